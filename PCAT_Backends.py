@@ -0,0 +1,798 @@
+'''
+GEOMETRY BACKENDS FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+Every geoprocessing step of the PCAT calculation goes through one of the backends below, so that the same
+calculation can run either with ArcGIS or, without an ArcGIS license, with open-source libraries:
+
+    "arcpy"     ArcpyBackend    wraps the arcpy geoprocessing tools the script has always used. Layers are
+                                dataset paths: intermediate layers are kept in the ArcGIS memory workspace, and
+                                only go to a scratch GeoPackage next to the output once the process uses more
+                                than its memory budget.
+    "open"      OpenBackend     pure Python engine built on Shapely (>= 2.0, STRtree-indexed overlays) for the
+                                geometry and Fiona for reading/writing shapefiles and GeoPackages. Layers are
+                                in-memory FeatureLayer objects.
+
+Both backends have the same operations:
+    Read, CreateOutput, WriteResults, SaveOutput                    (input/output)
+    SaveLayer, LoadLayer                                            (prepared layer cache, see PCAT_Cache.py)
+    PolygonToLine, Buffer, Erase, Intersect, Dissolve, Clip,
+    Simplify, ConvexHull, Merge, Explode, AddConstantField, AddValueField,
+    SpatialJoin, NearPairs                                          (geoprocessing)
+    Subset                                                          (features with the given key values)
+    ReadMeasure, ReadRings, ReadShapes                              (shape length in meters / area in acres, polygon vertices, WKB and envelopes)
+    ReadTable, SpatialReference                                     (attribute columns and coordinate system, for PCAT_Output.py)
+    Delete, Cleanup, Keep, Release                                  (temporary layers)
+    Describe                                                        (feature and vertex counts of a layer, for PCAT_Profile.py)
+
+The open backend can also write its output a chunk at a time (OpenOutput, WriteFeatures), for PCAT_Streaming.py.
+
+'''
+import os, sys, math, atexit, pickle, ctypes, collections
+import numpy
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+try:
+    import shapely
+    from shapely.strtree import STRtree
+except ImportError:
+    shapely = None
+
+try:
+    import fiona
+except ImportError:
+    fiona = None
+
+
+# #########################################################################
+# Units and Messages
+# #########################################################################
+
+SquareMetersPerAcre = 4046.8564224
+
+# Meters in one of each of the linear units accepted in a distance string such as "0.25 Miles"
+MetersPerUnit = {"METERS": 1.0, "METER": 1.0, "KILOMETERS": 1000.0, "KILOMETER": 1000.0,
+                 "FEET": 0.3048, "FOOT": 0.3048, "YARDS": 0.9144, "YARD": 0.9144,
+                 "MILES": 1609.344, "MILE": 1609.344, "DECIMETERS": 0.1, "CENTIMETERS": 0.01}
+
+
+# Converts a linear unit string ("402.3300", "0.25 Miles", "-25 Meters") into meters. A distance without a unit is taken to be in meters (the unit of the maps)
+def LinearUnitToMeters_Fnx(LinearUnit):
+    Parts = str(LinearUnit).split()
+    Distance = float(Parts[0])
+    if len(Parts) > 1:
+        Unit = Parts[1].upper()
+        if Unit not in MetersPerUnit:
+            raise ValueError("Unknown linear unit: " + str(LinearUnit))
+        Distance = Distance * MetersPerUnit[Unit]
+    return Distance
+
+
+# Segments per quarter circle for the arcs of a buffer of Radius meters to stay within MaxDeviation meters of the true circle (at most MaxSegments)
+def ArcSegments_Fnx(Radius, MaxDeviation, MaxSegments):
+    if MaxDeviation <= 0:
+        return MaxSegments
+    if MaxDeviation >= Radius:
+        return 1
+    return int(min(MaxSegments, max(1, math.ceil((math.pi / 4) / math.acos(1 - MaxDeviation / Radius)))))
+
+
+# Progress messages can be turned off (e.g. in the worker processes of PCAT_Parallel.py, which would otherwise repeat them for every tile)
+ShowMessages = True
+
+
+# Sends a progress message to the geoprocessing window, or to the console when running without arcpy
+def AddMessage(Message):
+    if not ShowMessages:
+        return
+    if arcpy is not None:
+        arcpy.AddMessage(Message)
+    else:
+        print(Message)
+
+
+# Sends an error message to the geoprocessing window, or to stderr when running without arcpy
+def AddError(Message):
+    if arcpy is not None:
+        arcpy.AddError(Message)
+    else:
+        sys.stderr.write(Message + "\n")
+
+
+# Resident memory of the process in MB (None where it cannot be read)
+def ResidentMB_Fnx():
+    try:
+        with open("/proc/self/status") as status:
+            for Line in status:
+                if Line.startswith("VmRSS:"):
+                    return int(Line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    if sys.platform == "win32":
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong), ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t), ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t), ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        Counters = ProcessMemoryCounters()
+        Counters.cb = ctypes.sizeof(Counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(Counters), Counters.cb):
+            return Counters.WorkingSetSize / (1024.0 ** 2)
+    return None
+
+
+# Name of a file or folder that belongs to the run writing nameOfOutputShapefile (its checkpoint folder, its scratch GeoPackage): <output>_<extension><Suffix>,
+# so that two runs writing the same analysis file in different output formats never share one
+def RunFileName_Fnx(nameOfOutputShapefile, Suffix):
+    OutputRoot, OutputExtension = os.path.splitext(nameOfOutputShapefile)
+    return OutputRoot + "_" + OutputExtension.lstrip(".").lower() + Suffix
+
+
+# Returns the backend for the requested engine ("arcpy" or "open"); MemoryBudgetMB is the memory the arcpy engine may use before its intermediate layers go to disk
+def GetBackend_Fnx(Engine, nameOfOutputShapefile, MemoryBudgetMB=4096):
+    if Engine == "arcpy":
+        return ArcpyBackend(nameOfOutputShapefile, MemoryBudgetMB)
+    if Engine == "open":
+        return OpenBackend(nameOfOutputShapefile)
+    raise ValueError("Unknown geometry engine: " + str(Engine) + " (use 'arcpy' or 'open')")
+
+
+# #########################################################################
+# ArcGIS Backend
+# #########################################################################
+
+class ArcpyBackend(object):
+    '''NOTES:
+        Layers are dataset paths. Every operation writes a new intermediate feature class (pcat_tempNN) and returns its path.
+        Intermediate feature classes go to the memory workspace ("memory" in ArcGIS Pro, "in_memory" in ArcMap) while the process uses less than MemoryBudgetMB,
+        and to a single scratch GeoPackage next to the output (<output>_<extension>_scratch.gpkg) after that, so a large dataset can not run the machine out of memory.
+        The output itself is also built in memory, and only written to disk once, by SaveOutput.
+        Intermediate feature classes are removed with Delete (or all at once with Cleanup, which also deletes the scratch GeoPackage, and runs at exit if a run fails).
+        Keep takes layers out of the intermediate feature classes, so that they stay through Cleanup (e.g. the prepared layers a batch reuses, see PCAT_Batch.py) until Release hands them back.
+    '''
+    Name = "arcpy"
+
+    def __init__(self, nameOfOutputShapefile, MemoryBudgetMB=4096):
+        if arcpy is None:
+            raise ImportError("The arcpy engine requires ArcGIS (arcpy could not be imported); use the open engine instead")
+
+        # Allow output to overwite any existing grid of the same name
+        arcpy.env.overwriteOutput = True
+
+        # This ensures that when using a table join the original field names will be use and not appended by the name of each of the joining fields
+        arcpy.env.qualifiedFieldNames = False
+
+        self.MemoryWorkspace = "memory" if arcpy.GetInstallInfo().get("ProductName") == "ArcGISPro" else "in_memory"
+        self.MemoryBudgetMB = MemoryBudgetMB
+        self.ScratchGeoPackage = RunFileName_Fnx(nameOfOutputShapefile, "_scratch.gpkg")
+        self.TempCount = 0
+        self.TempFiles = []
+        self.KeptFiles = []
+        atexit.register(self.Cleanup)
+
+    # Making Intermediate Feature Classes (in memory, or in the scratch GeoPackage once the process is over its memory budget)
+    def _Temp(self):
+        self.TempCount += 1
+        Name = "pcat_temp" + str(self.TempCount)
+        ResidentMB = ResidentMB_Fnx()
+        if ResidentMB is not None and ResidentMB > self.MemoryBudgetMB:
+            if not arcpy.Exists(self.ScratchGeoPackage):
+                AddMessage(" ... over the memory budget (" + str(int(ResidentMB)) + " MB), writing intermediate layers to " + self.ScratchGeoPackage)
+                arcpy.CreateSQLiteDatabase_management(self.ScratchGeoPackage, "GEOPACKAGE")
+            TempFile = os.path.join(self.ScratchGeoPackage, Name)
+        else:
+            TempFile = self.MemoryWorkspace + "\\" + Name
+        self.TempFiles.append(TempFile)
+        return TempFile
+
+    # ---- input/output ----
+
+    def Read(self, InputFile):
+        return InputFile
+
+    # Replicates the analysis file in memory, adds the output fields (Name, Type, Precision, Scale) and populates Match_ID with a sequential number (similar to FID)
+    def CreateOutput(self, AnalysisFile, nameOfOutputShapefile, OutputFields):
+        Output = self._Temp()
+        arcpy.CopyFeatures_management(AnalysisFile, Output)
+        for FieldName, FieldType, Precision, Scale in OutputFields:
+            arcpy.AddField_management(Output, FieldName, FieldType, Precision, Scale)
+        with arcpy.da.UpdateCursor(Output, ["Match_ID"]) as cursor:
+            for MatchID, row in enumerate(cursor, 1):
+                cursor.updateRow([MatchID])
+        return Output
+
+    # Writes every field of the results store into the output in one pass of an update cursor, matching rows on Match_ID
+    # (ExtendTable would only add new fields: the output fields already exist, from CreateOutput)
+    def WriteResults(self, OutputLayer, Results):
+        Fields = dict((Field.name, Field.type) for Field in arcpy.ListFields(OutputLayer))
+        FieldNames = [FieldName for FieldName in Results.FieldNames() if FieldName in Fields]
+        Columns = [Results.Get(FieldName) for FieldName in FieldNames]
+        Integers = [Fields[FieldName] in ("SmallInteger", "Integer") for FieldName in FieldNames]
+        with arcpy.da.UpdateCursor(OutputLayer, ["Match_ID"] + FieldNames) as cursor:
+            for row in cursor:
+                Position = Results.Positions([row[0]])[0]
+                Values = [Column[Position] for Column in Columns]
+                cursor.updateRow([row[0]] + [None if Value != Value else int(Value) if Integer else float(Value) for Value, Integer in zip(Values, Integers)])
+
+    # Writes the output as a shapefile, or as a GeoPackage (.gpkg) with one feature class named after the file
+    def SaveOutput(self, OutputLayer, nameOfOutputShapefile):
+        if OutputLayer != nameOfOutputShapefile:
+            if arcpy.Exists(nameOfOutputShapefile):
+                arcpy.Delete_management(nameOfOutputShapefile)
+            if nameOfOutputShapefile.lower().endswith(".gpkg"):
+                arcpy.CreateSQLiteDatabase_management(nameOfOutputShapefile, "GEOPACKAGE")
+                arcpy.CopyFeatures_management(OutputLayer, os.path.join(nameOfOutputShapefile, os.path.splitext(os.path.basename(nameOfOutputShapefile))[0]))
+                arcpy.ClearWorkspaceCache_management()
+            else:
+                arcpy.CopyFeatures_management(OutputLayer, nameOfOutputShapefile)
+        return nameOfOutputShapefile
+
+    # Saves a layer into a cache folder as <Name>.shp with a spatial index
+    def SaveLayer(self, Layer, Folder, Name):
+        Output = os.path.join(Folder, Name + ".shp")
+        arcpy.CopyFeatures_management(Layer, Output)
+        arcpy.AddSpatialIndex_management(Output)
+
+    def LoadLayer(self, Folder, Name):
+        Output = os.path.join(Folder, Name + ".shp")
+        if not arcpy.Exists(Output):
+            raise IOError("Missing cached layer: " + Output)
+        return Output
+
+    # ---- geoprocessing ----
+
+    def PolygonToLine(self, Layer):
+        Output = self._Temp()
+        arcpy.PolygonToLine_management(Layer, Output, "IGNORE_NEIGHBORS")
+        return Output
+
+    # LineSide is "FULL" or "OUTSIDE_ONLY"; negative distances shrink polygons (features that collapse are not written)
+    # With a MaxDeviation (a linear unit), the arcs are generalized to within that distance of the true circles (fewer vertices for the overlays that follow)
+    def Buffer(self, Layer, Distance, LineSide="FULL", MaxDeviation=None):
+        Output = self._Temp()
+        arcpy.Buffer_analysis(Layer, Output, Distance, LineSide, "ROUND", "NONE", "", "")
+        if MaxDeviation and LinearUnitToMeters_Fnx(MaxDeviation) > 0:
+            arcpy.Generalize_edit(Output, MaxDeviation)
+        return Output
+
+    # Topology-preserving simplification of polygons: vertices are removed while the boundary stays within Tolerance (a linear unit) of the original, without self-intersections
+    def Simplify(self, Layer, Tolerance):
+        Output = self._Temp()
+        if LinearUnitToMeters_Fnx(Tolerance) <= 0:
+            arcpy.CopyFeatures_management(Layer, Output)
+            return Output
+        arcpy.SimplifyPolygon_cartography(Layer, Output, "POINT_REMOVE", Tolerance, "0 SquareMeters", "RESOLVE_ERRORS", "NO_KEEP")
+        return Output
+
+    def Erase(self, Layer, EraseLayer, Tolerance=""):
+        Output = self._Temp()
+        arcpy.Erase_analysis(Layer, EraseLayer, Output, Tolerance)
+        return Output
+
+    # OutputType is "INPUT" (lowest dimension of the inputs) or "LINE"
+    def Intersect(self, Layer, OtherLayer, OutputType="INPUT"):
+        Output = self._Temp()
+        arcpy.Intersect_analysis([Layer, OtherLayer], Output, "", "", OutputType)
+        return Output
+
+    def Dissolve(self, Layer, DissolveField=None):
+        Output = self._Temp()
+        arcpy.Dissolve_management(Layer, Output, DissolveField or "", "", "MULTI_PART", "")
+        return Output
+
+    def Clip(self, Layer, ClipLayer):
+        Output = self._Temp()
+        arcpy.Clip_analysis(Layer, ClipLayer, Output)
+        return Output
+
+    # Convex hull around all of the features of the layer together
+    def ConvexHull(self, Layer):
+        Output = self._Temp()
+        arcpy.MinimumBoundingGeometry_management(Layer, Output, "CONVEX_HULL", "ALL")
+        return Output
+
+    def Merge(self, Layers):
+        Output = self._Temp()
+        arcpy.Merge_management(Layers, Output)
+        return Output
+
+    # Splits multipart features into one feature per part
+    def Explode(self, Layer):
+        Output = self._Temp()
+        arcpy.MultipartToSinglepart_management(Layer, Output)
+        return Output
+
+    # Adds a LONG field with the same value on every feature (the layer is changed in place, so only use this on temporary layers)
+    def AddConstantField(self, Layer, FieldName, Value):
+        arcpy.AddField_management(Layer, FieldName, "LONG", 8)
+        arcpy.CalculateField_management(Layer, FieldName, str(Value), "PYTHON_9.3")
+        return Layer
+
+    # Adds a LONG field with the value of each feature, matched by the keys of ReadShapes (OIDs); features without a value get Default (changed in place, like AddConstantField)
+    def AddValueField(self, Layer, FieldName, Keys, Values, Default=-1):
+        ValueOf = dict(zip(numpy.asarray(Keys).tolist(), numpy.asarray(Values).tolist()))
+        arcpy.AddField_management(Layer, FieldName, "LONG", 8)
+        with arcpy.da.UpdateCursor(Layer, ["OID@", FieldName]) as cursor:
+            for row in cursor:
+                cursor.updateRow([row[0], ValueOf.get(row[0], Default)])
+        return Layer
+
+    # Returns (KeyField values of the target features, number of join features intersecting each of them)
+    def SpatialJoin(self, TargetLayer, JoinLayer, KeyField):
+        Output = self._Temp()
+        arcpy.SpatialJoin_analysis(TargetLayer, JoinLayer, Output, "JOIN_ONE_TO_ONE", "KEEP_ALL", "", "INTERSECT", "", "")
+        Array = arcpy.da.FeatureClassToNumPyArray(Output, [KeyField, "Join_Count"], null_value=0)
+        self.Delete(Output)
+        return Array[KeyField].astype(numpy.int64), Array["Join_Count"].astype(numpy.int64)
+
+    # Returns (first keys, second keys, distances in meters) of every pair of features of the layer within Distance of each other (keys as in ReadShapes: OIDs), each pair once
+    def NearPairs(self, Layer, Distance):
+        Output = self._Temp()
+        arcpy.GenerateNearTable_analysis(Layer, Layer, Output, Distance, "NO_LOCATION", "NO_ANGLE", "ALL")
+        Array = arcpy.da.TableToNumPyArray(Output, ["IN_FID", "NEAR_FID", "NEAR_DIST"])
+        self.Delete(Output)
+        Once = Array["IN_FID"] < Array["NEAR_FID"]
+        return Array["IN_FID"][Once].astype(numpy.int64), Array["NEAR_FID"][Once].astype(numpy.int64), Array["NEAR_DIST"][Once].astype(float)
+
+    # New layer with only the features whose KeyField value is in Keys
+    def Subset(self, Layer, KeyField, Keys):
+        Output = self._Temp()
+        WhereClause = arcpy.AddFieldDelimiters(Layer, KeyField) + " IN (" + ",".join(str(int(Key)) for Key in Keys) + ")" if len(Keys) else "1 = 0"
+        arcpy.Select_analysis(Layer, Output, WhereClause)
+        return Output
+
+    # ---- measurements ----
+
+    # Returns (KeyFields values as an integer array with one column per key field, "AREA" in acres or "LENGTH" in meters) for every feature with a geometry
+    def ReadMeasure(self, Layer, KeyFields, Measure):
+        Keys = []
+        Values = []
+        with arcpy.da.SearchCursor(Layer, list(KeyFields) + ["SHAPE@"]) as cursor:
+            for row in cursor:
+                Shape = row[-1]
+                if Shape is None:
+                    continue
+                Keys.append(row[:-1])
+                if Measure == "AREA":
+                    Values.append(Shape.getArea("PLANAR", "ACRES"))
+                else:
+                    Values.append(Shape.getLength("PLANAR", "METERS"))
+        return numpy.array(Keys, dtype=numpy.int64).reshape(-1, len(KeyFields)), numpy.array(Values, dtype=float)
+
+    # Returns the vertices of every polygon ring (closed), the ring number of each vertex, and the KeyField value (or OID) of each ring
+    def ReadRings(self, Layer, KeyField=None):
+        Coordinates, RingIDs, RingKeys = [], [], []
+        with arcpy.da.SearchCursor(Layer, [KeyField or "OID@", "SHAPE@"]) as cursor:
+            for Key, Shape in cursor:
+                if Shape is None:
+                    continue
+                for Part in Shape:
+                    # Within a part, a None point separates the rings (the exterior ring first, then the holes)
+                    Ring = []
+                    for Point in list(Part) + [None]:
+                        if Point is not None:
+                            Ring.append((Point.X, Point.Y))
+                        elif Ring:
+                            if Ring[0] != Ring[-1]:
+                                Ring.append(Ring[0])
+                            Coordinates.extend(Ring)
+                            RingIDs.extend([len(RingKeys)] * len(Ring))
+                            RingKeys.append(Key)
+                            Ring = []
+        return numpy.array(Coordinates, dtype=float).reshape(-1, 2), numpy.array(RingIDs, dtype=numpy.int64), numpy.array(RingKeys, dtype=numpy.int64)
+
+    # Returns (KeyField values (or OIDs), WKB of every shape (None for a null shape), envelopes as XMin, YMin, XMax, YMax rows (NaN for a null shape))
+    def ReadShapes(self, Layer, KeyField=None):
+        Keys, Shapes, Bounds = [], [], []
+        with arcpy.da.SearchCursor(Layer, [KeyField or "OID@", "SHAPE@"]) as cursor:
+            for Key, Shape in cursor:
+                Keys.append(Key)
+                if Shape is None:
+                    Shapes.append(None)
+                    Bounds.append([numpy.nan] * 4)
+                else:
+                    Shapes.append(bytes(Shape.WKB))
+                    Bounds.append([Shape.extent.XMin, Shape.extent.YMin, Shape.extent.XMax, Shape.extent.YMax])
+        return numpy.array(Keys, dtype=numpy.int64), Shapes, numpy.array(Bounds, dtype=float).reshape(-1, 4)
+
+    # Returns {FieldName: object array} of every attribute field (not the geometry, object id or shape measure fields), in the same order as ReadShapes
+    def ReadTable(self, Layer):
+        Description = arcpy.Describe(Layer)
+        Skipped = [getattr(Description, "areaFieldName", ""), getattr(Description, "lengthFieldName", "")]
+        FieldNames = [Field.name for Field in arcpy.ListFields(Layer) if Field.type not in ("OID", "Geometry", "GlobalID", "Blob", "Raster") and Field.name not in Skipped]
+        Rows = list(arcpy.da.SearchCursor(Layer, FieldNames)) if FieldNames else []
+        return collections.OrderedDict((FieldName, numpy.array([Row[Position] for Row in Rows], dtype=object)) for Position, FieldName in enumerate(FieldNames))
+
+    # Returns the coordinate system of a layer as WKT (None when it has none)
+    def SpatialReference(self, Layer):
+        SpatialReference = arcpy.Describe(Layer).spatialReference
+        return SpatialReference.exportToString() if SpatialReference is not None and SpatialReference.name != "Unknown" else None
+
+    # Returns (number of features, number of vertices) of a layer, or None when Value is not a layer (e.g. a distance)
+    def Describe(self, Value):
+        if not isinstance(Value, str) or (Value not in self.TempFiles and os.path.splitext(Value)[1].lower() not in (".shp", ".gpkg")) or not arcpy.Exists(Value):
+            return None
+        Features = Vertices = 0
+        with arcpy.da.SearchCursor(Value, ["SHAPE@"]) as cursor:
+            for (Shape,) in cursor:
+                Features += 1
+                Vertices += Shape.pointCount if Shape is not None else 0
+        return Features, Vertices
+
+    # ---- temporary layers ----
+
+    def Delete(self, *Layers):
+        for Layer in Layers:
+            if Layer in self.TempFiles:
+                arcpy.Delete_management(Layer)
+                self.TempFiles.remove(Layer)
+
+    def Keep(self, *Layers):
+        for Layer in Layers:
+            if isinstance(Layer, str) and Layer in self.TempFiles:
+                self.TempFiles.remove(Layer)
+                self.KeptFiles.append(Layer)
+
+    def Release(self, *Layers):
+        for Layer in Layers:
+            if isinstance(Layer, str) and Layer in self.KeptFiles:
+                self.KeptFiles.remove(Layer)
+                self.TempFiles.append(Layer)
+
+    def Cleanup(self):
+        self.Delete(*list(self.TempFiles))
+        # (the scratch GeoPackage stays while it holds kept layers)
+        if arcpy.Exists(self.ScratchGeoPackage) and not any(Layer.startswith(self.ScratchGeoPackage) for Layer in self.KeptFiles):
+            arcpy.Delete_management(self.ScratchGeoPackage)
+        #Cleaning any cached memory (seemed to help prevent errors of overwriting internal variables)
+        arcpy.ClearWorkspaceCache_management()
+
+
+# #########################################################################
+# Open-Source Backend (Shapely + Fiona)
+# #########################################################################
+
+# In-memory feature class used by the open backend: an array of Shapely geometries plus one array per attribute field
+class FeatureLayer(object):
+    def __init__(self, Geometries, Fields=None, Crs=None, Schema=None, Driver=None):
+        self.Geometries = numpy.asarray(Geometries, dtype=object)
+        self.Fields = collections.OrderedDict(Fields or [])
+        self.Crs = Crs
+        self.Schema = Schema
+        self.Driver = Driver
+
+    def __len__(self):
+        return len(self.Geometries)
+
+    # STRtree spatial index of the geometries, built the first time it is needed and kept with the layer
+    def Tree(self):
+        if getattr(self, "_Tree", None) is None:
+            self._Tree = STRtree(self.Geometries)
+        return self._Tree
+
+    # The spatial index is not pickled (it is rebuilt from the geometries when needed)
+    def __getstate__(self):
+        State = dict(self.__dict__)
+        State.pop("_Tree", None)
+        return State
+
+    # New layer with only the features at Indices (and optionally new geometries for them)
+    def Take(self, Indices, Geometries=None):
+        Indices = numpy.asarray(Indices, dtype=numpy.intp)
+        if Geometries is None:
+            Geometries = self.Geometries[Indices]
+        Fields = [(Name, numpy.asarray(Values, dtype=object)[Indices]) for Name, Values in self.Fields.items()]
+        Layer = FeatureLayer(Geometries, Fields, self.Crs, self.Schema, self.Driver)
+        # (a subset of the output keeps its output fields, so that it can be saved as an output itself)
+        if hasattr(self, "OutputFields"):
+            Layer.OutputFields = self.OutputFields
+        return Layer
+
+
+class OpenBackend(object):
+    '''NOTES:
+        Layers are FeatureLayer objects held in memory; the inputs must be in a projected coordinate system in meters (the same assumption the arcpy version makes about the maps).
+        Overlays (Erase, Intersect, Clip, SpatialJoin) only compare features whose envelopes overlap, using a Shapely STRtree built on the second layer.
+        ROUND buffers are approximated with QuadSegs segments per quarter circle. 32 keeps the 2 mile rings within about a meter of a true circle, close to the ArcGIS buffers.
+        Features whose geometry becomes empty (e.g. a negative buffer that collapses a polygon) are dropped, as ArcGIS does.
+    '''
+    Name = "open"
+    QuadSegs = 32
+
+    def __init__(self, nameOfOutputShapefile):
+        if shapely is None or fiona is None:
+            raise ImportError("The open engine requires shapely (>= 2.0) and fiona")
+
+    # ---- input/output ----
+
+    def Read(self, InputFile):
+        if isinstance(InputFile, FeatureLayer):
+            return InputFile
+        Geometries = []
+        with fiona.open(InputFile) as source:
+            FieldNames = list(source.schema["properties"].keys())
+            Fields = collections.OrderedDict((Name, []) for Name in FieldNames)
+            for feature in source:
+                Geometry = feature["geometry"]
+                Geometries.append(shapely.geometry.shape(Geometry) if Geometry is not None else None)
+                Properties = feature["properties"]
+                for Name in FieldNames:
+                    Fields[Name].append(Properties[Name])
+            Layer = FeatureLayer(Geometries, [(Name, numpy.array(Values, dtype=object)) for Name, Values in Fields.items()],
+                                 source.crs, source.schema, source.driver)
+        return Layer
+
+    # Replicates the analysis file in memory, adds the output fields and populates Match_ID (similar to FID)
+    def CreateOutput(self, AnalysisFile, nameOfOutputShapefile, OutputFields):
+        Output = self.Read(AnalysisFile)
+        Output = Output.Take(numpy.arange(len(Output)))
+        Output.OutputFields = list(OutputFields)
+        for FieldName, FieldType, Precision, Scale in OutputFields:
+            Output.Fields[FieldName] = numpy.full(len(Output), None, dtype=object)
+        Output.Fields["Match_ID"] = numpy.arange(1, len(Output) + 1, dtype=numpy.int64)
+        return Output
+
+    def WriteResults(self, OutputLayer, Results):
+        Positions = Results.Positions(OutputLayer.Fields["Match_ID"])
+        for FieldName in Results.FieldNames():
+            OutputLayer.Fields[FieldName] = Results.Get(FieldName)[Positions]
+
+    # Writes the output as a shapefile (.shp) or GeoPackage (.gpkg), chosen by the extension
+    def SaveOutput(self, OutputLayer, nameOfOutputShapefile):
+        with self.OpenOutput(OutputLayer.Schema, OutputLayer.Crs, getattr(OutputLayer, "OutputFields", []), nameOfOutputShapefile) as sink:
+            self.WriteFeatures(sink, OutputLayer)
+        return nameOfOutputShapefile
+
+    # Opens the output for writing (the input schema plus OutputFields); the features are then written with WriteFeatures, all at once or a chunk at a time (see PCAT_Streaming.py)
+    def OpenOutput(self, InputSchema, Crs, OutputFields, nameOfOutputShapefile):
+        Driver = "GPKG" if nameOfOutputShapefile.lower().endswith(".gpkg") else "ESRI Shapefile"
+        FieldTypes = {"LONG": "int", "SHORT": "int", "DOUBLE": "float", "FLOAT": "float", "TEXT": "str"}
+        Properties = collections.OrderedDict(InputSchema["properties"])
+        for FieldName, FieldType, Precision, Scale in OutputFields:
+            Properties[FieldName] = FieldTypes.get(FieldType.upper(), "float")
+        Schema = {"geometry": InputSchema["geometry"], "properties": Properties}
+
+        if os.path.exists(nameOfOutputShapefile) and Driver == "GPKG":
+            os.remove(nameOfOutputShapefile)
+        return fiona.open(nameOfOutputShapefile, "w", driver=Driver, crs=Crs, schema=Schema)
+
+    def WriteFeatures(self, sink, Layer):
+        FieldNames = list(sink.schema["properties"].keys())
+        Records = []
+        for Position, Geometry in enumerate(Layer.Geometries):
+            Record = {}
+            for Name in FieldNames:
+                Value = Layer.Fields[Name][Position] if Name in Layer.Fields else None
+                Record[Name] = _PlainValue(Value)
+            Records.append({"geometry": shapely.geometry.mapping(Geometry) if Geometry is not None else None,
+                            "properties": Record})
+        sink.writerecords(Records)
+
+    # Saves a layer into a cache folder as <Name>.pkl (a pickle of the FeatureLayer; its spatial index is rebuilt when loaded)
+    def SaveLayer(self, Layer, Folder, Name):
+        with open(os.path.join(Folder, Name + ".pkl"), "wb") as sink:
+            pickle.dump(Layer, sink, pickle.HIGHEST_PROTOCOL)
+
+    def LoadLayer(self, Folder, Name):
+        with open(os.path.join(Folder, Name + ".pkl"), "rb") as source:
+            Layer = pickle.load(source)
+        Layer.Tree()
+        return Layer
+
+    # ---- geoprocessing ----
+
+    def PolygonToLine(self, Layer):
+        return self._Result(Layer, numpy.arange(len(Layer)), shapely.boundary(Layer.Geometries))
+
+    def Buffer(self, Layer, Distance, LineSide="FULL", MaxDeviation=None):
+        Meters = LinearUnitToMeters_Fnx(Distance)
+        QuadSegs = self.QuadSegs if not MaxDeviation else ArcSegments_Fnx(abs(Meters), LinearUnitToMeters_Fnx(MaxDeviation), self.QuadSegs)
+        Geometries = shapely.buffer(Layer.Geometries, Meters, quad_segs=QuadSegs)
+        if LineSide == "OUTSIDE_ONLY":
+            Geometries = shapely.difference(Geometries, Layer.Geometries)
+        return self._Result(Layer, numpy.arange(len(Layer)), Geometries)
+
+    # Douglas-Peucker simplification that keeps every ring valid (no self-intersections or collapsed holes)
+    def Simplify(self, Layer, Tolerance):
+        return self._Result(Layer, numpy.arange(len(Layer)), shapely.simplify(Layer.Geometries, LinearUnitToMeters_Fnx(Tolerance), preserve_topology=True))
+
+    # The cluster tolerance is not used; Shapely overlays are exact to floating point precision
+    def Erase(self, Layer, EraseLayer, Tolerance=""):
+        Geometries = Layer.Geometries.copy()
+        for Position, Candidates in self._Candidates(Layer, EraseLayer).items():
+            Geometries[Position] = shapely.difference(Geometries[Position], shapely.union_all(EraseLayer.Geometries[Candidates]))
+        return self._Result(Layer, numpy.arange(len(Layer)), Geometries)
+
+    def Intersect(self, Layer, OtherLayer, OutputType="INPUT"):
+        Pairs = self._Pairs(Layer, OtherLayer)
+        Geometries = shapely.intersection(Layer.Geometries[Pairs[0]], OtherLayer.Geometries[Pairs[1]])
+        if OutputType == "LINE":
+            Dimension = 1
+        else:
+            Dimension = min(_Dimension(Layer), _Dimension(OtherLayer))
+        Geometries = numpy.array([_KeepDimension(Geometry, Dimension) for Geometry in Geometries], dtype=object)
+
+        Result = Layer.Take(Pairs[0], Geometries)
+        for Name, Values in OtherLayer.Fields.items():
+            OutputName = Name if Name not in Result.Fields else Name + "_1"
+            Result.Fields[OutputName] = numpy.asarray(Values, dtype=object)[Pairs[1]]
+        return self._DropEmpty(Result)
+
+    def Dissolve(self, Layer, DissolveField=None):
+        if DissolveField is None:
+            return FeatureLayer([shapely.union_all(Layer.Geometries)], [], Layer.Crs)
+        Groups = collections.OrderedDict()
+        for Position, Key in enumerate(Layer.Fields[DissolveField]):
+            Groups.setdefault(Key, []).append(Position)
+        Geometries = [shapely.union_all(Layer.Geometries[Positions]) for Positions in Groups.values()]
+        return FeatureLayer(Geometries, [(DissolveField, numpy.array(list(Groups.keys()), dtype=object))], Layer.Crs)
+
+    def Clip(self, Layer, ClipLayer):
+        Dimension = _Dimension(Layer)
+        Candidates = self._Candidates(Layer, ClipLayer)
+        Positions = numpy.array(sorted(Candidates.keys()), dtype=numpy.intp)
+        Geometries = [_KeepDimension(shapely.intersection(Layer.Geometries[Position], shapely.union_all(ClipLayer.Geometries[Candidates[Position]])), Dimension)
+                      for Position in Positions]
+        return self._DropEmpty(Layer.Take(Positions, numpy.array(Geometries, dtype=object)))
+
+    def ConvexHull(self, Layer):
+        Points = shapely.multipoints(shapely.get_coordinates(Layer.Geometries))
+        return FeatureLayer([shapely.convex_hull(Points)], [], Layer.Crs)
+
+    def Merge(self, Layers):
+        FieldNames = []
+        for Layer in Layers:
+            FieldNames.extend(Name for Name in Layer.Fields if Name not in FieldNames)
+        Geometries = numpy.concatenate([Layer.Geometries for Layer in Layers])
+        Fields = [(Name, numpy.concatenate([numpy.asarray(Layer.Fields[Name], dtype=object) if Name in Layer.Fields
+                                            else numpy.full(len(Layer), None, dtype=object) for Layer in Layers]))
+                  for Name in FieldNames]
+        return FeatureLayer(Geometries, Fields, Layers[0].Crs if Layers else None)
+
+    def Explode(self, Layer):
+        Parts, PartFeatures = shapely.get_parts(Layer.Geometries, return_index=True)
+        return self._Result(Layer, PartFeatures, Parts)
+
+    def AddConstantField(self, Layer, FieldName, Value):
+        Result = Layer.Take(numpy.arange(len(Layer)))
+        Result.Fields[FieldName] = numpy.full(len(Layer), Value, dtype=object)
+        return Result
+
+    # (the keys are positions, as in ReadShapes)
+    def AddValueField(self, Layer, FieldName, Keys, Values, Default=-1):
+        Result = Layer.Take(numpy.arange(len(Layer)))
+        Result.Fields[FieldName] = numpy.full(len(Layer), Default, dtype=object)
+        Result.Fields[FieldName][numpy.asarray(Keys, dtype=numpy.intp)] = numpy.asarray(Values)
+        return Result
+
+    def SpatialJoin(self, TargetLayer, JoinLayer, KeyField):
+        Pairs = self._Pairs(TargetLayer, JoinLayer)
+        JoinCounts = numpy.bincount(Pairs[0], minlength=len(TargetLayer))
+        return numpy.asarray(TargetLayer.Fields[KeyField], dtype=numpy.int64), JoinCounts.astype(numpy.int64)
+
+    def NearPairs(self, Layer, Distance):
+        if len(Layer) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        Pairs = Layer.Tree().query(Layer.Geometries, predicate="dwithin", distance=LinearUnitToMeters_Fnx(Distance))
+        Pairs = Pairs[:, Pairs[0] < Pairs[1]]
+        Pairs = Pairs[:, numpy.lexsort((Pairs[1], Pairs[0]))]
+        return Pairs[0].astype(numpy.int64), Pairs[1].astype(numpy.int64), shapely.distance(Layer.Geometries[Pairs[0]], Layer.Geometries[Pairs[1]])
+
+    def Subset(self, Layer, KeyField, Keys):
+        return Layer.Take(numpy.flatnonzero(numpy.isin(numpy.asarray(Layer.Fields[KeyField], dtype=numpy.int64), Keys)))
+
+    # ---- measurements ----
+
+    def ReadMeasure(self, Layer, KeyFields, Measure):
+        Values = self._Measure(Layer, Measure)
+        Keep = ~numpy.isnan(Values)
+        Keys = numpy.column_stack([numpy.asarray(Layer.Fields[Name], dtype=numpy.int64) for Name in KeyFields]) if len(Layer) and len(KeyFields) else numpy.zeros((len(Layer), len(KeyFields)), dtype=numpy.int64)
+        return Keys[Keep], Values[Keep]
+
+    def ReadRings(self, Layer, KeyField=None):
+        Keys = numpy.asarray(Layer.Fields[KeyField], dtype=numpy.int64) if KeyField else numpy.arange(len(Layer))
+        Parts, PartFeatures = shapely.get_parts(Layer.Geometries, return_index=True)
+        Polygons = shapely.get_type_id(Parts) == 3
+        Rings, RingParts = shapely.get_rings(Parts[Polygons], return_index=True)
+        Coordinates, RingIDs = shapely.get_coordinates(Rings, return_index=True)
+        return Coordinates, RingIDs.astype(numpy.int64), Keys[PartFeatures[Polygons][RingParts]]
+
+    def ReadShapes(self, Layer, KeyField=None):
+        Keys = numpy.asarray(Layer.Fields[KeyField], dtype=numpy.int64) if KeyField else numpy.arange(len(Layer))
+        return Keys, list(shapely.to_wkb(Layer.Geometries)), shapely.bounds(Layer.Geometries).reshape(-1, 4)
+
+    def ReadTable(self, Layer):
+        return collections.OrderedDict((FieldName, numpy.asarray(Values, dtype=object)) for FieldName, Values in Layer.Fields.items())
+
+    def SpatialReference(self, Layer):
+        return Layer.Crs.to_wkt() if Layer.Crs else None
+
+    def Describe(self, Value):
+        if not isinstance(Value, FeatureLayer):
+            return None
+        return len(Value), int(shapely.get_num_coordinates(Value.Geometries).sum())
+
+    # ---- temporary layers ----
+
+    # In-memory layers are released when they are no longer referenced
+    def Delete(self, *Layers):
+        pass
+
+    def Cleanup(self):
+        pass
+
+    def Keep(self, *Layers):
+        pass
+
+    def Release(self, *Layers):
+        pass
+
+    # ---- helpers ----
+
+    def _Measure(self, Layer, Measure):
+        if Measure == "AREA":
+            return shapely.area(Layer.Geometries).astype(float) / SquareMetersPerAcre
+        return shapely.length(Layer.Geometries).astype(float)
+
+    # Index pairs [[layer positions], [other layer positions]] of intersecting features, from an STRtree on the other layer
+    '''NOTES:
+        The pairs are sorted (by layer position, then other layer position) rather than left in tree order, so that overlay results and the order they are summed in
+        do not depend on how the tree was built. This is what makes a calculation on a subset of the layers (PCAT_Parallel.py) give exactly the same values.
+    '''
+    def _Pairs(self, Layer, OtherLayer):
+        if len(Layer) == 0 or len(OtherLayer) == 0:
+            return numpy.zeros((2, 0), dtype=numpy.intp)
+        Pairs = OtherLayer.Tree().query(Layer.Geometries, predicate="intersects")
+        return Pairs[:, numpy.lexsort((Pairs[1], Pairs[0]))]
+
+    # {layer position: array of intersecting other layer positions}
+    def _Candidates(self, Layer, OtherLayer):
+        Pairs = self._Pairs(Layer, OtherLayer)
+        Candidates = collections.OrderedDict()
+        if Pairs.shape[1] == 0:
+            return Candidates
+        Order = numpy.argsort(Pairs[0], kind="stable")
+        Positions, Starts = numpy.unique(Pairs[0][Order], return_index=True)
+        for Position, Group in zip(Positions, numpy.split(Pairs[1][Order], Starts[1:])):
+            Candidates[int(Position)] = Group
+        return Candidates
+
+    def _Result(self, Layer, Positions, Geometries):
+        return self._DropEmpty(Layer.Take(Positions, numpy.asarray(Geometries, dtype=object)))
+
+    def _DropEmpty(self, Layer):
+        Keep = numpy.flatnonzero(~(shapely.is_missing(Layer.Geometries) | shapely.is_empty(Layer.Geometries)))
+        if len(Keep) == len(Layer):
+            return Layer
+        return Layer.Take(Keep)
+
+
+# Topological dimension of a layer (0 points, 1 lines, 2 polygons), from its first feature
+def _Dimension(Layer):
+    for Geometry in Layer.Geometries:
+        if Geometry is not None and not Geometry.is_empty:
+            return shapely.get_dimensions(Geometry)
+    return 2
+
+
+# Keeps only the parts of an overlay result with the requested dimension (e.g. drops the points where a line touches a polygon)
+def _KeepDimension(Geometry, Dimension):
+    if Geometry is None or Geometry.is_empty:
+        return None
+    if Geometry.geom_type != "GeometryCollection":
+        return Geometry if shapely.get_dimensions(Geometry) == Dimension else None
+    Parts = [Part for Part in shapely.get_parts(Geometry) if shapely.get_dimensions(Part) == Dimension and not Part.is_empty]
+    if not Parts:
+        return None
+    return shapely.union_all(Parts)
+
+
+# Converts numpy scalars to plain Python values for writing (NaN is written as null)
+def _PlainValue(Value):
+    if isinstance(Value, numpy.generic):
+        Value = Value.item()
+    if isinstance(Value, float) and Value != Value:
+        return None
+    return Value
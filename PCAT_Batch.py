@@ -0,0 +1,365 @@
+'''
+BATCH RUNNER AND WARM WORKER FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+Scoring many analysis files (one per county, one per planning scenario ...) against the same context and exclusion
+repeats the slowest part of every run: reading the context and exclusion and preparing the layers that only depend
+on them (PrepareLayers_Fnx), along with starting Python and loading the geometry libraries. This module runs many
+analysis files in one process and keeps the prepared layers (and, with the open engine, their STRtree spatial
+indexes) in memory between them:
+
+    run         runs every job of a manifest, then exits
+    worker      keeps running, and runs the job files that appear in a queue folder
+    submit      adds the jobs of a manifest to a queue folder, one job file each
+
+A job is a set of RunPCAT_Fnx parameters (ContextFile, AnalysisFile, ExclusionFile, Width, Engine, ...). A manifest
+is either a JSON file, with "defaults" shared by every job and a list of "jobs":
+
+    {"defaults": {"ContextFile": "context.shp", "ExclusionFile": "water.shp", "Engine": "open"},
+     "jobs": [{"AnalysisFile": "county1.shp"}, {"AnalysisFile": "county2.shp", "Width": "50 Meters"}]}
+
+(a plain list of jobs works as well), or a CSV file with one job per row and one parameter per column (empty cells
+take the default). Relative paths are relative to the manifest. The prepared layers are reused when a job has the
+same context and exclusion files (unchanged since they were prepared), engine, width, connectivity method and cell
+size as an earlier job; the jobs of a manifest run grouped by these so that every group is prepared once. The output of
+a job is named after its analysis file (see OutputName_Fnx), so a manifest where two jobs would write the same output
+(e.g. two widths for the same analysis file) is rejected.
+
+Queue folder: the worker claims a job file by moving it into <queue>/running, and moves it into <queue>/done or
+<queue>/failed with the result (output, seconds, and the error for failed jobs) added. Several workers can share a
+queue folder. A file named STOP in the queue folder stops the workers once their current jobs are done.
+
+The open engine keeps the prepared layers warm most cheaply; with the arcpy engine they are kept in the memory
+workspace (see ArcpyBackend.Keep).
+
+To use from the command line:
+    python PCAT_Batch.py run manifest.json [--report batch_report.json]
+    python PCAT_Batch.py worker queue_folder
+    python PCAT_Batch.py submit queue_folder manifest.json
+
+'''
+import os, sys, csv, json, time, uuid, inspect, argparse, traceback, collections
+
+import PCAT_Backends
+import PCAT_Profile
+from PCAT_Backends import AddMessage
+import TNC_ArcPyConservationTool as PCAT
+
+
+# Parameters of RunPCAT_Fnx a job can set (the others are passed by the batch itself)
+JobParameters = [Name for Name in inspect.signature(PCAT.RunPCAT_Fnx).parameters if Name not in ("Backend", "PreparedStore")]
+# Parameters that are file or folder names, and are relative to the manifest
+PathParameters = ["ContextFile", "AnalysisFile", "ExclusionFile", "Workspace", "CacheFolder", "MetricsCacheFile", "MetricsTable", "ProfileFile", "CProfileFolder", "GapGraphFile"]
+# Parameters that are whole numbers (CSV cells are read as text)
+IntegerParameters = ["CacheMaxMB", "Workers", "Tiles", "MemoryBudgetMB", "ChunkSize", "TopK", "PreviewSample", "GeneralizeSample"]
+# Parameters that are true or false
+BooleanParameters = ["Resume", "Checkpoints"]
+# Parameters that are lists (separated by ";" in CSV cells)
+ListParameters = ["SweepWidths"]
+# Parameters that decide whether the prepared layers of an earlier job can be reused
+WarmParameters = ["ContextFile", "ExclusionFile", "Engine", "Width", "ConnectivityMethod", "CellSize"]
+
+
+# #########################################################################
+# Manifests
+# #########################################################################
+
+# Reads a JSON or CSV manifest; returns a list of jobs (dictionaries of RunPCAT_Fnx parameters, with the defaults filled in)
+def ReadManifest_Fnx(ManifestFile):
+    Folder = os.path.dirname(os.path.abspath(ManifestFile))
+    if os.path.splitext(ManifestFile)[1].lower() == ".csv":
+        Defaults = {}
+        with open(ManifestFile, newline="") as table:
+            Jobs = [dict((Name, Value) for Name, Value in Row.items() if Name and Value not in (None, "")) for Row in csv.DictReader(table)]
+    else:
+        with open(ManifestFile) as manifest:
+            Content = json.load(manifest)
+        if isinstance(Content, list):
+            Defaults, Jobs = {}, Content
+        else:
+            Defaults, Jobs = Content.get("defaults", {}), Content.get("jobs", [Content])
+
+    Jobs = [CheckJob_Fnx(dict(Defaults, **Job), Folder) for Job in Jobs]
+
+    # Jobs writing the same output would overwrite each other (and share its checkpoint folder and scratch GeoPackage, which are named after the output)
+    Outputs = {}
+    for Job in Jobs:
+        Output = os.path.normcase(os.path.abspath(PCAT.OutputName_Fnx(Job["AnalysisFile"], Job.get("OutputFormat"), Job.get("TopK"), Job.get("Preview"))))
+        if Output in Outputs:
+            raise ValueError("The jobs " + Outputs[Output] + " and " + Job["Name"] + " would both write " + Output +
+                             " (put the analysis file of one of them under another name, or give them different OutputFormats, which also gives them separate checkpoint folders)")
+        Outputs[Output] = Job["Name"]
+    return Jobs
+
+
+# Checks the parameter names of a job, converts the whole numbers, true/false values and lists and makes the paths absolute (relative to Folder)
+def CheckJob_Fnx(Job, Folder):
+    Name = Job.pop("Name", None)
+    Unknown = [Parameter for Parameter in Job if Parameter not in JobParameters]
+    if Unknown:
+        raise ValueError("Unknown job parameter(s): " + ", ".join(Unknown) + " (use the parameter names of RunPCAT_Fnx: " + ", ".join(JobParameters) + ")")
+    for Parameter in ("ContextFile", "AnalysisFile", "ExclusionFile"):
+        if not Job.get(Parameter):
+            raise ValueError("Every job needs a " + Parameter)
+    for Parameter in IntegerParameters:
+        if Job.get(Parameter) is not None:
+            Job[Parameter] = int(Job[Parameter])
+    for Parameter in BooleanParameters:
+        if isinstance(Job.get(Parameter), str):
+            Job[Parameter] = Job[Parameter].strip().lower() in ("1", "true", "yes")
+    for Parameter in ListParameters:
+        if isinstance(Job.get(Parameter), str):
+            Job[Parameter] = [Value.strip() for Value in Job[Parameter].split(";") if Value.strip()]
+    for Parameter in PathParameters:
+        if Job.get(Parameter):
+            Job[Parameter] = os.path.join(Folder, Job[Parameter])
+    Job["Name"] = Name or os.path.splitext(os.path.basename(Job["AnalysisFile"]))[0]
+    return Job
+
+
+# The key that groups jobs whose prepared layers are the same
+def _WarmKey(Job):
+    Defaults = inspect.signature(PCAT.RunPCAT_Fnx).parameters
+    return tuple(str(Job.get(Parameter, Defaults[Parameter].default)) for Parameter in WarmParameters)
+
+
+# #########################################################################
+# Keeping the Prepared Layers
+# #########################################################################
+
+class PreparedStore(object):
+    '''NOTES:
+        Keeps the prepared layers (see PrepareLayers_Fnx) of the last MaxEntries combinations of context and exclusion files and preparation parameters.
+        The files are recognized by their path, size and modification time, so a file that is changed between jobs is prepared again.
+        The layers are kept through the Cleanup at the end of every run (Backend.Keep), and handed back to the backend to delete when they drop out of the store.
+    '''
+    def __init__(self, MaxEntries=2):
+        self.MaxEntries = max(1, MaxEntries)
+        self.Entries = collections.OrderedDict()
+        self.Hits = 0
+        self.Misses = 0
+
+    def Get(self, Backend, ContextFile, ExclusionFile, Width, Cache=None, ConnectivityMethod="vector", CellSize=None, Zones=True):
+        Key = (Backend.Name, _FileStamp(ContextFile), _FileStamp(ExclusionFile), Width, ConnectivityMethod, CellSize, Zones)
+        if Key in self.Entries:
+            self.Entries.move_to_end(Key)
+            self.Hits += 1
+            AddMessage(" ... reusing the prepared context and exclusion of an earlier job")
+            # (this job did not spend any time on the connectivity zones)
+            return dict(self.Entries[Key][1], ZoneSeconds=0.0)
+
+        self.Misses += 1
+        Prepared = PCAT.PrepareLayers_Fnx(Backend, ContextFile, ExclusionFile, Width, Cache, ConnectivityMethod, CellSize, Zones)
+        Backend.Keep(*Prepared.values())
+        self.Entries[Key] = (Backend, Prepared)
+        while len(self.Entries) > self.MaxEntries:
+            self._Drop(self.Entries.popitem(last=False)[1])
+        return Prepared
+
+    # Deletes every kept layer
+    def Clear(self):
+        while self.Entries:
+            self._Drop(self.Entries.popitem(last=False)[1])
+
+    def _Drop(self, Entry):
+        Backend, Prepared = Entry
+        Backend.Release(*Prepared.values())
+        Backend.Delete(*Prepared.values())
+
+
+# (absolute path, size, modification time) of a file
+def _FileStamp(FileName):
+    FileName = os.path.abspath(FileName)
+    Stat = os.stat(FileName)
+    return FileName, Stat.st_size, Stat.st_mtime_ns
+
+
+# #########################################################################
+# Running Jobs
+# #########################################################################
+
+class BatchRunner(object):
+    '''NOTES:
+        Runs jobs one after the other in this process, with one backend per engine and the prepared layers kept in a PreparedStore between them.
+        A job that fails does not stop the others; its error is recorded in its result.
+    '''
+    def __init__(self, MaxPrepared=2):
+        self.Backends = {}
+        self.Store = PreparedStore(MaxPrepared)
+
+    # Runs one job; returns its result (name, analysis file, output, status "done" or "failed", seconds, and the error of a failed job)
+    def Run(self, Job):
+        Job = dict(Job)
+        Result = collections.OrderedDict([("Name", Job.pop("Name", "")), ("AnalysisFile", Job["AnalysisFile"]), ("Output", None), ("Status", "done")])
+        Start = time.perf_counter()
+        Backend = None
+        try:
+            Backend = self._Backend(Job)
+            Result["Output"] = PCAT.RunPCAT_Fnx(Backend=Backend, PreparedStore=self.Store, **Job)
+        except Exception as e:
+            Result["Status"] = "failed"
+            Result["Error"] = str(e)
+            Result["Traceback"] = traceback.format_exc()
+            AddMessage("Job " + Result["Name"] + " failed because: " + str(e))
+            # Removing what the run left behind (the kept layers stay)
+            PCAT_Profile.Activate_Fnx(None)
+            if Backend is not None:
+                Backend.Cleanup()
+        Result["Seconds"] = time.perf_counter() - Start
+        return Result
+
+    # Runs a list of jobs, grouped by their prepared layers; returns their results
+    def RunAll(self, Jobs):
+        Results = []
+        for Number, Job in enumerate(sorted(Jobs, key=_WarmKey)):
+            AddMessage("\n" + "#" * 72 + "\nJob " + str(Number + 1) + " of " + str(len(Jobs)) + ": " + Job["Name"] + "\n" + "#" * 72)
+            Results.append(self.Run(Job))
+            AddMessage("Job " + Job["Name"] + " " + Results[-1]["Status"] + " in %.1f seconds" % Results[-1]["Seconds"])
+        return Results
+
+    # Deletes the kept layers and the temporary layers of every backend
+    def Close(self):
+        self.Store.Clear()
+        for Backend in self.Backends.values():
+            Backend.Cleanup()
+        self.Backends = {}
+
+    def _Backend(self, Job):
+        Engine = Job.get("Engine", "arcpy")
+        if Engine not in self.Backends:
+            # (the arcpy engine names its scratch GeoPackage after the output of the first job)
+            AnalysisRoot, AnalysisExtension = os.path.splitext(Job["AnalysisFile"])
+            self.Backends[Engine] = PCAT_Backends.GetBackend_Fnx(Engine, AnalysisRoot + "_PCAT" + (AnalysisExtension or ".shp"), Job.get("MemoryBudgetMB", 4096))
+        return self.Backends[Engine]
+
+
+# Sends a summary of the results of a batch to the messages, and saves them to ReportFile (JSON, optional)
+def Report_Fnx(Results, Store, ReportFile=None):
+    AddMessage("\nBatch summary:")
+    for Result in Results:
+        AddMessage("     " + Result["Name"].ljust(28) + Result["Status"].ljust(8) + "%9.1f s   " % Result["Seconds"] + str(Result["Output"] or Result.get("Error")))
+    AddMessage("     prepared context and exclusion " + str(Store.Misses) + " time(s), reused " + str(Store.Hits) + " time(s)")
+    if ReportFile:
+        with open(ReportFile, "w") as report:
+            json.dump(Results, report, indent=1)
+        AddMessage("Report saved to " + ReportFile)
+
+
+# BATCH FUNCTION:
+# Runs every job of a manifest; returns their results
+def RunBatch_Fnx(ManifestFile, ReportFile=None, MaxPrepared=2):
+    Jobs = ReadManifest_Fnx(ManifestFile)
+    Runner = BatchRunner(MaxPrepared)
+    try:
+        Results = Runner.RunAll(Jobs)
+        Report_Fnx(Results, Runner.Store, ReportFile)
+    finally:
+        Runner.Close()
+    return Results
+
+
+# #########################################################################
+# Job Queue Folder
+# #########################################################################
+
+# Writes every job of a manifest into the queue folder as its own job file (written under a temporary name, so a worker never reads half a file); returns the job files
+# (the names also hold a random part, so that manifests submitted in the same second never replace each other's job files)
+def SubmitJobs_Fnx(QueueFolder, ManifestFile):
+    if not os.path.isdir(QueueFolder):
+        os.makedirs(QueueFolder)
+    JobFiles = []
+    for Job in ReadManifest_Fnx(ManifestFile):
+        JobFile = os.path.join(QueueFolder, time.strftime("%Y%m%d_%H%M%S_") + "%06d_" % (len(JobFiles) + 1) + uuid.uuid4().hex[:8] + "_" + Job["Name"] + ".json")
+        with open(JobFile + ".tmp", "w") as job:
+            json.dump(Job, job, indent=1)
+        os.replace(JobFile + ".tmp", JobFile)
+        JobFiles.append(JobFile)
+    AddMessage(str(len(JobFiles)) + " job(s) added to " + QueueFolder)
+    return JobFiles
+
+
+# Moves the oldest job file of the queue folder into <queue>/running; returns its new name, or None when the queue is empty
+def _ClaimJob(QueueFolder):
+    for JobName in sorted(Name for Name in os.listdir(QueueFolder) if Name.endswith(".json")):
+        Running = os.path.join(QueueFolder, "running", JobName)
+        try:
+            os.rename(os.path.join(QueueFolder, JobName), Running)
+        except OSError:
+            # (another worker claimed it first)
+            continue
+        return Running
+    return None
+
+
+# WORKER FUNCTION:
+# Runs the job files of a queue folder as they appear, with the prepared layers kept between them; returns the number of jobs run
+'''NOTES:
+    The worker looks for new job files every PollSeconds, and stops when a STOP file appears in the queue folder, or after IdleSeconds (optional) without a job.
+    Job files are written by SubmitJobs_Fnx, or by hand (one JSON job with the parameters of a manifest job; relative paths are relative to the queue folder).
+'''
+def Worker_Fnx(QueueFolder, PollSeconds=2.0, IdleSeconds=None, MaxPrepared=2):
+    for Subfolder in ("running", "done", "failed"):
+        if not os.path.isdir(os.path.join(QueueFolder, Subfolder)):
+            os.makedirs(os.path.join(QueueFolder, Subfolder))
+    AddMessage("Waiting for jobs in " + QueueFolder + " (add a file named STOP to stop)")
+
+    Runner = BatchRunner(MaxPrepared)
+    Done = 0
+    Idle = time.perf_counter()
+    try:
+        while not os.path.exists(os.path.join(QueueFolder, "STOP")):
+            Running = _ClaimJob(QueueFolder)
+            if Running is None:
+                if IdleSeconds is not None and time.perf_counter() - Idle > IdleSeconds:
+                    break
+                time.sleep(PollSeconds)
+                continue
+
+            AddMessage("\n" + "#" * 72 + "\nJob " + os.path.basename(Running) + "\n" + "#" * 72)
+            try:
+                with open(Running) as job:
+                    Job = CheckJob_Fnx(json.load(job), QueueFolder)
+                Result = Runner.Run(Job)
+            except Exception as e:
+                Job = {}
+                Result = {"Status": "failed", "Error": str(e), "Traceback": traceback.format_exc()}
+            AddMessage("Job " + os.path.basename(Running) + " " + Result["Status"] + ("" if "Seconds" not in Result else " in %.1f seconds" % Result["Seconds"]))
+
+            Finished = os.path.join(QueueFolder, Result["Status"], os.path.basename(Running))
+            with open(Finished + ".tmp", "w") as job:
+                json.dump(dict(Job, Result=Result), job, indent=1)
+            os.replace(Finished + ".tmp", Finished)
+            os.remove(Running)
+            Done += 1
+            Idle = time.perf_counter()
+    finally:
+        Runner.Close()
+    AddMessage("Worker stopped after " + str(Done) + " job(s); prepared context and exclusion " + str(Runner.Store.Misses) + " time(s), reused " + str(Runner.Store.Hits) + " time(s)")
+    return Done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the PCAT tool on many analysis files, keeping the prepared context and exclusion in memory between them.")
+    Commands = parser.add_subparsers(dest="Command")
+    Run = Commands.add_parser("run", help="run every job of a manifest")
+    Run.add_argument("ManifestFile", help="JSON or CSV manifest of jobs (RunPCAT_Fnx parameters)")
+    Run.add_argument("--report", default=None, help="JSON file in which to save the result of every job")
+    Run.add_argument("--keep", type=int, default=2, help="number of prepared context and exclusion combinations to keep in memory (default: 2)")
+    Work = Commands.add_parser("worker", help="run the job files that appear in a queue folder")
+    Work.add_argument("QueueFolder")
+    Work.add_argument("--poll", type=float, default=2.0, help="seconds between looks for new job files (default: 2)")
+    Work.add_argument("--idle-exit", type=float, default=None, help="stop after this many seconds without a job (default: keep waiting)")
+    Work.add_argument("--keep", type=int, default=2, help="number of prepared context and exclusion combinations to keep in memory (default: 2)")
+    Submit = Commands.add_parser("submit", help="add the jobs of a manifest to a queue folder")
+    Submit.add_argument("QueueFolder")
+    Submit.add_argument("ManifestFile")
+    Parameters = parser.parse_args(sys.argv[1:])
+
+    if Parameters.Command == "run":
+        Results = RunBatch_Fnx(Parameters.ManifestFile, Parameters.report, Parameters.keep)
+        sys.exit(1 if any(Result["Status"] != "done" for Result in Results) else 0)
+    elif Parameters.Command == "worker":
+        Worker_Fnx(Parameters.QueueFolder, Parameters.poll, Parameters.idle_exit, Parameters.keep)
+    elif Parameters.Command == "submit":
+        SubmitJobs_Fnx(Parameters.QueueFolder, Parameters.ManifestFile)
+    else:
+        parser.print_help()
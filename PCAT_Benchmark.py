@@ -0,0 +1,329 @@
+'''
+BENCHMARK SUITE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+Generates synthetic landscapes (analysis parcels, existing conservation context and an exclusion layer) at several
+scales, runs the PCAT calculation on them and records the wall time, peak memory and feature counts of the whole
+run and of each stage into a JSON results file. Two results files can be compared to flag regressions.
+
+To use from the command line:
+    python PCAT_Benchmark.py run --scales 1000 10000 100000 1000000 --output results.json
+    python PCAT_Benchmark.py compare baseline.json results.json
+
+Landscapes:
+    Parcels are star-shaped polygons of --vertices vertices, about 200 m across, on a 300 m grid (so a scale of N
+    parcels covers about sqrt(N) * 300 m on a side). --clustering (0 to 1) moves that fraction of the parcels, and of
+    the context, into a few Gaussian clusters, as in real land markets. The context has a third as many polygons
+    (100 to 600 m across) and the exclusion is a few river-like strips across the whole landscape. The same seed
+    always gives the same landscape, and generated landscapes are kept in --data-folder to be reused.
+
+Stages (in the order they run):
+    prepare (without the connectivity areas), connectivity zones (the narrow and near areas, the gap graph windows or
+    the connectivity raster of the --connectivity method, PrepareZones_Fnx), create output, shared boundary, perimeter,
+    one stage per buffer ring (calculated on its own, as AreaPercent_Fnx), all rings (the single pass the tool uses),
+    connectivity (scoring the sites against the zones), final score, write output
+The whole tool is also run once from start to finish ("pipeline").
+
+The feature and vertex counts of a stage are those of what it produced: the prepared layers, the narrow and near areas
+(none for the raster), the output, or (features only) the sites a calculation stage filled the fields of.
+
+Peak memory is the peak resident set size during the stage (Linux, where it can be reset between stages), or the
+peak of the process so far on other systems. It is left empty where it cannot be read (e.g. on Windows).
+
+'''
+import os, sys, json, time, math, platform, argparse, collections
+import numpy
+
+try:
+    import shapely
+    import fiona
+except ImportError:
+    shapely = None
+    fiona = None
+
+import PCAT_Backends
+from PCAT_Profile import ResetPeak_Fnx, PeakMB_Fnx
+import TNC_ArcPyConservationTool as PCAT
+from PCAT_Results import ResultsStore
+
+
+DefaultScales = [1000, 10000, 100000, 1000000]
+
+# A stage only counts as a regression when it is slower by more than the threshold AND by more than this many seconds (shorter stages are mostly noise)
+MinimumRegressionSeconds = 0.5
+
+
+# #########################################################################
+# Synthetic Landscapes
+# #########################################################################
+
+# Star-shaped polygons (a valid, simple polygon for every center) with Vertices vertices and radii between MinRadius and MaxRadius
+def StarPolygons_Fnx(Random, CenterX, CenterY, MinRadius, MaxRadius, Vertices):
+    Count = len(CenterX)
+    Angles = numpy.sort(Random.uniform(0, 2 * math.pi, (Count, Vertices)), axis=1)
+    Radii = Random.uniform(MinRadius, MaxRadius, (Count, 1)) * Random.uniform(0.7, 1.0, (Count, Vertices))
+    Coordinates = numpy.stack([CenterX[:, None] + Radii * numpy.cos(Angles), CenterY[:, None] + Radii * numpy.sin(Angles)], axis=2)
+    Coordinates = numpy.concatenate([Coordinates, Coordinates[:, :1]], axis=1)
+    return shapely.make_valid(shapely.polygons(Coordinates))
+
+
+# Centers of Count features in a Side x Side square: a Clustering fraction of them drawn around a few cluster centers, the rest uniform
+def Centers_Fnx(Random, Count, Side, Clustering):
+    Clustered = int(round(Count * Clustering))
+    X = Random.uniform(0, Side, Count)
+    Y = Random.uniform(0, Side, Count)
+    if Clustered:
+        Clusters = max(1, int(math.sqrt(Count) / 10))
+        Which = Random.integers(0, Clusters, Clustered)
+        ClusterX, ClusterY = Random.uniform(0, Side, Clusters), Random.uniform(0, Side, Clusters)
+        Spread = Side / (4.0 * math.sqrt(Clusters))
+        X[:Clustered] = numpy.clip(ClusterX[Which] + Random.normal(0, Spread, Clustered), 0, Side)
+        Y[:Clustered] = numpy.clip(ClusterY[Which] + Random.normal(0, Spread, Clustered), 0, Side)
+    return X, Y
+
+
+# Writes geometries with one integer ID field
+def _WriteLayer(FileName, Geometries, IDField, Crs):
+    Driver = "GPKG" if FileName.lower().endswith(".gpkg") else "ESRI Shapefile"
+    Schema = {"geometry": "Polygon", "properties": {IDField: "int"}}
+    with fiona.open(FileName, "w", driver=Driver, crs=Crs, schema=Schema) as sink:
+        sink.writerecords({"geometry": shapely.geometry.mapping(Geometry), "properties": {IDField: Position}}
+                          for Position, Geometry in enumerate(Geometries))
+
+
+# SYNTHETIC LANDSCAPE FUNCTION:
+# Generates (or reuses) a landscape of Parcels parcels; returns (context file, analysis file, exclusion file)
+'''NOTES:
+    The landscape is placed in UTM zone 18N (EPSG:26918) so that the units are meters, as the tool expects.
+    Extension is ".shp" or ".gpkg" (shapefiles are limited to 2 GB, which the larger scales can come close to with many vertices).
+'''
+def SyntheticLandscape_Fnx(DataFolder, Parcels, Clustering=0.5, Vertices=8, Seed=1, Extension=".shp"):
+    if shapely is None or fiona is None:
+        raise ImportError("Generating synthetic landscapes requires shapely (>= 2.0) and fiona")
+    Folder = os.path.join(DataFolder, "pcat_" + str(Parcels) + "_c" + str(Clustering) + "_v" + str(Vertices) + "_s" + str(Seed))
+    Files = [os.path.join(Folder, Name + Extension) for Name in ("context", "parcels", "exclusion")]
+    if all(os.path.exists(File) for File in Files):
+        return Files
+    if not os.path.isdir(Folder):
+        os.makedirs(Folder)
+
+    Random = numpy.random.default_rng(Seed)
+    Side = math.sqrt(Parcels) * 300.0
+    OriginX, OriginY = 500000.0, 4000000.0
+
+    # Parcels: the uniform ones on a jittered 300 m grid, the clustered ones around the cluster centers
+    X, Y = Centers_Fnx(Random, Parcels, Side, Clustering)
+    Uniform = numpy.arange(int(round(Parcels * Clustering)), Parcels)
+    Columns = int(math.ceil(math.sqrt(Parcels)))
+    X[Uniform] = (Uniform % Columns + 0.5) * 300.0 + Random.uniform(-30, 30, len(Uniform))
+    Y[Uniform] = (Uniform // Columns + 0.5) * 300.0 + Random.uniform(-30, 30, len(Uniform))
+    ParcelGeometries = StarPolygons_Fnx(Random, OriginX + X, OriginY + Y, 80, 120, Vertices)
+
+    # Context: a third as many, larger polygons, spread a little past the parcels
+    ContextCount = max(5, Parcels // 3)
+    X, Y = Centers_Fnx(Random, ContextCount, Side + 2000, Clustering)
+    ContextGeometries = StarPolygons_Fnx(Random, OriginX - 1000 + X, OriginY - 1000 + Y, 50, 300, Vertices)
+
+    # Exclusion: one meandering 80 m wide river per 10 km of landscape
+    Rivers = []
+    for River in range(max(1, int(Side / 10000))):
+        Ys = numpy.linspace(-2000, Side + 2000, 50)
+        Xs = Random.uniform(0, Side) + numpy.cumsum(Random.normal(0, 100, 50))
+        Rivers.append(shapely.buffer(shapely.linestrings(OriginX + Xs, OriginY + Ys), 40))
+
+    Crs = "EPSG:26918"
+    _WriteLayer(Files[0], ContextGeometries, "CID", Crs)
+    _WriteLayer(Files[1], ParcelGeometries, "PID", Crs)
+    _WriteLayer(Files[2], Rivers, "EID", Crs)
+    return Files
+
+
+# #########################################################################
+# Measuring
+# #########################################################################
+
+# Runs Function(*Arguments) and appends its wall time, peak memory and output feature count (with a Backend) to Stages; returns what the function returns
+def _TimeStage(Stages, Name, Function, *Arguments, Backend=None):
+    ResetPeak_Fnx()
+    Start = time.perf_counter()
+    Value = Function(*Arguments)
+    Seconds, PeakMB = time.perf_counter() - Start, PeakMB_Fnx()
+    Features, Vertices = _OutputFeatures(Backend, Value)
+    Stages.append(collections.OrderedDict([("Name", Name), ("Seconds", Seconds), ("PeakMB", PeakMB), ("Features", Features), ("Vertices", Vertices)]))
+    PCAT_Backends.ShowMessages = True
+    PCAT_Backends.AddMessage("     " + Name.ljust(18) + " " + "%.2f" % Seconds + " s" + ("" if Features is None else "   " + str(Features) + " features") +
+                             ("" if Vertices is None else ", " + str(Vertices) + " vertices"))
+    PCAT_Backends.ShowMessages = False
+    return Value
+
+
+# Number of features and of vertices a stage produced: of the layer (or layers) it returned, or the number of sites it calculated (a ResultsStore, no vertices); None where they can not be counted
+def _OutputFeatures(Backend, Value):
+    if Backend is None or Value is None:
+        return None, None
+    if isinstance(Value, ResultsStore):
+        return len(Value), None
+    Layers = Value.values() if isinstance(Value, dict) else Value if isinstance(Value, (list, tuple)) else [Value]
+    Counts = [Backend.Describe(Layer) for Layer in Layers]
+    Counts = [Count for Count in Counts if Count is not None]
+    if not Counts:
+        return None, None
+    return int(sum(Count[0] for Count in Counts)), int(sum(Count[1] for Count in Counts))
+
+
+# Number of features and of vertices of a file
+def _Counts(Backend, InputFile):
+    Layer = Backend.Read(InputFile)
+    Coordinates, RingIDs, RingKeys = Backend.ReadRings(Layer)
+    return {"Features": int(len(numpy.unique(RingKeys))), "Vertices": int(len(Coordinates))}
+
+
+# BENCHMARK FUNCTION:
+# Runs the stages of the tool one by one, then the whole tool, on one landscape; returns the record of the run
+def BenchmarkLandscape_Fnx(ContextFile, AnalysisFile, ExclusionFile, Engine="open", Width="25 Meters", ConnectivityMethod="vector", CellSize=None, Workers=1):
+    AnalysisRoot, AnalysisExtension = os.path.splitext(AnalysisFile)
+    nameOfOutputShapefile = AnalysisRoot + "_PCAT" + AnalysisExtension
+    if ConnectivityMethod == "raster" and not CellSize:
+        CellSize = str(PCAT_Backends.LinearUnitToMeters_Fnx(Width) / 10) + " Meters"
+
+    Backend = PCAT_Backends.GetBackend_Fnx(Engine, nameOfOutputShapefile)
+    Stages = []
+    PCAT_Backends.ShowMessages = False
+    try:
+        Prepared = _TimeStage(Stages, "prepare", PCAT.PrepareLayers_Fnx, Backend, ContextFile, ExclusionFile, Width, None, ConnectivityMethod, CellSize, False, Backend=Backend)
+
+        def BuildZones():
+            PCAT.PrepareZones_Fnx(Backend, Prepared, Width, ConnectivityMethod, CellSize)
+            return [Prepared[Name] for Name in ("NarrowAreas", "NearAreas") if Name in Prepared]
+        _TimeStage(Stages, "connectivity zones", BuildZones, Backend=Backend)
+        OutputLayer = _TimeStage(Stages, "create output", Backend.CreateOutput, AnalysisFile, nameOfOutputShapefile, PCAT.OutputFields, Backend=Backend)
+        Keys, SiteAcres = Backend.ReadMeasure(OutputLayer, ["Match_ID"], "AREA")
+        Results = ResultsStore(Keys[:, 0])
+        Results.Set("SP_Acr", Results.SumByMatchID(Keys[:, 0], SiteAcres))
+
+        Context, Exclusion = Prepared["ContextNoExclusion"], Prepared["Exclusion"]
+        _TimeStage(Stages, "shared boundary", PCAT.SharedBoundaryPercent_Fnx, Backend, OutputLayer, Context, Exclusion, Results, "SP_Lng", "SP_Adj_Pct", Backend=Backend)
+        _TimeStage(Stages, "perimeter", PCAT.PerimeterPercent_Fnx, Backend, OutputLayer, Context, Exclusion, Results, "SP_Lng", "SP_Adj_Pct", Backend=Backend)
+        for Ring in PCAT.BuffRings:
+            _TimeStage(Stages, "ring " + Ring[1].split("_")[0], PCAT.AreaPercent_Fnx, Backend, OutputLayer, Context, Exclusion, Results, *Ring, Backend=Backend)
+        _TimeStage(Stages, "all rings", PCAT.MultiRingAreaPercent_Fnx, Backend, OutputLayer, Context, Exclusion, Results, PCAT.BuffRings, Backend=Backend)
+        _TimeStage(Stages, "connectivity", PCAT.Connectivity_Fnx, Backend, OutputLayer, Prepared, Results, Backend=Backend)
+        _TimeStage(Stages, "final score", PCAT.FinalScore_Fnx, Results, PCAT.ScoreWeights, Backend=Backend)
+
+        def WriteOutput():
+            Backend.WriteResults(OutputLayer, Results)
+            Backend.SaveOutput(OutputLayer, nameOfOutputShapefile)
+            return OutputLayer
+        _TimeStage(Stages, "write output", WriteOutput, Backend=Backend)
+        Backend.Cleanup()
+
+        Pipeline = []
+        _TimeStage(Pipeline, "pipeline", PCAT.RunPCAT_Fnx, ContextFile, AnalysisFile, ExclusionFile, "", Width, Engine, None, 2048, ConnectivityMethod, CellSize, Workers)
+    finally:
+        PCAT_Backends.ShowMessages = True
+
+    return collections.OrderedDict([
+        ("Counts", collections.OrderedDict((Name, _Counts(Backend, File)) for Name, File in (("Parcels", AnalysisFile), ("Context", ContextFile), ("Exclusion", ExclusionFile)))),
+        ("Pipeline", Pipeline[0]),
+        ("Stages", Stages)])
+
+
+# Runs the benchmark at every scale and writes the results file
+def RunBenchmarks_Fnx(Scales, OutputFile, DataFolder, Clustering=0.5, Vertices=8, Seed=1, Extension=".shp", Engine="open", Width="25 Meters",
+                      ConnectivityMethod="vector", CellSize=None, Workers=1):
+    Record = collections.OrderedDict([
+        ("Machine", collections.OrderedDict([("Platform", platform.platform()), ("Python", platform.python_version()),
+                                             ("Processor", platform.processor()), ("CPUs", os.cpu_count())])),
+        ("Parameters", collections.OrderedDict([("Engine", Engine), ("Width", Width), ("ConnectivityMethod", ConnectivityMethod), ("CellSize", CellSize),
+                                                ("Workers", Workers), ("Clustering", Clustering), ("Vertices", Vertices), ("Seed", Seed)])),
+        ("Runs", [])])
+
+    for Scale in Scales:
+        PCAT_Backends.AddMessage("Benchmarking " + str(Scale) + " parcels")
+        ContextFile, AnalysisFile, ExclusionFile = SyntheticLandscape_Fnx(DataFolder, Scale, Clustering, Vertices, Seed, Extension)
+        Run = BenchmarkLandscape_Fnx(ContextFile, AnalysisFile, ExclusionFile, Engine, Width, ConnectivityMethod, CellSize, Workers)
+        Run["Scale"] = Scale
+        Run.move_to_end("Scale", last=False)
+        Record["Runs"].append(Run)
+
+        # Written after every scale, so the smaller scales are kept if a larger one runs out of memory
+        with open(OutputFile, "w") as results:
+            json.dump(Record, results, indent=2)
+    return Record
+
+
+# #########################################################################
+# Comparing Results
+# #########################################################################
+
+# COMPARE FUNCTION:
+# Compares the stages of two results files; returns the list of regressions (as messages)
+'''NOTES:
+    A stage is a regression when it took more than Threshold times as long as in the baseline (and MinimumRegressionSeconds longer), or used more than Threshold times the peak memory.
+    Only the scales and stages found in both files are compared.
+'''
+def CompareResults_Fnx(BaselineFile, ResultsFile, Threshold=1.1):
+    with open(BaselineFile) as baseline:
+        Baseline = json.load(baseline)
+    with open(ResultsFile) as results:
+        Results = json.load(results)
+    if Baseline.get("Parameters") != Results.get("Parameters"):
+        PCAT_Backends.AddMessage("Warning: the two files were run with different parameters")
+
+    BaselineRuns = dict((Run["Scale"], Run) for Run in Baseline["Runs"])
+    Regressions = []
+    for Run in Results["Runs"]:
+        if Run["Scale"] not in BaselineRuns:
+            continue
+        BaselineStages = dict((Stage["Name"], Stage) for Stage in [BaselineRuns[Run["Scale"]]["Pipeline"]] + BaselineRuns[Run["Scale"]]["Stages"])
+        for Stage in [Run["Pipeline"]] + Run["Stages"]:
+            Before = BaselineStages.get(Stage["Name"])
+            if Before is None:
+                continue
+            Flag = ""
+            if Stage["Seconds"] > Before["Seconds"] * Threshold and Stage["Seconds"] - Before["Seconds"] > MinimumRegressionSeconds:
+                Flag = "  <-- slower"
+            elif Before["PeakMB"] and Stage["PeakMB"] and Stage["PeakMB"] > Before["PeakMB"] * Threshold:
+                Flag = "  <-- more memory"
+            # (a stage that produces another number of features is doing different work, e.g. after a change of the overlays)
+            Features = ""
+            if Before.get("Features") is not None and Stage.get("Features") is not None and Before["Features"] != Stage["Features"]:
+                Features = "   features " + str(Before["Features"]) + " -> " + str(Stage["Features"])
+            Line = (str(Run["Scale"]).rjust(8) + "  " + Stage["Name"].ljust(18) + ("%10.2f s" % Before["Seconds"]) + (" ->%10.2f s" % Stage["Seconds"]) +
+                    ("   (x%.2f)" % (Stage["Seconds"] / Before["Seconds"] if Before["Seconds"] else float("inf"))) + Features + Flag)
+            PCAT_Backends.AddMessage(Line)
+            if Flag:
+                Regressions.append(Line.strip())
+    return Regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the PCAT tool on synthetic landscapes, or compares two benchmark results files.")
+    Commands = parser.add_subparsers(dest="Command")
+    Run = Commands.add_parser("run", help="generate landscapes and benchmark the tool")
+    Run.add_argument("--scales", type=int, nargs="+", default=DefaultScales, help="numbers of parcels (default: 1000 10000 100000 1000000)")
+    Run.add_argument("--output", default="pcat_benchmark.json", help="results file (default: pcat_benchmark.json)")
+    Run.add_argument("--data-folder", default="pcat_benchmark_data", help="folder for the generated landscapes (default: pcat_benchmark_data)")
+    Run.add_argument("--clustering", type=float, default=0.5, help="fraction of the features placed in clusters, 0 to 1 (default: 0.5)")
+    Run.add_argument("--vertices", type=int, default=8, help="vertices per polygon (default: 8)")
+    Run.add_argument("--seed", type=int, default=1)
+    Run.add_argument("--format", choices=["shp", "gpkg"], default="shp", help="file format of the landscapes (default: shp)")
+    Run.add_argument("--engine", choices=["arcpy", "open"], default="open")
+    Run.add_argument("--width", default="25 Meters", help="narrowness width (default: 25 Meters)")
+    Run.add_argument("--connectivity", choices=["vector", "graph", "raster"], default="vector")
+    Run.add_argument("--cell-size", default=None)
+    Run.add_argument("--workers", type=int, default=1, help="processes for the pipeline run (default: 1)")
+    Compare = Commands.add_parser("compare", help="flag regressions between two results files")
+    Compare.add_argument("BaselineFile")
+    Compare.add_argument("ResultsFile")
+    Compare.add_argument("--threshold", type=float, default=1.1, help="slowdown (or memory growth) ratio counted as a regression (default: 1.1)")
+    Parameters = parser.parse_args(sys.argv[1:])
+
+    if Parameters.Command == "run":
+        RunBenchmarks_Fnx(Parameters.scales, Parameters.output, Parameters.data_folder, Parameters.clustering, Parameters.vertices, Parameters.seed,
+                          "." + Parameters.format, Parameters.engine, Parameters.width, Parameters.connectivity, Parameters.cell_size, Parameters.workers)
+    elif Parameters.Command == "compare":
+        Regressions = CompareResults_Fnx(Parameters.BaselineFile, Parameters.ResultsFile, Parameters.threshold)
+        print("\n" + str(len(Regressions)) + " regression(s)")
+        sys.exit(1 if Regressions else 0)
+    else:
+        parser.print_help()
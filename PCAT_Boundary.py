@@ -0,0 +1,345 @@
+'''
+SHARED-BOUNDARY ENGINE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The perimeter percentage (SP_Lng, SP_Adj_Pct) asks how much of each site's boundary, outside of the exclusion, runs
+along or through existing conservation land. PerimeterPercent_Fnx answers it with general overlays (polygon to
+line, erase, intersect in LINE mode). This engine answers it directly from the boundary segments, in one sweep:
+
+    1) the boundaries of the sites, and the edges of the context and exclusion polygons, are read as segments
+       (Backend.ReadRings), and each site segment is paired with the edges whose envelopes come within the snapping
+       tolerance of it (a uniform grid index)
+    2) every site segment is split where it crosses an edge, and where an edge's end point comes within the
+       tolerance of it, so that each piece is either entirely in or entirely out of the context (and of the exclusion)
+    3) a piece is in a layer when its midpoint is within the tolerance of one of the layer's edges (a shared or
+       snapped boundary), or inside one of its polygons (an even-odd ray count against the edges of the polygons
+       whose envelopes hold the midpoint)
+    4) the piece lengths are summed by site: boundary length outside the exclusion (SP_Lng), the part of it in
+       the context, and the length removed by the exclusion
+
+Each part of a boundary is counted once, however many context features cover it. The overlays count it once per
+context feature, so where context features overlap (or two of them share an edge that a site runs along) the overlay
+percentage can go past 100; elsewhere the two agree to floating point precision with the default tolerance (0.001 m,
+the ArcGIS default XY tolerance). A larger tolerance also counts boundaries that are only nearly coincident (e.g. a
+site and a conservation easement digitized a few centimeters apart) as shared.
+
+Only sites whose envelopes come near a context (or exclusion) polygon's envelope are tested against that layer, and
+the site segments are processed in chunks of ChunkSegments, so the memory used stays bounded on large inputs. The
+sweep is plain numpy and runs the same with both engines; with the arcpy engine it replaces three geoprocessing tools
+and their intermediate feature classes. With the open engine the GEOS overlays are somewhat faster (1.2 to 1.8 times
+on the synthetic landscapes of PCAT_Benchmark.py), which is why the overlays stay the default.
+
+'''
+import math
+import numpy
+
+import PCAT_Backends
+
+
+# Site segments handled at once (each one typically pairs with a few dozen edges)
+ChunkSegments = 200000
+
+
+# #########################################################################
+# Segments and the Grid Index
+# #########################################################################
+
+# Boundary segments of the polygons of Layer: (start points, end points, KeyField value (or feature position) of each segment)
+def BoundarySegments_Fnx(Backend, Layer, KeyField=None):
+    Coordinates, RingIDs, RingKeys = Backend.ReadRings(Layer, KeyField)
+    if len(Coordinates) < 2:
+        return numpy.zeros((0, 2)), numpy.zeros((0, 2)), numpy.zeros(0, dtype=numpy.int64)
+    SameRing = RingIDs[:-1] == RingIDs[1:]
+    Starts, Ends = Coordinates[:-1][SameRing], Coordinates[1:][SameRing]
+    Keys = RingKeys[RingIDs[:-1][SameRing]]
+    NotEmpty = numpy.any(Starts != Ends, axis=1)
+    return Starts[NotEmpty], Ends[NotEmpty], Keys[NotEmpty]
+
+
+class PolygonEdges(object):
+    '''NOTES:
+        The edges of every polygon of a layer, sorted by polygon (Polygons are feature positions), with the envelope of each polygon.
+        Holes need no special handling: the even-odd ray count over all of the rings of a polygon is odd only inside the polygon and outside its holes.
+    '''
+    def __init__(self, Starts, Ends, Polygons):
+        Order = numpy.argsort(Polygons, kind="stable")
+        self.Starts, self.Ends, self.Polygons = Starts[Order], Ends[Order], Polygons[Order]
+        self.PolygonIDs, self.EdgeStarts = numpy.unique(self.Polygons, return_index=True)
+        if len(self.Starts):
+            X = numpy.minimum(self.Starts[:, 0], self.Ends[:, 0]), numpy.maximum(self.Starts[:, 0], self.Ends[:, 0])
+            Y = numpy.minimum(self.Starts[:, 1], self.Ends[:, 1]), numpy.maximum(self.Starts[:, 1], self.Ends[:, 1])
+            self.PolygonBoxes = numpy.column_stack([numpy.minimum.reduceat(X[0], self.EdgeStarts), numpy.minimum.reduceat(Y[0], self.EdgeStarts),
+                                                    numpy.maximum.reduceat(X[1], self.EdgeStarts), numpy.maximum.reduceat(Y[1], self.EdgeStarts)])
+        else:
+            self.PolygonBoxes = numpy.zeros((0, 4))
+        self.EdgeGrid = GridIndex(_SegmentBoxes(self.Starts, self.Ends))
+        self.PolygonGrid = GridIndex(self.PolygonBoxes)
+        self._BandIndex()
+
+    # Edges by (polygon, horizontal band), so that a ray from a point only meets the edges of the polygon in the point's band
+    def _BandIndex(self):
+        self.BandHeight, self.BandOrigin, self.Bands = 1.0, 0.0, 1
+        self.BandKeys, self.BandEdges = numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        if not len(self.Starts):
+            return
+        YMin, YMax = numpy.minimum(self.Starts[:, 1], self.Ends[:, 1]), numpy.maximum(self.Starts[:, 1], self.Ends[:, 1])
+        Sizes = numpy.maximum(numpy.abs(self.Ends[:, 0] - self.Starts[:, 0]), YMax - YMin)
+        self.BandHeight, self.BandOrigin = max(2 * float(numpy.median(Sizes)), 1e-6), float(YMin.min())
+        First = numpy.floor((YMin - self.BandOrigin) / self.BandHeight).astype(numpy.int64)
+        Last = numpy.floor((YMax - self.BandOrigin) / self.BandHeight).astype(numpy.int64)
+        self.Bands = int(Last.max()) + 1
+        Edges, Offsets = _Expand(numpy.zeros(len(First), dtype=numpy.int64), Last - First + 1)
+        Keys = numpy.searchsorted(self.PolygonIDs, self.Polygons[Edges]) * self.Bands + First[Edges] + Offsets
+        Order = numpy.argsort(Keys, kind="stable")
+        self.BandKeys, self.BandEdges = Keys[Order], Edges[Order]
+
+    # Band number of each y
+    def Band(self, Y):
+        return numpy.clip(numpy.floor((Y - self.BandOrigin) / self.BandHeight).astype(numpy.int64), 0, self.Bands - 1)
+
+    @classmethod
+    def FromLayer(cls, Backend, Layer):
+        Starts, Ends, Polygons = BoundarySegments_Fnx(Backend, Layer)
+        return cls(Starts, Ends, Polygons)
+
+    def __len__(self):
+        return len(self.Starts)
+
+
+# Envelopes (XMin, YMin, XMax, YMax) of segments
+def _SegmentBoxes(Starts, Ends):
+    return numpy.column_stack([numpy.minimum(Starts[:, 0], Ends[:, 0]), numpy.minimum(Starts[:, 1], Ends[:, 1]),
+                               numpy.maximum(Starts[:, 0], Ends[:, 0]), numpy.maximum(Starts[:, 1], Ends[:, 1])])
+
+
+# For groups given by Starts and Counts: (group number of every member, position of every member)
+def _Expand(Starts, Counts):
+    Owners = numpy.repeat(numpy.arange(len(Counts)), Counts)
+    Offsets = numpy.arange(Counts.sum()) - numpy.repeat(numpy.cumsum(Counts) - Counts, Counts)
+    return Owners, numpy.repeat(Starts, Counts) + Offsets
+
+
+class GridIndex(object):
+    '''NOTES:
+        A uniform grid over a set of envelopes (XMin, YMin, XMax, YMax), built once and queried with any number of other envelopes.
+        The cells are twice the typical (median) envelope, so most envelopes fall in one to four cells. Envelopes over MaxCells cells (e.g. the edges of a long straight road) are kept aside and compared with every query.
+        A pair met in several cells is only kept in the cell that holds the lower left corner of the overlap of the two envelopes, so no pair is returned twice.
+    '''
+    def __init__(self, Boxes, MaxCells=1024):
+        self.Boxes = Boxes
+        Sizes = numpy.maximum(Boxes[:, 2] - Boxes[:, 0], Boxes[:, 3] - Boxes[:, 1]) if len(Boxes) else numpy.zeros(1)
+        self.CellSize = max(2 * float(numpy.median(Sizes)), 1e-6)
+        self.Origin = Boxes[:, :2].min(axis=0) if len(Boxes) else numpy.zeros(2)
+        self.Columns = int(math.floor((Boxes[:, 2].max() - self.Origin[0]) / self.CellSize)) + 1 if len(Boxes) else 1
+        self.Rows = int(math.floor((Boxes[:, 3].max() - self.Origin[1]) / self.CellSize)) + 1 if len(Boxes) else 1
+        Column0, Row0, Width, Height = self._CellRanges(Boxes)
+        self.Large = numpy.flatnonzero(Width * Height > MaxCells)
+        Small = numpy.flatnonzero(Width * Height <= MaxCells)
+        Entries, Cells = self._Cells(Small, Column0, Row0, Width, Height)
+        Order = numpy.argsort(Cells, kind="stable")
+        self.Entries, self.Cells = Entries[Order], Cells[Order]
+
+    def __len__(self):
+        return len(self.Boxes)
+
+    # First column and row, and number of columns and rows, of the cells covered by each envelope (limited to the grid)
+    def _CellRanges(self, Boxes):
+        def Index(Values, Origin, Limit):
+            return numpy.clip(numpy.floor((Values - Origin) / self.CellSize).astype(numpy.int64), 0, Limit - 1)
+        Column0, Row0 = Index(Boxes[:, 0], self.Origin[0], self.Columns), Index(Boxes[:, 1], self.Origin[1], self.Rows)
+        return Column0, Row0, Index(Boxes[:, 2], self.Origin[0], self.Columns) - Column0 + 1, Index(Boxes[:, 3], self.Origin[1], self.Rows) - Row0 + 1
+
+    # (envelope number, cell number) of every cell covered by the envelopes at Positions
+    def _Cells(self, Positions, Column0, Row0, Width, Height):
+        Owners, Offsets = _Expand(numpy.zeros(len(Positions), dtype=numpy.int64), (Width * Height)[Positions])
+        Entries = Positions[Owners]
+        return Entries, (Row0[Entries] + Offsets // Width[Entries]) * self.Columns + Column0[Entries] + Offsets % Width[Entries]
+
+    # Pairs [[query positions], [index positions]] of the query envelopes and the indexed envelopes that overlap, after expanding the queries by Tolerance
+    def Query(self, Boxes, Tolerance=0.0):
+        if len(Boxes) == 0 or len(self.Boxes) == 0:
+            return numpy.zeros((2, 0), dtype=numpy.int64)
+        Boxes = Boxes + numpy.array([-Tolerance, -Tolerance, Tolerance, Tolerance])
+        Column0, Row0, Width, Height = self._CellRanges(Boxes)
+        Queries, Cells = self._Cells(numpy.arange(len(Boxes)), Column0, Row0, Width, Height)
+        First = numpy.searchsorted(self.Cells, Cells, "left")
+        Owners, Positions = _Expand(First, numpy.searchsorted(self.Cells, Cells, "right") - First)
+        PairA, PairB, PairCells = Queries[Owners], self.Entries[Positions], Cells[Owners]
+        Overlap = ((Boxes[PairA, 0] <= self.Boxes[PairB, 2]) & (self.Boxes[PairB, 0] <= Boxes[PairA, 2]) &
+                   (Boxes[PairA, 1] <= self.Boxes[PairB, 3]) & (self.Boxes[PairB, 1] <= Boxes[PairA, 3]))
+        PairA, PairB, PairCells = PairA[Overlap], PairB[Overlap], PairCells[Overlap]
+        Corners = numpy.column_stack([numpy.maximum(Boxes[PairA, 0], self.Boxes[PairB, 0]), numpy.maximum(Boxes[PairA, 1], self.Boxes[PairB, 1]),
+                                      numpy.maximum(Boxes[PairA, 0], self.Boxes[PairB, 0]), numpy.maximum(Boxes[PairA, 1], self.Boxes[PairB, 1])])
+        CornerColumn, CornerRow = self._CellRanges(Corners)[:2]
+        First = CornerRow * self.Columns + CornerColumn == PairCells
+        PairA, PairB = [PairA[First]], [PairB[First]]
+
+        # The large envelopes against every query
+        if len(self.Large):
+            LargeA = numpy.tile(numpy.arange(len(Boxes)), len(self.Large))
+            LargeB = numpy.repeat(self.Large, len(Boxes))
+            Overlap = ((Boxes[LargeA, 0] <= self.Boxes[LargeB, 2]) & (self.Boxes[LargeB, 0] <= Boxes[LargeA, 2]) &
+                       (Boxes[LargeA, 1] <= self.Boxes[LargeB, 3]) & (self.Boxes[LargeB, 1] <= Boxes[LargeA, 3]))
+            PairA.append(LargeA[Overlap])
+            PairB.append(LargeB[Overlap])
+        PairA, PairB = numpy.concatenate(PairA), numpy.concatenate(PairB)
+        Order = numpy.lexsort((PairB, PairA))
+        return numpy.vstack([PairA[Order], PairB[Order]])
+
+
+# #########################################################################
+# Splitting and Classifying the Segments
+# #########################################################################
+
+def _Cross(AX, AY, BX, BY):
+    return AX * BY - AY * BX
+
+
+# Distance from points P to segments S0-S1 (all arrays of the same length)
+def _PointSegmentDistance(P, S0, S1):
+    D = S1 - S0
+    LengthSquared = numpy.einsum("ij,ij->i", D, D)
+    T = numpy.clip(numpy.einsum("ij,ij->i", P - S0, D) / numpy.where(LengthSquared > 0, LengthSquared, 1), 0, 1)
+    Nearest = S0 + D * T[:, None]
+    return numpy.hypot(P[:, 0] - Nearest[:, 0], P[:, 1] - Nearest[:, 1])
+
+
+# Split parameters (0 < t < 1 along the segment) where the paired edges cross each segment, or where their end points come within Tolerance of it
+def _SplitParameters(Starts, Ends, Edges, Pairs, Tolerance):
+    P0, P1 = Starts[Pairs[0]], Ends[Pairs[0]]
+    Q0, Q1 = Edges.Starts[Pairs[1]], Edges.Ends[Pairs[1]]
+    D, E, W = P1 - P0, Q1 - Q0, Q0 - P0
+    Denominator = _Cross(D[:, 0], D[:, 1], E[:, 0], E[:, 1])
+    Safe = numpy.where(Denominator != 0, Denominator, 1)
+    T = _Cross(W[:, 0], W[:, 1], E[:, 0], E[:, 1]) / Safe
+    U = _Cross(W[:, 0], W[:, 1], D[:, 0], D[:, 1]) / Safe
+    Crossing = (Denominator != 0) & (T > 0) & (T < 1) & (U >= 0) & (U <= 1)
+    Segments, Parameters = [Pairs[0][Crossing]], [T[Crossing]]
+
+    LengthSquared = numpy.einsum("ij,ij->i", D, D)
+    for Q in (Q0, Q1):
+        T = numpy.einsum("ij,ij->i", Q - P0, D) / LengthSquared
+        Projected = P0 + D * T[:, None]
+        Near = (T > 0) & (T < 1) & (numpy.hypot(Q[:, 0] - Projected[:, 0], Q[:, 1] - Projected[:, 1]) <= Tolerance)
+        Segments.append(Pairs[0][Near])
+        Parameters.append(T[Near])
+    return numpy.concatenate(Segments), numpy.concatenate(Parameters)
+
+
+# Whether each point is inside a polygon of Edges (even-odd ray count to the right against the edges, in the point's band, of the polygons whose envelopes hold the point)
+def _Inside(Points, Edges):
+    Inside = numpy.zeros(len(Points), dtype=bool)
+    if len(Points) == 0 or len(Edges) == 0:
+        return Inside
+    PointBoxes = numpy.column_stack([Points, Points])
+    Pairs = Edges.PolygonGrid.Query(PointBoxes)
+    Keys = Pairs[1] * Edges.Bands + Edges.Band(Points[Pairs[0], 1])
+    First = numpy.searchsorted(Edges.BandKeys, Keys, "left")
+    PairOwners, BandPositions = _Expand(First, numpy.searchsorted(Edges.BandKeys, Keys, "right") - First)
+    EdgePositions = Edges.BandEdges[BandPositions]
+    P = Points[Pairs[0][PairOwners]]
+    Q0, Q1 = Edges.Starts[EdgePositions], Edges.Ends[EdgePositions]
+    Straddles = (Q0[:, 1] > P[:, 1]) != (Q1[:, 1] > P[:, 1])
+    Safe = numpy.where(Straddles, Q1[:, 1] - Q0[:, 1], 1)
+    CrossX = Q0[:, 0] + (P[:, 1] - Q0[:, 1]) * (Q1[:, 0] - Q0[:, 0]) / Safe
+    Crossings = numpy.bincount(PairOwners, weights=(Straddles & (CrossX > P[:, 0])), minlength=Pairs.shape[1])
+    Inside[Pairs[0][Crossings % 2 == 1]] = True
+    return Inside
+
+
+# Whether each piece (given by its midpoint and its segment's pairs with Edges) lies within Tolerance of one of the paired edges
+def _OnBoundary(Midpoints, PieceSegments, Edges, Pairs, Tolerance):
+    OnBoundary = numpy.zeros(len(Midpoints), dtype=bool)
+    if Pairs.shape[1] == 0:
+        return OnBoundary
+    PairStarts = numpy.searchsorted(Pairs[0], PieceSegments, "left")
+    PairCounts = numpy.searchsorted(Pairs[0], PieceSegments, "right") - PairStarts
+    Pieces, PairPositions = _Expand(PairStarts, PairCounts)
+    EdgePositions = Pairs[1][PairPositions]
+    Near = _PointSegmentDistance(Midpoints[Pieces], Edges.Starts[EdgePositions], Edges.Ends[EdgePositions]) <= Tolerance
+    OnBoundary[Pieces[Near]] = True
+    return OnBoundary
+
+
+# Pairs of segments and edges of a layer within Tolerance of each other, for the segments that are Near the layer
+def _EdgePairs(Boxes, Edges, Near, Tolerance):
+    Subset = numpy.flatnonzero(Near)
+    Pairs = Edges.EdgeGrid.Query(Boxes[Subset], Tolerance)
+    Pairs[0] = Subset[Pairs[0]]
+    return Pairs
+
+
+# Whether each piece is on the boundary of, or inside, a polygon of a layer (only pieces of the segments that are Near the layer are tested)
+def _InLayer(Midpoints, PieceSegments, Edges, Pairs, Near, Tolerance):
+    InLayer = numpy.zeros(len(Midpoints), dtype=bool)
+    Pieces = numpy.flatnonzero(Near[PieceSegments])
+    InLayer[Pieces] = _OnBoundary(Midpoints[Pieces], PieceSegments[Pieces], Edges, Pairs, Tolerance) | _Inside(Midpoints[Pieces], Edges)
+    return InLayer
+
+
+# SEGMENT LENGTHS FUNCTION:
+# Splits the segments at the context and exclusion edges and returns, per segment, (length outside the exclusion, of which in the context, length in the exclusion)
+'''NOTES:
+    NearContext and NearExclusion (optional) are boolean arrays of the segments that can reach the layer at all (e.g. those of the sites whose envelopes overlap a polygon's envelope); the others are not tested against it.
+'''
+def SegmentLengths_Fnx(Starts, Ends, Context, Exclusion, Tolerance, NearContext=None, NearExclusion=None):
+    NearContext = numpy.ones(len(Starts), dtype=bool) if NearContext is None else NearContext
+    NearExclusion = numpy.ones(len(Starts), dtype=bool) if NearExclusion is None else NearExclusion
+    Boxes = _SegmentBoxes(Starts, Ends)
+    ContextPairs = _EdgePairs(Boxes, Context, NearContext, Tolerance)
+    ExclusionPairs = _EdgePairs(Boxes, Exclusion, NearExclusion, Tolerance)
+
+    # Every split parameter of every segment, with the two ends of the segment
+    SplitSegments, SplitParameters = [numpy.arange(len(Starts)), numpy.arange(len(Starts))], [numpy.zeros(len(Starts)), numpy.ones(len(Starts))]
+    for Edges, Pairs in ((Context, ContextPairs), (Exclusion, ExclusionPairs)):
+        Segments, Parameters = _SplitParameters(Starts, Ends, Edges, Pairs, Tolerance)
+        SplitSegments.append(Segments)
+        SplitParameters.append(Parameters)
+    SplitSegments, SplitParameters = numpy.concatenate(SplitSegments), numpy.concatenate(SplitParameters)
+    Order = numpy.lexsort((SplitParameters, SplitSegments))
+    SplitSegments, SplitParameters = SplitSegments[Order], SplitParameters[Order]
+
+    # Pieces between consecutive split parameters of the same segment
+    Consecutive = (SplitSegments[:-1] == SplitSegments[1:]) & (SplitParameters[1:] > SplitParameters[:-1])
+    PieceSegments = SplitSegments[:-1][Consecutive]
+    T0, T1 = SplitParameters[:-1][Consecutive], SplitParameters[1:][Consecutive]
+    D = Ends[PieceSegments] - Starts[PieceSegments]
+    Midpoints = Starts[PieceSegments] + D * ((T0 + T1) / 2)[:, None]
+    PieceLengths = (T1 - T0) * numpy.hypot(D[:, 0], D[:, 1])
+
+    InContext = _InLayer(Midpoints, PieceSegments, Context, ContextPairs, NearContext, Tolerance)
+    InExclusion = _InLayer(Midpoints, PieceSegments, Exclusion, ExclusionPairs, NearExclusion, Tolerance)
+
+    Count = len(Starts)
+    Remaining = numpy.bincount(PieceSegments, weights=PieceLengths * ~InExclusion, minlength=Count)
+    InContextLength = numpy.bincount(PieceSegments, weights=PieceLengths * (~InExclusion & InContext), minlength=Count)
+    Excluded = numpy.bincount(PieceSegments, weights=PieceLengths * InExclusion, minlength=Count)
+    return Remaining, InContextLength, Excluded
+
+
+# SHARED BOUNDARY FUNCTION:
+# Boundary lengths of every site in one sweep; returns (KeyField values, meters outside the exclusion, meters of that in the context, meters removed by the exclusion)
+'''NOTES:
+    Tolerance is a linear unit (e.g. "0.001 Meters"): boundaries closer than that to a context or exclusion edge count as coincident with it.
+'''
+def SharedBoundary_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, KeyField="Match_ID", Tolerance="0.001 Meters"):
+    ToleranceMeters = PCAT_Backends.LinearUnitToMeters_Fnx(Tolerance)
+    Starts, Ends, SegmentKeys = BoundarySegments_Fnx(Backend, OutputLayer, KeyField)
+    Context = PolygonEdges.FromLayer(Backend, ContextLayer)
+    Exclusion = PolygonEdges.FromLayer(Backend, ExclusionLayer)
+
+    Keys, SegmentSites = numpy.unique(SegmentKeys, return_inverse=True)
+
+    # Only the sites whose envelopes come near a polygon's envelope are tested against that layer
+    SiteBoxes = numpy.tile(numpy.array([numpy.inf, numpy.inf, -numpy.inf, -numpy.inf]), (len(Keys), 1))
+    SegmentBoxes = _SegmentBoxes(Starts, Ends)
+    for Column, Reduce in enumerate((numpy.minimum, numpy.minimum, numpy.maximum, numpy.maximum)):
+        Reduce.at(SiteBoxes[:, Column], SegmentSites, SegmentBoxes[:, Column])
+    NearContext, NearExclusion = [numpy.isin(SegmentSites, Layer.PolygonGrid.Query(SiteBoxes, ToleranceMeters)[0]) for Layer in (Context, Exclusion)]
+
+    Remaining, InContext, Excluded = numpy.zeros(len(Keys)), numpy.zeros(len(Keys)), numpy.zeros(len(Keys))
+    for Start in range(0, len(Starts), ChunkSegments):
+        Chunk = slice(Start, Start + ChunkSegments)
+        Lengths = SegmentLengths_Fnx(Starts[Chunk], Ends[Chunk], Context, Exclusion, ToleranceMeters, NearContext[Chunk], NearExclusion[Chunk])
+        for Total, Length in zip((Remaining, InContext, Excluded), Lengths):
+            Total += numpy.bincount(SegmentSites[Chunk], weights=Length, minlength=len(Keys))
+    return Keys, Remaining, InContext, Excluded
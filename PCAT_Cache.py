@@ -0,0 +1,242 @@
+'''
+PREPARED LAYER CACHE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The context and exclusion files change a few times a year, while the tool is run on new analysis files much more
+often. Everything that only depends on the context, the exclusion and the parameters (the dissolved context, the
+context minus the exclusion, the indexed exclusion, the convex hull, the negative space and the narrow/near
+connectivity areas) is prepared once and kept in a cache folder on local disk, so that later runs load it instead of
+redoing that work.
+
+Each cache entry is a folder named after a SHA-1 key of the content of the input files (not their names or dates)
+and the parameters. The cache is bounded in size: when it grows past MaxBytes, the least recently used entries are
+deleted.
+
+The site metrics cache (SiteMetricsCache) goes one step further for analysis files that change a little from week
+to week: it keeps the calculated fields of every site in a SQLite file, keyed by a hash of the site's geometry, so
+that only new or changed sites, and sites near changed context or exclusion features, are calculated again.
+
+'''
+import os, json, time, shutil, sqlite3, hashlib, tempfile, collections
+import numpy
+
+
+# Files that make up a shapefile (all of them are hashed, so that e.g. a change to the .dbf or .prj alone is noticed)
+ShapefileExtensions = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+
+# Returns a SHA-1 key of the content of the input files and of the parameters (a dictionary of JSON-friendly values)
+def CacheKey_Fnx(InputFiles, Parameters):
+    Hash = hashlib.sha1()
+    for InputFile in InputFiles:
+        Root, Extension = os.path.splitext(InputFile)
+        if Extension.lower() == ".shp":
+            Parts = [Root + PartExtension for PartExtension in ShapefileExtensions if os.path.exists(Root + PartExtension)]
+        else:
+            Parts = [InputFile]
+        for Part in Parts:
+            Hash.update(os.path.splitext(Part)[1].lower().encode("utf-8"))
+            with open(Part, "rb") as source:
+                for Block in iter(lambda: source.read(1 << 20), b""):
+                    Hash.update(Block)
+    Hash.update(json.dumps(Parameters, sort_keys=True).encode("utf-8"))
+    return Hash.hexdigest()
+
+
+class PreparedLayerCache(object):
+    '''NOTES:
+        Entries are written into a temporary folder and renamed into place when they are complete, so an interrupted run never leaves a half-written entry behind.
+        The last time each entry was used is kept in its entry.json file, which is what the least recently used eviction goes by.
+    '''
+    def __init__(self, CacheFolder, MaxBytes=2 * 1024 ** 3):
+        self.CacheFolder = CacheFolder
+        self.MaxBytes = MaxBytes
+        if not os.path.isdir(CacheFolder):
+            os.makedirs(CacheFolder)
+
+    def _EntryFolder(self, Key):
+        return os.path.join(self.CacheFolder, Key)
+
+    # Returns the folder of the entry, or None when it is not cached; marks the entry as used
+    def Get(self, Key):
+        EntryFolder = self._EntryFolder(Key)
+        if not os.path.exists(os.path.join(EntryFolder, "entry.json")):
+            return None
+        self._Touch(EntryFolder)
+        return EntryFolder
+
+    # Builds a new entry: BuildFunction(Folder) writes the entry's files into Folder. Returns the folder of the entry
+    def Put(self, Key, BuildFunction):
+        EntryFolder = self._EntryFolder(Key)
+        BuildFolder = tempfile.mkdtemp(prefix=Key + "_", dir=self.CacheFolder)
+        try:
+            BuildFunction(BuildFolder)
+            with open(os.path.join(BuildFolder, "entry.json"), "w") as entry:
+                json.dump({"Key": Key, "Created": time.time(), "LastUsed": time.time()}, entry)
+            if os.path.exists(EntryFolder):
+                shutil.rmtree(EntryFolder)
+            os.rename(BuildFolder, EntryFolder)
+        except Exception:
+            shutil.rmtree(BuildFolder, ignore_errors=True)
+            raise
+        self.Evict(Keep=Key)
+        return EntryFolder
+
+    # Deletes the least recently used entries until the cache fits in MaxBytes (the entry Keep is never deleted)
+    def Evict(self, Keep=None):
+        Entries = []
+        for Name in os.listdir(self.CacheFolder):
+            EntryFolder = os.path.join(self.CacheFolder, Name)
+            EntryFile = os.path.join(EntryFolder, "entry.json")
+            if not os.path.isfile(EntryFile):
+                continue
+            try:
+                with open(EntryFile) as entry:
+                    LastUsed = json.load(entry)["LastUsed"]
+            except (ValueError, KeyError, IOError):
+                LastUsed = 0
+            Entries.append([LastUsed, Name, _FolderBytes(EntryFolder)])
+
+        TotalBytes = sum(Entry[2] for Entry in Entries)
+        for LastUsed, Name, Bytes in sorted(Entries):
+            if TotalBytes <= self.MaxBytes:
+                break
+            if Name == Keep:
+                continue
+            shutil.rmtree(os.path.join(self.CacheFolder, Name), ignore_errors=True)
+            TotalBytes -= Bytes
+
+    def _Touch(self, EntryFolder):
+        EntryFile = os.path.join(EntryFolder, "entry.json")
+        with open(EntryFile) as entry:
+            Entry = json.load(entry)
+        Entry["LastUsed"] = time.time()
+        with open(EntryFile, "w") as entry:
+            json.dump(Entry, entry)
+
+
+def _FolderBytes(Folder):
+    Total = 0
+    for Root, Folders, Files in os.walk(Folder):
+        for Name in Files:
+            Total += os.path.getsize(os.path.join(Root, Name))
+    return Total
+
+
+# #########################################################################
+# Site Metrics Cache
+# #########################################################################
+
+# SHA-1 of a shape's WKB (an empty string for a null shape)
+def ShapeHash_Fnx(Shape):
+    return hashlib.sha1(Shape).hexdigest() if Shape is not None else ""
+
+
+class SiteMetricsCache(object):
+    '''NOTES:
+        One SQLite file can hold the metrics of several parameter sets; each set is identified by a fingerprint of its Parameters (a dictionary of JSON-friendly values).
+        A site's fields only depend on its geometry and on the context and exclusion features within HaloDistance of it, so the metrics are stored by geometry hash with the site's envelope:
+            Sites       fingerprint, geometry hash, envelope, the site fields (as JSON) and the connectivity score
+            Inputs      fingerprint, layer, feature hash and envelope of every context and exclusion feature the stored metrics were calculated with
+            Runs        fingerprint and the hash of the study area hull
+        UpdateInputs compares the current context and exclusion features with the stored ones. Every stored site within HaloDistance of an added or removed feature is deleted,
+        and when the study area hull changed (which moves the edge of the narrow areas), the connectivity score of every stored site is cleared.
+    '''
+    def __init__(self, CacheFile, Parameters):
+        self.Connection = sqlite3.connect(CacheFile)
+        self.Fingerprint = hashlib.sha1(json.dumps(Parameters, sort_keys=True).encode("utf-8")).hexdigest()
+        with self.Connection:
+            self.Connection.execute("CREATE TABLE IF NOT EXISTS Sites (Fingerprint TEXT, GeometryHash TEXT, XMin REAL, YMin REAL, XMax REAL, YMax REAL, "
+                                    "SiteFields TEXT, ConScore INTEGER, PRIMARY KEY (Fingerprint, GeometryHash))")
+            self.Connection.execute("CREATE TABLE IF NOT EXISTS Inputs (Fingerprint TEXT, Layer TEXT, FeatureHash TEXT, XMin REAL, YMin REAL, XMax REAL, YMax REAL)")
+            self.Connection.execute("CREATE INDEX IF NOT EXISTS InputsByFingerprint ON Inputs (Fingerprint)")
+            self.Connection.execute("CREATE TABLE IF NOT EXISTS Runs (Fingerprint TEXT PRIMARY KEY, HullHash TEXT, LastUsed REAL)")
+
+    def Close(self):
+        self.Connection.close()
+
+    # Compares the current context/exclusion features with those of the stored metrics and drops the metrics they change
+    '''NOTES:
+        InputShapes is {Layer name: (list of WKB, envelopes)} for every context and exclusion layer, HullShape the WKB of the study area hull.
+        Returns the number of stored sites that were deleted (or -1 when there was nothing stored for these parameters yet).
+    '''
+    def UpdateInputs(self, InputShapes, HullShape, HaloDistance):
+        Cursor = self.Connection.cursor()
+        Run = Cursor.execute("SELECT HullHash FROM Runs WHERE Fingerprint = ?", (self.Fingerprint,)).fetchone()
+        HullHash = ShapeHash_Fnx(HullShape)
+
+        with self.Connection:
+            if Run is None:
+                Deleted = -1
+                Cursor.execute("DELETE FROM Sites WHERE Fingerprint = ?", (self.Fingerprint,))
+            else:
+                # Envelopes of the features that were added or removed since the metrics were stored (a changed feature is both)
+                Changed = []
+                for Layer, (Shapes, Bounds) in InputShapes.items():
+                    Current = collections.defaultdict(list)
+                    for Shape, Bound in zip(Shapes, Bounds):
+                        Current[ShapeHash_Fnx(Shape)].append(Bound)
+                    for FeatureHash, XMin, YMin, XMax, YMax in Cursor.execute("SELECT FeatureHash, XMin, YMin, XMax, YMax FROM Inputs WHERE Fingerprint = ? AND Layer = ?",
+                                                                               (self.Fingerprint, Layer)).fetchall():
+                        if Current[FeatureHash]:
+                            Current[FeatureHash].pop()
+                        else:
+                            Changed.append([XMin, YMin, XMax, YMax])
+                    for Remaining in Current.values():
+                        Changed.extend(Remaining)
+
+                Deleted = 0
+                for XMin, YMin, XMax, YMax in Changed:
+                    if XMin is None or XMin != XMin:
+                        continue
+                    Deleted += Cursor.execute("DELETE FROM Sites WHERE Fingerprint = ? AND XMax >= ? AND XMin <= ? AND YMax >= ? AND YMin <= ?",
+                                              (self.Fingerprint, XMin - HaloDistance, XMax + HaloDistance, YMin - HaloDistance, YMax + HaloDistance)).rowcount
+                if Run[0] != HullHash:
+                    Cursor.execute("UPDATE Sites SET ConScore = NULL WHERE Fingerprint = ?", (self.Fingerprint,))
+
+            # The current features are what the stored metrics are calculated with from now on
+            Cursor.execute("DELETE FROM Inputs WHERE Fingerprint = ?", (self.Fingerprint,))
+            for Layer, (Shapes, Bounds) in InputShapes.items():
+                Cursor.executemany("INSERT INTO Inputs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   ((self.Fingerprint, Layer, ShapeHash_Fnx(Shape)) + tuple(_Nullable(Value) for Value in Bound) for Shape, Bound in zip(Shapes, Bounds)))
+            Cursor.execute("INSERT OR REPLACE INTO Runs VALUES (?, ?, ?)", (self.Fingerprint, HullHash, time.time()))
+        return Deleted
+
+    # Looks up the sites by geometry hash; returns ({field: array}, whether the fields of each site were cached, connectivity scores with -1 where not cached)
+    def Lookup(self, GeometryHashes, FieldNames):
+        Stored = {}
+        Cursor = self.Connection.cursor()
+        Unique = list(set(GeometryHashes))
+        for Start in range(0, len(Unique), 500):
+            Batch = Unique[Start:Start + 500]
+            Query = "SELECT GeometryHash, SiteFields, ConScore FROM Sites WHERE Fingerprint = ? AND GeometryHash IN (" + ",".join("?" * len(Batch)) + ")"
+            for GeometryHash, SiteFields, ConScore in Cursor.execute(Query, [self.Fingerprint] + Batch):
+                Stored[GeometryHash] = (json.loads(SiteFields) if SiteFields else None, ConScore)
+
+        Fields = collections.OrderedDict((FieldName, numpy.full(len(GeometryHashes), numpy.nan)) for FieldName in FieldNames)
+        Found = numpy.zeros(len(GeometryHashes), dtype=bool)
+        ConScores = numpy.full(len(GeometryHashes), -1, dtype=numpy.int64)
+        for Position, GeometryHash in enumerate(GeometryHashes):
+            SiteFields, ConScore = Stored.get(GeometryHash, (None, None))
+            if SiteFields is not None and all(FieldName in SiteFields for FieldName in FieldNames):
+                for FieldName in FieldNames:
+                    Fields[FieldName][Position] = SiteFields[FieldName]
+                Found[Position] = True
+            if ConScore is not None:
+                ConScores[Position] = ConScore
+        return Fields, Found, ConScores
+
+    # Stores the fields ({field: array}) and connectivity scores of the sites
+    def Store(self, GeometryHashes, Bounds, Fields, ConScores):
+        FieldNames = list(Fields.keys())
+        Rows = []
+        for Position, GeometryHash in enumerate(GeometryHashes):
+            SiteFields = json.dumps(dict((FieldName, float(Fields[FieldName][Position])) for FieldName in FieldNames))
+            Rows.append((self.Fingerprint, GeometryHash) + tuple(_Nullable(Value) for Value in Bounds[Position]) + (SiteFields, int(ConScores[Position])))
+        with self.Connection:
+            self.Connection.executemany("INSERT OR REPLACE INTO Sites VALUES (?, ?, ?, ?, ?, ?, ?, ?)", Rows)
+
+
+# NaN (e.g. the envelope of a null shape) is stored as NULL
+def _Nullable(Value):
+    Value = float(Value)
+    return None if Value != Value else Value
@@ -0,0 +1,95 @@
+'''
+STAGE CHECKPOINTS FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+A run on a large analysis file takes hours, most of it in the buffer rings and the connectivity buffering. Without
+checkpoints, a run that fails near the end (or is stopped) has to redo every stage. With them (--checkpoints), each
+stage (perimeter, buffer rings, connectivity, final score) saves the fields it calculated as soon as it is done, and a
+later run with --resume loads them instead of calculating them again. They are off by default, since the fingerprint
+reads every byte of the input files.
+
+The checkpoints of a run are kept in a folder next to the output, named after it (<output>_<extension>_checkpoint, so
+runs writing the same analysis file in two output formats keep separate checkpoints):
+
+    checkpoint.json     the manifest: a fingerprint of the input files (a SHA-1 of their content, see
+                        PCAT_Cache.CacheKey_Fnx) and, for every completed stage, its parameters, fields, file and time
+    <stage>.npz         the fields of the stage, by Match_ID (ResultsStore.SaveColumns), which load back in moments
+    prepared/           the prepared context and exclusion, when the run has no cache folder of its own (a
+                        PCAT_Cache.PreparedLayerCache), so that a resumed run does not buffer the narrowness again
+
+A stage is only reused when the input files are unchanged and its own parameters are the same, so e.g. a run with
+another narrowness width reuses the perimeter and buffer rings and only calculates the connectivity and final score
+again. The manifest and the stage files are written under temporary names and renamed into place, so a run that is
+stopped while writing them never leaves a half-written checkpoint. The folder is deleted once the output is written.
+
+'''
+import os, json, time, shutil, collections
+
+import PCAT_Cache
+from PCAT_Backends import AddMessage
+
+
+ManifestName = "checkpoint.json"
+
+
+class Checkpoint(object):
+    '''NOTES:
+        InputFiles are the context, analysis and exclusion files; they must be files (shapefiles or GeoPackages), since their content is what the fingerprint is taken of.
+        Without Resume, the checkpoints of an earlier run in the folder are deleted and every stage is calculated (and recorded).
+        Stage parameters must be JSON-friendly; a stage that uses the fields of another stage should include that stage's parameters in its own.
+    '''
+    def __init__(self, CheckpointFolder, InputFiles, Resume=False):
+        self.CheckpointFolder = CheckpointFolder
+        self.ManifestFile = os.path.join(CheckpointFolder, ManifestName)
+        self.Inputs = PCAT_Cache.CacheKey_Fnx(InputFiles, {})
+
+        Manifest = None
+        if Resume and os.path.isfile(self.ManifestFile):
+            try:
+                with open(self.ManifestFile) as manifest:
+                    Manifest = json.load(manifest)
+            except ValueError:
+                AddMessage(" ... the checkpoint manifest can not be read, calculating every stage")
+            if Manifest is not None and Manifest.get("Inputs") != self.Inputs:
+                AddMessage(" ... the input files have changed since the checkpoints were saved, calculating every stage")
+                Manifest = None
+        elif Resume:
+            AddMessage(" ... no checkpoints to resume from in " + CheckpointFolder)
+
+        if Manifest is None:
+            if os.path.isdir(CheckpointFolder):
+                shutil.rmtree(CheckpointFolder)
+            os.makedirs(CheckpointFolder)
+            Manifest = {"Inputs": self.Inputs, "Stages": {}}
+        self.Stages = collections.OrderedDict(Manifest["Stages"])
+
+    # Loads the fields of a completed stage into Results when its parameters are unchanged; returns whether it did
+    def Resume(self, Stage, Results, Parameters):
+        Entry = self.Stages.get(Stage)
+        if Entry is None:
+            return False
+        if Entry["Parameters"] != _Plain(Parameters):
+            AddMessage(" ... the parameters of the " + Stage + " stage have changed since its checkpoint, calculating it again")
+            return False
+        Results.LoadColumns(os.path.join(self.CheckpointFolder, Entry["File"]))
+        AddMessage(" ... resuming: the " + Stage + " stage was completed on " + Entry["Finished"] + " (in %.1f seconds), loaded its fields" % Entry["Seconds"])
+        return True
+
+    # Records a completed stage: saves its fields (FieldNames of Results) and adds it to the manifest
+    def Save(self, Stage, Results, FieldNames, Parameters, Seconds):
+        StageFile = Stage.replace(" ", "_") + ".npz"
+        Results.SaveColumns(os.path.join(self.CheckpointFolder, StageFile + ".tmp"), FieldNames)
+        os.replace(os.path.join(self.CheckpointFolder, StageFile + ".tmp"), os.path.join(self.CheckpointFolder, StageFile))
+        self.Stages[Stage] = {"Parameters": _Plain(Parameters), "Fields": list(FieldNames), "File": StageFile,
+                              "Seconds": Seconds, "Finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(self.ManifestFile + ".tmp", "w") as manifest:
+            json.dump({"Inputs": self.Inputs, "Stages": self.Stages}, manifest, indent=1)
+        os.replace(self.ManifestFile + ".tmp", self.ManifestFile)
+
+    # Deletes the checkpoints (once the output is written)
+    def Finish(self):
+        shutil.rmtree(self.CheckpointFolder, ignore_errors=True)
+
+
+# Parameters as they read back from JSON (tuples become lists), so that they compare equal to the recorded ones
+def _Plain(Parameters):
+    return json.loads(json.dumps(Parameters, sort_keys=True))
@@ -0,0 +1,207 @@
+'''
+GAP GRAPH CONNECTIVITY FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The vector connectivity calculation (ConnectivityZones_Fnx) buffers the whole negative space in and out: one polygon
+the size of the study area, with a hole for every conservation patch, whose cost grows with the whole region rather
+than with the gaps that make narrow areas. The gap graph finds those gaps first and only buffers around them:
+
+    1) the dissolved context is split into patches (the nodes), and every pair of patches within twice the narrowness
+       width of each other is found with a spatial index (the edges, with their distances)
+    2) the patches are grouped into the connected components of the graph; a patch is "active" when its component has
+       an edge, or when it is not convex (it has a hole or a reflex corner)
+    3) each component with an active patch gets a window: its active patches buffered by three times the width, minus
+       the context, inside the study area; the windows are opened (buffered in and out by the width) on their own
+    4) the narrow areas are what the openings remove within the width of an active patch (and inside the convex hull);
+       the near areas are the land within the width of a narrow area, as before
+
+The narrow and near areas are the same as those of ConnectivityZones_Fnx. Whether a point is narrow only depends on the
+negative space within twice the width of it, and a narrow point is always within the width of a patch; a window holds
+everything within twice the width of the points it is used for. A convex patch with no other patch within twice the
+width has no narrow area next to it at all (a circle of the width fits on its outside at every point), so it needs no
+window. The cost therefore grows with the number of close patch pairs and the size of their components, not with the
+study area. This needs the narrowness width to be less than half of the study area buffer (StudyAreaBuffer), so that
+the edge of the study area can never make a narrow area; for larger widths the tool falls back to ConnectivityZones_Fnx.
+
+The graph is kept with the prepared layers (and in the prepared layer cache), and can be exported as a table of its
+edges for reuse (--gap-graph): one row per close pair of patches, with the distance, the component and the centers of
+the envelopes of both patches.
+
+To use from the command line:
+    python TNC_ArcPyConservationTool.py context.shp parcels.shp exclusion.shp "" "25 Meters" --connectivity graph --gap-graph gaps.csv
+
+'''
+import os, csv
+import numpy
+
+import PCAT_Backends
+import PCAT_Profile
+from PCAT_Backends import AddMessage
+
+
+# Field of the patches with the number of their component (-1 for the patches that need no window)
+ComponentField = "Comp_ID"
+# Extra distance (in meters) added to the windows and to the reach of the narrow areas, since the buffers are only approximations of circles
+Margin = 1.0
+
+
+class GapGraph(object):
+    '''NOTES:
+        Keys are the keys of the patches (as in Backend.ReadShapes), Bounds their envelopes (XMin, YMin, XMax, YMax rows) and Convex whether each is convex.
+        First, Second and Distances are the edges: positions of the two patches (First < Second) and the distance between them in meters.
+        Saved in (and loaded from) the prepared layer cache as one compressed .npz file, like PCAT_Raster.ConnectivityRaster.
+    '''
+    def __init__(self, Keys, Bounds, Convex, First, Second, Distances, WidthMeters):
+        self.Keys = numpy.asarray(Keys, dtype=numpy.int64)
+        self.Bounds = numpy.asarray(Bounds, dtype=float).reshape(-1, 4)
+        self.Convex = numpy.asarray(Convex, dtype=bool)
+        self.First = numpy.asarray(First, dtype=numpy.int64)
+        self.Second = numpy.asarray(Second, dtype=numpy.int64)
+        self.Distances = numpy.asarray(Distances, dtype=float)
+        self.WidthMeters = float(WidthMeters)
+        self.Components = ConnectedComponents_Fnx(len(self.Keys), self.First, self.Second)
+
+    # Whether each patch needs a window: its component has an edge, or it is not convex
+    def Active(self):
+        HasEdge = numpy.zeros(len(self.Keys), dtype=bool)
+        HasEdge[self.Components[self.First]] = True
+        return HasEdge[self.Components] | ~self.Convex
+
+    def Save(self, Folder, Name):
+        numpy.savez_compressed(os.path.join(Folder, Name + ".npz"), Keys=self.Keys, Bounds=self.Bounds, Convex=self.Convex,
+                               First=self.First, Second=self.Second, Distances=self.Distances, WidthMeters=self.WidthMeters)
+
+    @classmethod
+    def Load(cls, Folder, Name):
+        with numpy.load(os.path.join(Folder, Name + ".npz")) as Saved:
+            return cls(Saved["Keys"], Saved["Bounds"], Saved["Convex"], Saved["First"], Saved["Second"], Saved["Distances"], float(Saved["WidthMeters"]))
+
+    # Writes the edges as a CSV table: the keys of both patches, the distance, the component and the centers of the envelopes of both patches
+    def SaveTable(self, TableFile):
+        CenterX = (self.Bounds[:, 0] + self.Bounds[:, 2]) / 2
+        CenterY = (self.Bounds[:, 1] + self.Bounds[:, 3]) / 2
+        with open(TableFile, "w", newline="") as table:
+            writer = csv.writer(table)
+            writer.writerow(["Patch_A", "Patch_B", "Dist_M", ComponentField, "A_X", "A_Y", "B_X", "B_Y"])
+            for A, B, Distance in zip(self.First, self.Second, self.Distances):
+                writer.writerow([self.Keys[A], self.Keys[B], "%.3f" % Distance, self.Keys[self.Components[A]],
+                                 "%.3f" % CenterX[A], "%.3f" % CenterY[A], "%.3f" % CenterX[B], "%.3f" % CenterY[B]])
+
+
+# Component of each of Count nodes (the lowest node position in it), from the edges First-Second, by label propagation with pointer jumping
+def ConnectedComponents_Fnx(Count, First, Second):
+    Labels = numpy.arange(Count, dtype=numpy.int64)
+    while len(First):
+        Lowest = numpy.minimum(Labels[First], Labels[Second])
+        New = Labels.copy()
+        numpy.minimum.at(New, First, Lowest)
+        numpy.minimum.at(New, Second, Lowest)
+        New = New[New]
+        if (New == Labels).all():
+            break
+        Labels = New
+    return Labels
+
+
+# Whether each of the polygons of Keys is convex: a single ring (no holes, one part) whose corners all turn the same way
+def ConvexPolygons_Fnx(Coordinates, RingIDs, RingKeys, Keys):
+    RingCounts = numpy.bincount(numpy.searchsorted(Keys, RingKeys), minlength=len(Keys))
+    Convex = RingCounts == 1
+    if len(Coordinates) < 2:
+        return Convex
+
+    # Turn at every corner of every (closed) ring: the cross product of the edges before and after it
+    SameRing = RingIDs[1:] == RingIDs[:-1]
+    Edges = numpy.diff(Coordinates, axis=0)[SameRing]
+    EdgeRings = RingIDs[1:][SameRing]
+    RingStart = numpy.r_[True, EdgeRings[1:] != EdgeRings[:-1]]
+    Previous = numpy.roll(Edges, 1, axis=0)
+    # (the corner at the start of a ring turns from the last edge of the same ring)
+    RingLast = numpy.r_[numpy.flatnonzero(RingStart)[1:] - 1, len(Edges) - 1]
+    Previous[RingStart] = Edges[RingLast]
+    Turns = Previous[:, 0] * Edges[:, 1] - Previous[:, 1] * Edges[:, 0]
+
+    Left = numpy.bincount(EdgeRings, weights=Turns > 0, minlength=len(RingKeys)) > 0
+    Right = numpy.bincount(EdgeRings, weights=Turns < 0, minlength=len(RingKeys)) > 0
+    RingPositions = numpy.searchsorted(Keys, RingKeys)
+    Convex[RingPositions[Left & Right]] = False
+    return Convex
+
+
+# GAP GRAPH FUNCTION:
+# This function builds the gap graph of the context patches for a narrowness width (steps 1 and 2 above); returns (the patches layer, the GapGraph)
+@PCAT_Profile.Profiled("gap graph")
+def BuildGapGraph_Fnx(Backend, ContextDissolved, Width):
+    WidthMeters = PCAT_Backends.LinearUnitToMeters_Fnx(Width)
+
+    AddMessage(" ... splitting context into patches")
+    Patches = Backend.Explode(ContextDissolved)
+    Keys, Shapes, Bounds = Backend.ReadShapes(Patches)
+    Convex = ConvexPolygons_Fnx(*(Backend.ReadRings(Patches) + (Keys,)))
+
+    AddMessage(" ... finding the patches within twice the width of each other")
+    First, Second, Distances = Backend.NearPairs(Patches, str(2 * WidthMeters) + " Meters")
+    Graph = GapGraph(Keys, Bounds, Convex, numpy.searchsorted(Keys, First), numpy.searchsorted(Keys, Second), Distances, WidthMeters)
+
+    Active = Graph.Active()
+    AddMessage("     " + str(len(Keys)) + " patches, " + str(len(First)) + " gaps, " +
+               str(len(numpy.unique(Graph.Components[Active]))) + " windows over " + str(int(Active.sum())) + " patches")
+    return Patches, Graph
+
+
+# GAP GRAPH ZONES FUNCTION:
+# This function finds the narrow and near areas of ConnectivityZones_Fnx inside windows around the close patches only (steps 3 and 4 above)
+'''NOTES:
+    StudyArea is the convex hull buffered by the study area buffer (the negative space is StudyArea minus ContextDissolved).
+    Returns (narrow areas, near areas, GapGraph), with one narrow and one near feature per window; the windows overlap, so the same narrow area can be in more than one feature.
+    The sites touching them are the same as for the narrow and near areas of ConnectivityZones_Fnx.
+'''
+@PCAT_Profile.Profiled("connectivity zones")
+def GapGraphZones_Fnx(Backend, ContextDissolved, StudyArea, ConvexHull, Width):
+    Patches, Graph = BuildGapGraph_Fnx(Backend, ContextDissolved, Width)
+    Active = Graph.Active()
+
+    AddMessage(" ... building windows around the gaps")
+    Patches = Backend.AddValueField(Patches, ComponentField, Graph.Keys[Active], Graph.Keys[Graph.Components[Active]])
+    ActivePatches = Backend.Subset(Patches, ComponentField, numpy.unique(Graph.Keys[Graph.Components[Active]]))
+    WindowBuffers = Backend.Buffer(ActivePatches, WindowDistance_Fnx(Width), "FULL")
+    Windows = Backend.Dissolve(WindowBuffers, ComponentField)
+
+    NarrowAreas, NearAreas = WindowZones_Fnx(Backend, Windows, ActivePatches, Patches, StudyArea, ConvexHull, Width)
+    Backend.Delete(Patches, ActivePatches, WindowBuffers, Windows)
+    return NarrowAreas, NearAreas, Graph
+
+
+# Distance to buffer the features that narrow areas are needed near by, for their windows: three widths, and the margin for the approximations of the circles
+def WindowDistance_Fnx(Width):
+    return str(3 * PCAT_Backends.LinearUnitToMeters_Fnx(Width) + Margin) + " Meters"
+
+
+# WINDOW ZONES FUNCTION:
+# This function finds the narrow and near areas of the negative space within the width of the features of Centers, from windows around them (steps 3 and 4 above)
+'''NOTES:
+    Windows must hold the features of Centers buffered by WindowDistance_Fnx; ContextLayer is the context to erase from them (the negative space is StudyArea minus the context).
+    Returns (narrow areas, near areas), one feature per window. Every narrow area within the width of a feature of Centers is found, exactly as ConnectivityZones_Fnx would find it, so the
+    narrow and near areas touching those features are the same; further from them, the edges of the windows make narrow areas of their own, which are left out.
+'''
+def WindowZones_Fnx(Backend, Windows, Centers, ContextLayer, StudyArea, ConvexHull, Width):
+    WidthMeters = PCAT_Backends.LinearUnitToMeters_Fnx(Width)
+    StudyWindows = Backend.Clip(Windows, StudyArea)
+    LocalSpace = Backend.Erase(StudyWindows, ContextLayer, "1 Meters")
+
+    # The same opening as ConnectivityZones_Fnx, on each window
+    AddMessage(" ... finding narrowness in the windows")
+    InnerBuffer = Backend.Buffer(LocalSpace, "-" + Width, "FULL")
+    OutterBuffer = Backend.Buffer(InnerBuffer, Width, "FULL")
+    NarrowAreas = Backend.Erase(LocalSpace, OutterBuffer)
+
+    # Only the narrow areas within the width of a center hold for the whole negative space (further into a window, its edge makes narrowness of its own)
+    Reach = Backend.Buffer(Centers, str(WidthMeters + Margin) + " Meters", "FULL")
+    NarrowReach = Backend.Clip(NarrowAreas, Reach)
+    NarrowAreas_NoBuffer = Backend.Clip(NarrowReach, ConvexHull)
+
+    # The narrow areas stay one feature per window, so that each is buffered on its own (the near areas of a window can overlap the narrow areas of another, which score as connected anyway)
+    AddMessage(" ... buffering the narrow areas")
+    NearConnectivity = Backend.Buffer(NarrowAreas_NoBuffer, Width, "OUTSIDE_ONLY")
+
+    Backend.Delete(StudyWindows, LocalSpace, InnerBuffer, OutterBuffer, NarrowAreas, Reach, NarrowReach)
+    return NarrowAreas_NoBuffer, NearConnectivity
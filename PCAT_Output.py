@@ -0,0 +1,326 @@
+'''
+OUTPUT FORMATS FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The output of the tool is a copy of the analysis file with the calculated fields added. A shapefile is limited to
+2 GB and 10 character field names, and a dashboard that only needs one score has to read (and decode) every geometry
+to get it. The output can also be written as:
+
+    GeoParquet  (.parquet) a columnar file: every field is a column of its own, so a reader can fetch PCAT_Scr or a
+                ring percentage without touching the geometry column. The rows are sorted along a Hilbert curve
+                of the centers of their envelopes and cut into row groups of RowGroupSize sites, so every row group
+                is a compact area; every column has statistics (minimum, maximum, null count) per row group and per
+                page, and a "bbox" column (xmin, ymin, xmax, ymax) lets readers skip the row groups outside an area
+                of interest from those statistics alone. The geometry is WKB, described by the "geo" metadata of
+                GeoParquet 1.1 (with the coordinate system as PROJJSON when Fiona is available to convert it).
+    GeoPackage  (.gpkg) the sites as a feature table (as before), plus an attributes table (MetricsTable) with the
+                Match_ID and the calculated fields only, registered in the GeoPackage so that GIS software lists
+                it, which can be read or joined without reading the geometry blobs.
+
+The file is written in a single pass: the sites are read once from the output layer (or from each chunk in the
+streaming mode, see PCAT_Streaming.py), and each row group is written as soon as it is full. Only one row group is
+held in memory, so the streaming mode stays within its memory bound with GeoParquet as well.
+
+GeoParquet needs pyarrow; GeoPackage and shapefiles are written by the backend (PCAT_Backends.py).
+
+To use from the command line:
+    python TNC_ArcPyConservationTool.py context.shp parcels.shp exclusion.shp "" "25 Meters" --output-format geoparquet
+
+Reading only the scores back (no geometry is read or decoded):
+    pyarrow.parquet.read_table("parcels_PCAT.parquet", columns=["Match_ID", "PCAT_Scr"])
+
+'''
+import os, json, sqlite3, collections
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import fiona.crs
+except ImportError:
+    fiona = None
+
+from PCAT_Streaming import HilbertKeys_Fnx
+
+
+# Output formats and the extension of their files
+OutputFormats = collections.OrderedDict([("shapefile", ".shp"), ("geopackage", ".gpkg"), ("geoparquet", ".parquet")])
+
+# Number of sites per row group of a GeoParquet output
+RowGroupSize = 65536
+
+# Name of the attributes table of the calculated fields in a GeoPackage output
+MetricsTable = "PCAT_Metrics"
+
+# Arrow types of the output field types (see OutputFields in TNC_ArcPyConservationTool.py)
+FieldTypes = {"LONG": "int64", "SHORT": "int64", "DOUBLE": "float64", "FLOAT": "float64", "TEXT": "string"}
+
+# Arrow types of the field types of an input schema (Fiona: "int", "float:24.15", "str:80" ...); dates and times are written as text
+SchemaTypes = {"int": "int64", "int32": "int64", "int64": "int64", "float": "float64", "bool": "bool", "str": "string", "date": "string", "time": "string", "datetime": "string"}
+
+# Names of the WKB geometry type codes
+GeometryTypes = {1: "Point", 2: "LineString", 3: "Polygon", 4: "MultiPoint", 5: "MultiLineString", 6: "MultiPolygon", 7: "GeometryCollection"}
+
+
+# Extension of the output file: that of the OutputFormat, or of the analysis file (a shapefile when it has none)
+def OutputExtension_Fnx(OutputFormat, AnalysisExtension):
+    if OutputFormat:
+        return OutputFormats[OutputFormat]
+    return AnalysisExtension or ".shp"
+
+
+# Order of the rows along a Hilbert curve of the centers of their envelopes (Bounds: XMin, YMin, XMax, YMax); rows without a geometry go last
+def SpatialOrder_Fnx(Bounds):
+    Valid = ~numpy.isnan(Bounds).any(axis=1)
+    Keys = numpy.full(len(Bounds), numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+    if Valid.any():
+        Extent = [Bounds[Valid, 0].min(), Bounds[Valid, 1].min(), Bounds[Valid, 2].max(), Bounds[Valid, 3].max()]
+        Keys[Valid] = HilbertKeys_Fnx((Bounds[Valid, 0] + Bounds[Valid, 2]) / 2, (Bounds[Valid, 1] + Bounds[Valid, 3]) / 2, Extent)
+    return numpy.argsort(Keys, kind="stable")
+
+
+# Name of the geometry type of a WKB geometry (e.g. "Polygon", "MultiPolygon Z")
+def WkbGeometryType_Fnx(Shape):
+    Code = int.from_bytes(bytes(Shape[1:5]), "little" if Shape[0] == 1 else "big")
+    HasZ = bool(Code & 0x80000000) or (Code & 0xFFFF) // 1000 in (1, 3)
+    return GeometryTypes.get((Code & 0xFFFF) % 1000, "Unknown") + (" Z" if HasZ else "")
+
+
+# Coordinate system (WKT) as PROJJSON, for the GeoParquet metadata (None when it is unknown, or when Fiona is not available to convert it)
+def ProjJson_Fnx(Wkt):
+    if not Wkt or fiona is None:
+        return None
+    try:
+        return fiona.crs.CRS.from_wkt(Wkt).to_dict(projjson=True)
+    except Exception:
+        return None
+
+
+# #########################################################################
+# Output Writers
+# #########################################################################
+
+# OUTPUT WRITER FUNCTION:
+# Returns the writer of the output format of nameOfOutput (by its extension): a GeoParquetWriter for .parquet, otherwise a FeatureWriter
+'''NOTES:
+    A writer either saves a whole output layer at once (Save), or is opened with the schema of the analysis file and given the sites a chunk at a time (Open, Write, Close).
+    OutputFields are the calculated fields (see OutputFields in TNC_ArcPyConservationTool.py), whose values are taken from the results store given with the sites.
+'''
+def OutputWriter_Fnx(Backend, nameOfOutput, OutputFields):
+    if nameOfOutput.lower().endswith(".parquet"):
+        return GeoParquetWriter(Backend, nameOfOutput, OutputFields)
+    return FeatureWriter(Backend, nameOfOutput, OutputFields)
+
+
+class FeatureWriter(object):
+    '''NOTES:
+        Writes shapefiles and GeoPackages through the backend (SaveOutput, or OpenOutput and WriteFeatures). A GeoPackage also gets the MetricsTable attributes table (see SaveMetricsTable_Fnx).
+    '''
+    def __init__(self, Backend, nameOfOutput, OutputFields):
+        self.Backend = Backend
+        self.nameOfOutput = nameOfOutput
+        self.OutputFields = OutputFields
+        self.GeoPackage = nameOfOutput.lower().endswith(".gpkg")
+        self.Sink = self.Connection = None
+
+    def Save(self, OutputLayer, Results):
+        self.Backend.SaveOutput(OutputLayer, self.nameOfOutput)
+        if self.GeoPackage:
+            with sqlite3.connect(self.nameOfOutput) as Connection:
+                SaveMetricsTable_Fnx(Connection, Results, self.OutputFields)
+            Connection.close()
+        return self.nameOfOutput
+
+    def Open(self, InputSchema, Crs):
+        self.Sink = self.Backend.OpenOutput(InputSchema, Crs, self.OutputFields, self.nameOfOutput)
+        return self
+
+    # Appends the sites of Layer (their calculated fields already written into it with WriteResults); Results holds the same fields
+    def Write(self, Layer, Results):
+        self.Backend.WriteFeatures(self.Sink, Layer)
+        if self.GeoPackage:
+            # (the features are flushed first, so that the GeoPackage is not locked by the backend's own transaction)
+            self.Sink.flush()
+            if self.Connection is None:
+                self.Connection = sqlite3.connect(self.nameOfOutput)
+                SaveMetricsTable_Fnx(self.Connection, Results, self.OutputFields)
+            else:
+                SaveMetricsTable_Fnx(self.Connection, Results, self.OutputFields, Append=True)
+            self.Connection.commit()
+
+    def Close(self):
+        if self.Connection is not None:
+            self.Connection.close()
+            self.Connection = None
+        if self.Sink is not None:
+            self.Sink.close()
+            self.Sink = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *Exception):
+        self.Close()
+
+
+# Writes the Match_IDs and the calculated fields of Results into the MetricsTable attributes table of a GeoPackage (Connection); with Append, adds the rows to the existing table
+def SaveMetricsTable_Fnx(Connection, Results, OutputFields, Append=False):
+    FieldNames = [FieldName for FieldName, FieldType, Precision, Scale in OutputFields if FieldName != "Match_ID" and FieldName in Results.FieldNames()]
+    if not Append:
+        Types = dict((FieldName, "INTEGER" if FieldType.upper() in ("LONG", "SHORT") else "TEXT" if FieldType.upper() == "TEXT" else "REAL")
+                     for FieldName, FieldType, Precision, Scale in OutputFields)
+        Connection.execute('DROP TABLE IF EXISTS "' + MetricsTable + '"')
+        Connection.execute('DELETE FROM gpkg_contents WHERE table_name = ?', (MetricsTable,))
+        Connection.execute('CREATE TABLE "' + MetricsTable + '" ("Match_ID" INTEGER PRIMARY KEY' + "".join(', "' + FieldName + '" ' + Types[FieldName] for FieldName in FieldNames) + ")")
+        Connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, description) VALUES (?, 'attributes', ?, ?)",
+                           (MetricsTable, MetricsTable, "PCAT fields of every site, by Match_ID"))
+    Columns = [Results.MatchIDs.tolist()] + [Results.Get(FieldName).tolist() for FieldName in FieldNames]
+    Rows = ([None if isinstance(Value, float) and Value != Value else Value for Value in Row] for Row in zip(*Columns))
+    Connection.executemany('INSERT INTO "' + MetricsTable + '" VALUES (' + ", ".join(["?"] * (len(FieldNames) + 1)) + ")", Rows)
+
+
+class GeoParquetWriter(object):
+    '''NOTES:
+        Every call of Write sorts its sites along a Hilbert curve (SpatialOrder_Fnx) and adds them to the current row group; a row group is written as soon as it has RowGroupSize sites.
+        The columns are the attribute fields of the analysis file, then Match_ID and the calculated fields (with the types of OutputFields), then "bbox" and "geometry".
+        The types of the attribute fields come from the schema of the analysis file when the writer is opened with one (the streaming mode), so every chunk fits them;
+        when it is not (Save, which writes every site at once), they come from the values (a field with no values is written as text).
+        The "geo" metadata (the geometry types and the extent of every site written) is added when the writer is closed. A writer that exits with an exception
+        deletes its file instead, so that a failed run never leaves a GeoParquet file that looks complete.
+    '''
+    def __init__(self, Backend, nameOfOutput, OutputFields, RowGroupSize=RowGroupSize):
+        if pyarrow is None:
+            raise ImportError("GeoParquet output requires pyarrow")
+        self.Backend = Backend
+        self.nameOfOutput = nameOfOutput
+        self.OutputFields = OutputFields
+        self.RowGroupSize = RowGroupSize
+        self.Writer = self.Schema = self.Crs = None
+        self.InputTypes = {}
+        self.Pending, self.PendingRows = [], 0
+        self.Extent = [numpy.inf, numpy.inf, -numpy.inf, -numpy.inf]
+        self.Types = set()
+
+    def Save(self, OutputLayer, Results):
+        with self.Open(None, None):
+            self.Write(OutputLayer, Results)
+        return self.nameOfOutput
+
+    # (the coordinate system is read from the sites themselves)
+    def Open(self, InputSchema, Crs):
+        if InputSchema is not None:
+            self.InputTypes = dict((FieldName, pyarrow.type_for_alias(SchemaTypes.get(FieldType.split(":")[0], "string")))
+                                   for FieldName, FieldType in InputSchema["properties"].items())
+        if os.path.exists(self.nameOfOutput):
+            os.remove(self.nameOfOutput)
+        return self
+
+    # Adds the sites of Layer, with their calculated fields from Results
+    def Write(self, Layer, Results):
+        MatchIDs, Shapes, Bounds = self.Backend.ReadShapes(Layer, "Match_ID")
+        if not len(MatchIDs):
+            return
+        if self.Crs is None:
+            self.Crs = ProjJson_Fnx(self.Backend.SpatialReference(Layer))
+        Order = SpatialOrder_Fnx(Bounds)
+        Positions = Results.Positions(MatchIDs[Order])
+        OutputNames = [FieldName for FieldName, FieldType, Precision, Scale in self.OutputFields]
+
+        Arrays = collections.OrderedDict()
+        for FieldName, Values in self.Backend.ReadTable(Layer).items():
+            if FieldName not in OutputNames:
+                Arrays[FieldName] = self._Array(FieldName, [_Plain(Value) for Value in Values[Order]])
+        for FieldName, FieldType, Precision, Scale in self.OutputFields:
+            if FieldName == "Match_ID":
+                Values = MatchIDs[Order]
+            elif FieldName in Results.FieldNames():
+                Values = Results.Get(FieldName)[Positions]
+            else:
+                Values = numpy.full(len(MatchIDs), numpy.nan)
+            Arrays[FieldName] = pyarrow.array(Values, type=pyarrow.type_for_alias(FieldTypes.get(FieldType.upper(), "float64")), from_pandas=True)
+
+        # The envelope of every site (for the row group statistics) and the geometry itself
+        Bounds = Bounds[Order]
+        Arrays["bbox"] = pyarrow.StructArray.from_arrays([pyarrow.array(Bounds[:, Column], from_pandas=True) for Column in range(4)], ["xmin", "ymin", "xmax", "ymax"])
+        Shapes = [Shapes[Position] for Position in Order]
+        Arrays["geometry"] = pyarrow.array(Shapes, type=pyarrow.binary())
+
+        Valid = ~numpy.isnan(Bounds).any(axis=1)
+        if Valid.any():
+            self.Extent = [min(self.Extent[0], Bounds[Valid, 0].min()), min(self.Extent[1], Bounds[Valid, 1].min()),
+                           max(self.Extent[2], Bounds[Valid, 2].max()), max(self.Extent[3], Bounds[Valid, 3].max())]
+        self.Types.update(WkbGeometryType_Fnx(Shape) for Shape in Shapes if Shape is not None)
+
+        Table = pyarrow.Table.from_arrays(list(Arrays.values()), names=list(Arrays.keys()))
+        if self.Schema is None:
+            self.Schema = Table.schema
+            self.Writer = pyarrow.parquet.ParquetWriter(self.nameOfOutput, self.Schema, write_statistics=True, write_page_index=True)
+        self.Pending.append(Table.cast(self.Schema))
+        self.PendingRows += len(Table)
+        if self.PendingRows >= self.RowGroupSize:
+            self._Flush(False)
+
+    # Writes the full row groups of the pending sites (and, with All, the last partial one)
+    def _Flush(self, All):
+        if not self.PendingRows:
+            return
+        Table = pyarrow.concat_tables(self.Pending)
+        Rows = len(Table) if All else (len(Table) // self.RowGroupSize) * self.RowGroupSize
+        if Rows:
+            self.Writer.write_table(Table.slice(0, Rows), row_group_size=self.RowGroupSize)
+        self.Pending = [Table.slice(Rows)] if Rows < len(Table) else []
+        self.PendingRows = len(Table) - Rows
+
+    # Arrow array of an attribute field, with its type in the input schema, or else the type of the first values written (text when they are all empty)
+    def _Array(self, FieldName, Values):
+        Type = self.InputTypes.get(FieldName)
+        if Type is None and self.Schema is not None:
+            Type = self.Schema.field(FieldName).type
+        if Type is not None:
+            if pyarrow.types.is_string(Type):
+                Values = [None if Value is None else str(Value) for Value in Values]
+            return pyarrow.array(Values, type=Type, from_pandas=True)
+        Array = pyarrow.array(Values, from_pandas=True)
+        return Array.cast(pyarrow.string()) if pyarrow.types.is_null(Array.type) else Array
+
+    def Close(self):
+        if self.Writer is None:
+            return
+        self._Flush(True)
+        Geometry = {"encoding": "WKB", "geometry_types": sorted(self.Types), "crs": self.Crs,
+                    "covering": {"bbox": {"xmin": ["bbox", "xmin"], "ymin": ["bbox", "ymin"], "xmax": ["bbox", "xmax"], "ymax": ["bbox", "ymax"]}}}
+        if numpy.isfinite(self.Extent).all():
+            Geometry["bbox"] = [float(Value) for Value in self.Extent]
+        self.Writer.add_key_value_metadata({"geo": json.dumps({"version": "1.1.0", "primary_column": "geometry", "columns": {"geometry": Geometry}})})
+        self.Writer.close()
+        self.Writer = None
+
+    # Closes the file without its "geo" metadata and deletes it (after a failure: the sites written so far are not the whole output)
+    def Abort(self):
+        self.Pending, self.PendingRows = [], 0
+        if self.Writer is not None:
+            self.Writer.close()
+            self.Writer = None
+        if os.path.exists(self.nameOfOutput):
+            os.remove(self.nameOfOutput)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ExceptionType, *Exception):
+        if ExceptionType is None:
+            self.Close()
+        else:
+            self.Abort()
+
+
+# Plain Python value of a field value (NumPy scalars as Python numbers, NaN as None)
+def _Plain(Value):
+    if isinstance(Value, numpy.generic):
+        Value = Value.item()
+    if isinstance(Value, float) and Value != Value:
+        return None
+    return Value
@@ -0,0 +1,131 @@
+'''
+TILED PARALLEL EXECUTION FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The perimeter percentage and the buffer ring percentages of a site only depend on the context and exclusion
+features near that site, so they can be calculated for groups of sites independently. This module splits the
+analysis sites into spatial tiles, gives each tile the context and exclusion features within the largest buffer
+distance of its sites (the halo), calculates the tiles in a pool of worker processes and merges the fields back
+into the results store by Match_ID.
+
+The values are exactly the same as those of the serial calculation: every site sees the same context and
+exclusion features it would see in the whole layers, and the open backend sorts its overlay pairs, so the
+overlays and sums run in the same order on a tile as on the whole dataset.
+
+Tiles are equal-count strips (first by x, then by y within each column of tiles), so the work is balanced even
+when the sites are clustered. More tiles than workers (4 per worker by default) keeps every worker busy to the end;
+fewer, larger tiles repeat less of the context in the halos. Tiles are handed to the pool a few at a time, so only
+the tiles being calculated are held in memory twice.
+
+Only the open engine can run in parallel (arcpy geoprocessing tools write to a shared workspace); with the arcpy
+engine the calculation runs serially.
+
+'''
+import math
+import concurrent.futures
+import numpy
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+import PCAT_Backends
+import PCAT_Profile
+from PCAT_Backends import AddMessage
+from PCAT_Results import ResultsStore
+
+
+# #########################################################################
+# Tiling
+# #########################################################################
+
+# Splits features into about Tiles groups of equal size by the centers of their envelopes; returns a list of position arrays
+def SpatialTiles_Fnx(Geometries, Tiles):
+    Bounds = shapely.bounds(Geometries)
+    CenterX = numpy.nan_to_num((Bounds[:, 0] + Bounds[:, 2]) / 2)
+    CenterY = numpy.nan_to_num((Bounds[:, 1] + Bounds[:, 3]) / 2)
+    Count = len(Geometries)
+    Tiles = max(1, min(Tiles, Count))
+
+    # Columns and rows in proportion to the extent, so that the tiles are roughly square
+    Width = max(CenterX.max() - CenterX.min(), 1.0) if Count else 1.0
+    Height = max(CenterY.max() - CenterY.min(), 1.0) if Count else 1.0
+    Columns = max(1, min(Tiles, int(round(math.sqrt(Tiles * Width / Height)))))
+    Rows = int(math.ceil(Tiles / float(Columns)))
+
+    TileList = []
+    for Column in numpy.array_split(numpy.argsort(CenterX, kind="stable"), Columns):
+        for Tile in numpy.array_split(Column[numpy.argsort(CenterY[Column], kind="stable")], Rows):
+            if len(Tile):
+                TileList.append(numpy.sort(Tile))
+    return TileList
+
+
+# Positions of the features of Layer that intersect the envelope of Geometries expanded by Distance (meters), in layer order
+def HaloPositions_Fnx(Layer, Geometries, Distance):
+    Bounds = shapely.bounds(Geometries)
+    if len(Layer) == 0 or numpy.all(numpy.isnan(Bounds)):
+        return numpy.zeros(0, dtype=numpy.intp)
+    Box = shapely.box(numpy.nanmin(Bounds[:, 0]) - Distance, numpy.nanmin(Bounds[:, 1]) - Distance,
+                      numpy.nanmax(Bounds[:, 2]) + Distance, numpy.nanmax(Bounds[:, 3]) + Distance)
+    return numpy.sort(Layer.Tree().query(Box, predicate="intersects"))
+
+
+# #########################################################################
+# Running the Tiles
+# #########################################################################
+
+# Worker process setup: the tiles would otherwise repeat every progress message (and record into a copy of the parent's profiler)
+def _StartWorker():
+    PCAT_Backends.ShowMessages = False
+    PCAT_Profile.Activate_Fnx(None)
+
+
+# Calculates one tile in a worker process; returns its Match_IDs and calculated fields
+def _RunTile(Arguments):
+    MetricsFunction, SiteLayer, ContextLayer, ExclusionLayer = Arguments
+    Backend = PCAT_Backends.OpenBackend(None)
+    Results = ResultsStore(SiteLayer.Fields["Match_ID"])
+    MetricsFunction(Backend, SiteLayer, ContextLayer, ExclusionLayer, Results)
+    return Results.MatchIDs, dict(Results.Columns)
+
+
+# TILED METRICS FUNCTION:
+# Runs MetricsFunction(Backend, SiteLayer, ContextLayer, ExclusionLayer, Results) on spatial tiles of the output in Workers processes and merges the fields into Results
+'''NOTES:
+    HaloDistance is the largest distance (in meters) at which a context or exclusion feature can change a site's values, i.e. the largest buffer ring.
+    MetricsFunction must be a module level function, or a functools.partial of one (it is sent to the worker processes by name).
+'''
+def TiledMetrics_Fnx(OutputLayer, ContextLayer, ExclusionLayer, Results, MetricsFunction, HaloDistance, Workers, Tiles=None):
+    TileList = SpatialTiles_Fnx(OutputLayer.Geometries, Tiles or Workers * 4)
+    # A little more than the halo distance, since the buffers are only approximations of circles
+    Margin = HaloDistance + 1.0
+    AddMessage(" ... " + str(len(OutputLayer)) + " sites in " + str(len(TileList)) + " tiles on " + str(Workers) + " processes")
+
+    def TileArguments(Tile):
+        SiteLayer = PCAT_Backends.FeatureLayer(OutputLayer.Geometries[Tile], [("Match_ID", numpy.asarray(OutputLayer.Fields["Match_ID"])[Tile])], OutputLayer.Crs)
+        TileContext = ContextLayer.Take(HaloPositions_Fnx(ContextLayer, SiteLayer.Geometries, Margin))
+        TileExclusion = ExclusionLayer.Take(HaloPositions_Fnx(ExclusionLayer, SiteLayer.Geometries, Margin))
+        return MetricsFunction, SiteLayer, TileContext, TileExclusion
+
+    Remaining = iter(TileList)
+    Done = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=Workers, initializer=_StartWorker) as Pool:
+        Pending = set()
+        while True:
+            # Keep two tiles per worker queued, so the halos are only built (and copied to the workers) shortly before they are needed
+            for Tile in Remaining:
+                Pending.add(Pool.submit(_RunTile, TileArguments(Tile)))
+                if len(Pending) >= Workers * 2:
+                    break
+            if not Pending:
+                break
+            Finished, Pending = concurrent.futures.wait(Pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for Future in Finished:
+                MatchIDs, Columns = Future.result()
+                for FieldName, Values in Columns.items():
+                    Results.Set(FieldName, Values, ForMatchIDs=MatchIDs)
+                Done += 1
+            AddMessage("     " + str(Done) + " of " + str(len(TileList)) + " tiles done")
+
+    return Results
@@ -0,0 +1,201 @@
+'''
+PREVIEW MODE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+For exploratory runs, a quick map of the % conserved within a quarter, half, one and two miles of every site is
+often all that is needed, and the vector overlays of the buffer rings (MultiRingAreaPercent_Fnx) take most of the
+run time. The preview mode approximates the ring fields on grids instead:
+
+    1) the context and the exclusion are rasterized once (PCAT_Raster.py) over the extent of the sites plus the
+       largest ring: a grid of the number of context features covering each cell outside the exclusion (overlapping
+       context counts once per feature, as it does in the overlays), and a grid of the cells outside the exclusion
+    2) both grids are turned into summed-area tables, so the sum over any rectangle of cells takes four lookups
+    3) a site's ring (its buffer minus the site) is taken as its envelope grown by the ring distance with rounded
+       corners, minus the cells of the site: the band through the envelope and the bands above and below it are
+       rectangles, and each quarter disk at a corner is a staircase of CornerStrips rectangles (scaled to the area of
+       the quarter disk). That is 3 + 4 x CornerStrips lookups per grid, ring and site, whatever the ring distance
+    4) the acreage of the ring is the area of the site's buffer (perimeter x distance + pi x distance^2, with the
+       perimeter of the envelope for sites that are not convex) times the share of the ring's cells outside the
+       exclusion; the conserved acres are the same area times the share covered by the context
+
+The estimate is closest for compact sites and for context features that are large compared with the cells; it is
+furthest off for long or L-shaped sites (the envelope reaches farther than the buffer) and at the corners of the
+rings, where the staircases are within a cell of the quarter disks. PreviewErrors_Fnx measures the error
+against the exact calculation on a random sample of the sites, so every preview reports how far off it is.
+
+The time is the rasterization (one pass over the vertices of the context, exclusion and sites) plus a few array
+lookups per site, so it hardly depends on the number of sites. Memory is two 8 byte tables per cell, which is what
+MaxGridCells bounds (the cell size is raised above the requested one when the extent needs more cells).
+
+To use from the command line:
+    python TNC_ArcPyConservationTool.py context.shp parcels.shp exclusion.shp "" "25 Meters" --preview "30 Meters"
+
+'''
+import math
+import numpy
+
+import PCAT_Backends
+import PCAT_Profile
+from PCAT_Backends import AddMessage, SquareMetersPerAcre
+from PCAT_Raster import RasterGrid, PolygonSpans_Fnx, SpansToCounts_Fnx
+from PCAT_Results import ResultsStore, Percent_Fnx
+
+
+# Largest number of cells of the preview grids (two summed-area tables of 8 bytes per cell)
+MaxGridCells = 16000000
+
+# Number of rectangles (strips of rows) each quarter disk at the corners of a ring is made of, and sites looked up at once
+CornerStrips = 8
+ChunkSites = 8192
+
+
+# #########################################################################
+# Summed-Area Tables
+# #########################################################################
+
+# Summed-area table of a grid: Table[Row, Column] is the sum of the cells above and left of (Row, Column)
+def SummedAreaTable_Fnx(Values):
+    Table = numpy.zeros((Values.shape[0] + 1, Values.shape[1] + 1), dtype=numpy.int64)
+    numpy.cumsum(numpy.cumsum(Values, axis=0, dtype=numpy.int64), axis=1, out=Table[1:, 1:])
+    return Table
+
+
+# Sums of the cells of rows Row0 to Row1 and columns Column0 to Column1 (inclusive; the parts outside the grid and empty windows count as 0)
+def WindowSums_Fnx(Table, Row0, Row1, Column0, Column1):
+    Rows, Columns = Table.shape[0] - 1, Table.shape[1] - 1
+    Row0, Column0 = numpy.clip(Row0, 0, Rows), numpy.clip(Column0, 0, Columns)
+    Row1, Column1 = numpy.maximum(numpy.clip(Row1 + 1, 0, Rows), Row0), numpy.maximum(numpy.clip(Column1 + 1, 0, Columns), Column0)
+    # (flat positions in the table, which numpy looks up much faster than pairs of indices)
+    Flat, Row0, Row1 = Table.ravel(), Row0 * (Columns + 1), Row1 * (Columns + 1)
+    return Flat.take(Row1 + Column1) - Flat.take(Row0 + Column1) - Flat.take(Row1 + Column0) + Flat.take(Row0 + Column0)
+
+
+# Strips of a quarter disk of Radius cells, next to the corner cell of an envelope: [(first row, last row, number of columns)], counted outwards from the corner
+def CornerStrips_Fnx(Radius):
+    Strips = []
+    for Strip in range(CornerStrips):
+        FirstRow, LastRow = Strip * Radius // CornerStrips + 1, (Strip + 1) * Radius // CornerStrips
+        if FirstRow <= LastRow:
+            # (the width of the disk at the middle of the strip, measured from the centers of the cells)
+            Middle = (FirstRow + LastRow) / 2.0 - 0.5
+            Strips.append((FirstRow, LastRow, int(round(math.sqrt(max(Radius ** 2 - Middle ** 2, 0))))))
+    return Strips
+
+
+# Sums of a grid (Table) over the ring of Radius cells around each site's envelope (Envelope: first and last row and column), minus the site's own cells (Spans)
+'''NOTES:
+    The quarter disks at the corners are the staircases of CornerStrips_Fnx, scaled to the area of the quarter disk (see the module notes).
+    Spans are the (Feature, Row, FirstColumn, LastColumn) arrays of PolygonSpans_Fnx for the sites, with Feature the position of each site in Envelope.
+'''
+def RingSums_Fnx(Table, Envelope, Radius, Spans):
+    Strips = CornerStrips_Fnx(Radius)
+    CornerScale = math.pi * Radius ** 2 / 4 / max(sum((LastRow - FirstRow + 1) * Width for FirstRow, LastRow, Width in Strips), 1)
+    Sums = numpy.empty(len(Envelope[0]))
+    # (ChunkSites sites at a time, which keeps the many small arrays of the lookups in the processor's cache)
+    for Start in range(0, len(Sums), ChunkSites):
+        Row0, Row1, Column0, Column1 = [Cells[Start:Start + ChunkSites] for Cells in Envelope]
+        Band = WindowSums_Fnx(Table, Row0, Row1, Column0 - Radius, Column1 + Radius)
+        Sides = WindowSums_Fnx(Table, Row0 - Radius, Row0 - 1, Column0, Column1) + WindowSums_Fnx(Table, Row1 + 1, Row1 + Radius, Column0, Column1)
+        Corners = 0
+        for FirstRow, LastRow, Width in Strips:
+            for Rows in ((Row0 - LastRow, Row0 - FirstRow), (Row1 + FirstRow, Row1 + LastRow)):
+                Corners = Corners + WindowSums_Fnx(Table, Rows[0], Rows[1], Column0 - Width, Column0 - 1) + WindowSums_Fnx(Table, Rows[0], Rows[1], Column1 + 1, Column1 + Width)
+        Sums[Start:Start + ChunkSites] = Band + Sides + Corners * CornerScale
+    Feature, Row, FirstColumn, LastColumn = Spans
+    return Sums - numpy.bincount(Feature, weights=WindowSums_Fnx(Table, Row, Row, FirstColumn, LastColumn), minlength=len(Sums))
+
+
+# #########################################################################
+# Preview of the Ring Fields
+# #########################################################################
+
+# PREVIEW RINGS FUNCTION:
+# Approximates the fields of MultiRingAreaPercent_Fnx (buffer acres, conserved acres and % conserved, minus the exclusion) for every ring of BuffRings on grids of CellSize (meters)
+'''NOTES:
+    ContextLayer is the context (with or without the exclusion erased, since the exclusion is left out of the grids either way); sites are matched to Results by Match_ID.
+    Returns the grid used (its cell size can be larger than CellSize, see MaxGridCells).
+'''
+@PCAT_Profile.Profiled("preview rings")
+def PreviewRings_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, BuffRings, CellSize):
+    Distances = [PCAT_Backends.LinearUnitToMeters_Fnx(Ring[0]) for Ring in BuffRings]
+
+    # The envelope and perimeter of every site, from its rings
+    Coordinates, RingIDs, RingKeys = Backend.ReadRings(OutputLayer, "Match_ID")
+    MatchIDs, RingFeatures = numpy.unique(RingKeys, return_inverse=True)
+    VertexFeatures = RingFeatures[RingIDs]
+    SameRing = RingIDs[:-1] == RingIDs[1:]
+    EdgeLengths = numpy.hypot(*(Coordinates[1:] - Coordinates[:-1]).T) * SameRing
+    Perimeters = numpy.bincount(VertexFeatures[:-1], weights=EdgeLengths, minlength=len(MatchIDs))
+    Envelopes = numpy.zeros((len(MatchIDs), 4))
+    if len(MatchIDs):
+        Envelopes[:, :2], Envelopes[:, 2:] = numpy.inf, -numpy.inf
+        numpy.minimum.at(Envelopes[:, 0], VertexFeatures, Coordinates[:, 0])
+        numpy.minimum.at(Envelopes[:, 1], VertexFeatures, Coordinates[:, 1])
+        numpy.maximum.at(Envelopes[:, 2], VertexFeatures, Coordinates[:, 0])
+        numpy.maximum.at(Envelopes[:, 3], VertexFeatures, Coordinates[:, 1])
+
+    # A grid over the sites and their largest ring, with cells of CellSize or larger
+    Extent = numpy.array([Envelopes[:, 0].min(), Envelopes[:, 1].min(), Envelopes[:, 2].max(), Envelopes[:, 3].max()]) if len(MatchIDs) else numpy.zeros(4)
+    Extent += numpy.array([-1, -1, 1, 1]) * (max(Distances) + 2 * CellSize)
+    CellSize = max(CellSize, math.sqrt((Extent[2] - Extent[0]) * (Extent[3] - Extent[1]) / MaxGridCells))
+    Grid = RasterGrid(Extent[0], Extent[3], CellSize, math.ceil((Extent[3] - Extent[1]) / CellSize), math.ceil((Extent[2] - Extent[0]) / CellSize))
+    AddMessage(" ... rasterizing context and exclusion on " + str(Grid.Rows) + " x " + str(Grid.Columns) + " cells of %.1f m" % CellSize)
+
+    def Rasterize(Layer):
+        LayerCoordinates, LayerRingIDs, LayerRingKeys = Backend.ReadRings(Layer)
+        Feature, Row, FirstColumn, LastColumn = PolygonSpans_Fnx(LayerCoordinates, LayerRingIDs, numpy.unique(LayerRingKeys, return_inverse=True)[1], Grid)
+        return SpansToCounts_Fnx(Row, FirstColumn, LastColumn, Grid)
+
+    Open = Rasterize(ExclusionLayer) == 0
+    Conserved = SummedAreaTable_Fnx(Rasterize(ContextLayer) * Open)
+    Open = SummedAreaTable_Fnx(Open)
+
+    AddMessage(" ... summing the rings")
+    Spans = PolygonSpans_Fnx(Coordinates, RingIDs, RingFeatures, Grid)
+    SiteCells = numpy.bincount(Spans[0], weights=Spans[3] - Spans[2] + 1, minlength=len(MatchIDs))
+    Row0, Column0 = Grid.CellOf(Envelopes[:, 0], Envelopes[:, 3])
+    Row1, Column1 = Grid.CellOf(Envelopes[:, 2], Envelopes[:, 1])
+    Envelope = (Row0, Row1, Column0, Column1)
+    # (the perimeter of the envelope is the longest the perimeter of the convex hull can be)
+    Perimeters = numpy.minimum(Perimeters, 2 * (Envelopes[:, 2] - Envelopes[:, 0] + Envelopes[:, 3] - Envelopes[:, 1]))
+
+    for Distance, Ring in zip(Distances, BuffRings):
+        Radius = int(round(Distance / CellSize))
+        RingCells = ((Row1 - Row0 + 1) * (Column1 - Column0 + 1 + 2 * Radius) + 2 * Radius * (Column1 - Column0 + 1) + math.pi * Radius ** 2 - SiteCells)
+        RingArea = numpy.minimum(Perimeters * Distance + math.pi * Distance ** 2, RingCells * CellSize ** 2) / SquareMetersPerAcre
+        BufferArea = RingArea * Percent_Fnx(RingSums_Fnx(Open, Envelope, Radius, Spans), RingCells) / 100
+        ContextArea = RingArea * Percent_Fnx(RingSums_Fnx(Conserved, Envelope, Radius, Spans), RingCells) / 100
+        Results.Set(Ring[1], BufferArea, ForMatchIDs=MatchIDs)
+        Results.Set(Ring[2], ContextArea, ForMatchIDs=MatchIDs)
+        Results.Set(Ring[3], Percent_Fnx(ContextArea, BufferArea), ForMatchIDs=MatchIDs)
+    return Grid
+
+
+# PREVIEW ERRORS FUNCTION:
+# Compares the preview fields in Results with the exact ones on a random sample of Sample sites; returns {FieldName: {"Mean", "P95", "Max"}} of the absolute errors
+'''NOTES:
+    ExactFunction(Backend, SiteLayer, SiteResults) calculates the exact fields of the sites of SiteLayer (e.g. MultiRingAreaPercent_Fnx).
+    The errors of the percentages are in percentage points, those of the acreages in acres.
+'''
+@PCAT_Profile.Profiled("preview errors")
+def PreviewErrors_Fnx(Backend, OutputLayer, Results, ExactFunction, FieldNames, Sample, Seed=0):
+    MatchIDs = numpy.sort(numpy.random.RandomState(Seed).choice(Results.MatchIDs, min(Sample, len(Results)), replace=False))
+    AddMessage(" ... calculating the exact values of " + str(len(MatchIDs)) + " sites")
+    SiteLayer, SiteResults = Backend.Subset(OutputLayer, "Match_ID", MatchIDs), ResultsStore(MatchIDs)
+    ShowMessages = PCAT_Backends.ShowMessages
+    PCAT_Backends.ShowMessages = False
+    try:
+        ExactFunction(Backend, SiteLayer, SiteResults)
+    finally:
+        PCAT_Backends.ShowMessages = ShowMessages
+    Backend.Delete(SiteLayer)
+
+    Report = {}
+    Positions = Results.Positions(SiteResults.MatchIDs)
+    AddMessage("     field          mean error    95th pct.       max")
+    for FieldName in FieldNames:
+        Errors = numpy.abs(Results.Get(FieldName)[Positions] - SiteResults.Get(FieldName))
+        Unit = " pts" if FieldName.endswith("_Pct") else " ac "
+        if len(Errors):
+            Report[FieldName] = {"Mean": float(Errors.mean()), "P95": float(numpy.percentile(Errors, 95)), "Max": float(Errors.max())}
+            AddMessage("     %-10s %10.2f%s %8.2f%s %8.2f%s" % (FieldName, Report[FieldName]["Mean"], Unit, Report[FieldName]["P95"], Unit, Report[FieldName]["Max"], Unit))
+    return Report
@@ -0,0 +1,237 @@
+'''
+PROFILING FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+Records what every stage of a run (prepare, perimeter, buffer rings, connectivity, final score ...) and every
+geoprocessing operation inside them costs, and writes it as a trace-event profile (a JSON file that opens in
+chrome://tracing or https://ui.perfetto.dev, with the operations nested under their stages).
+
+For each stage and operation:
+    Wall and CPU time (seconds)
+    Input and output feature and vertex counts (operations only; see Backend.Describe)
+    Bytes written to disk while it ran (read from /proc/self/io; not available on every system)
+    Peak memory (peak resident set size while it ran, on Linux; the peak of the process so far elsewhere)
+
+Stages are marked in the code with the Profiled decorator or the Stage context manager, which do nothing unless a
+Profiler is active, so an ordinary run is not slowed down. The operations are recorded by wrapping the backend in a
+ProfiledBackend. With a CProfileFolder, every top-level stage also runs under cProfile and its statistics are saved
+as <CProfileFolder>/<NN>_<stage>.prof (for pstats or snakeviz).
+
+To use from the command line:
+    python TNC_ArcPyConservationTool.py context.shp parcels.shp exclusion.shp --profile profile.json [--profile-stages prof_folder]
+
+'''
+import os, sys, json, time, cProfile, functools, contextlib, collections
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PCAT_Backends import AddMessage
+
+
+# #########################################################################
+# Memory and Disk Measurements
+# #########################################################################
+
+# Resets the peak resident set size of the process (Linux only); returns whether it could
+def ResetPeak_Fnx():
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+# Peak resident set size in MB: since the last ResetPeak_Fnx on Linux, of the whole process elsewhere (None where it cannot be read)
+def PeakMB_Fnx():
+    try:
+        with open("/proc/self/status") as status:
+            for Line in status:
+                if Line.startswith("VmHWM:"):
+                    return int(Line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    if resource is not None:
+        Peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return Peak / (1024.0 ** 2) if sys.platform == "darwin" else Peak / 1024.0
+    return None
+
+
+# Bytes the process has written so far (files, but also the console), or None where it cannot be read
+def BytesWritten_Fnx():
+    try:
+        with open("/proc/self/io") as io:
+            for Line in io:
+                if Line.startswith("wchar:"):
+                    return int(Line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+# #########################################################################
+# Profiler
+# #########################################################################
+
+class Profiler(object):
+    '''NOTES:
+        Events are kept as trace-event "complete" events (ph "X"), with the measurements in their args.
+        Stages can be nested. Since there is only one peak memory counter per process, a stage's peak is the largest of the peaks of its nested stages and of what is left after them.
+    '''
+    def __init__(self, CProfileFolder=None):
+        self.Events = []
+        self.Origin = time.perf_counter()
+        self.CProfileFolder = CProfileFolder
+        self.Open = []
+        self.CProfileCount = 0
+        if CProfileFolder and not os.path.isdir(CProfileFolder):
+            os.makedirs(CProfileFolder)
+
+    # Records the block inside the with statement as one event; Args (a dictionary) can be filled in while it runs
+    @contextlib.contextmanager
+    def Stage(self, Name, Category="stage", Args=None):
+        Args = Args if Args is not None else collections.OrderedDict()
+        Frame = {"ChildPeak": None}
+        self.Open.append(Frame)
+        StartBytes = BytesWritten_Fnx()
+        ResetPeak_Fnx()
+        Profile = None
+        if self.CProfileFolder and Category == "stage" and len(self.Open) == 1:
+            Profile = cProfile.Profile()
+            Profile.enable()
+        StartCPU = time.process_time()
+        Start = time.perf_counter()
+        try:
+            yield Args
+        finally:
+            Wall = time.perf_counter() - Start
+            CPU = time.process_time() - StartCPU
+            if Profile is not None:
+                Profile.disable()
+                self.CProfileCount += 1
+                Profile.dump_stats(os.path.join(self.CProfileFolder, "%02d_" % self.CProfileCount + Name.replace(" ", "_") + ".prof"))
+            EndBytes = BytesWritten_Fnx()
+            Peak = _Largest(PeakMB_Fnx(), Frame["ChildPeak"])
+            self.Open.pop()
+            if self.Open:
+                self.Open[-1]["ChildPeak"] = _Largest(self.Open[-1]["ChildPeak"], Peak)
+
+            Args["WallSeconds"] = Wall
+            Args["CPUSeconds"] = CPU
+            Args["BytesWritten"] = EndBytes - StartBytes if StartBytes is not None and EndBytes is not None else None
+            Args["PeakMB"] = Peak
+            self.Events.append({"name": Name, "cat": Category, "ph": "X", "pid": os.getpid(), "tid": 0,
+                                "ts": (Start - self.Origin) * 1e6, "dur": Wall * 1e6, "args": Args})
+
+    # Writes the trace-event profile
+    def Save(self, TraceFile):
+        with open(TraceFile, "w") as trace:
+            json.dump({"traceEvents": sorted(self.Events, key=lambda Event: Event["ts"]), "displayTimeUnit": "ms"}, trace, indent=1)
+        return TraceFile
+
+    # Sends a short summary (the time of every top-level stage and the slowest operations) to the messages
+    def Summary(self, Operations=10):
+        AddMessage("Profile:")
+        Stages = [Event for Event in self.Events if Event["cat"] == "stage"]
+        Ends = []
+        for Event in sorted(Stages, key=lambda Event: Event["ts"]):
+            if any(Event["ts"] >= Start and Event["ts"] + Event["dur"] <= End for Start, End in Ends):
+                continue
+            Ends.append((Event["ts"], Event["ts"] + Event["dur"]))
+            AddMessage("     " + Event["name"].ljust(28) + "%9.2f s wall %9.2f s cpu" % (Event["args"]["WallSeconds"], Event["args"]["CPUSeconds"]) +
+                       ("   %8.1f MB peak" % Event["args"]["PeakMB"] if Event["args"]["PeakMB"] is not None else ""))
+        Slowest = sorted((Event for Event in self.Events if Event["cat"] == "operation"), key=lambda Event: -Event["dur"])[:Operations]
+        if Slowest:
+            AddMessage("   slowest operations:")
+        for Event in Slowest:
+            Args = Event["args"]
+            AddMessage("     " + Event["name"].ljust(28) + "%9.2f s wall" % Args["WallSeconds"] +
+                       "   " + str(Args.get("InputFeatures")) + " -> " + str(Args.get("OutputFeatures")) + " features")
+
+
+def _Largest(First, Second):
+    Values = [Value for Value in (First, Second) if Value is not None]
+    return max(Values) if Values else None
+
+
+# The profiler of the current run (None when the run is not profiled)
+ActiveProfiler = None
+
+
+# Makes Profiler the active profiler (or turns profiling off with None)
+def Activate_Fnx(NewProfiler):
+    global ActiveProfiler
+    ActiveProfiler = NewProfiler
+    return NewProfiler
+
+
+# Records the block inside the with statement as a stage of the active profiler (does nothing when no profiler is active)
+@contextlib.contextmanager
+def Stage(Name, Category="stage"):
+    if ActiveProfiler is None:
+        yield None
+        return
+    with ActiveProfiler.Stage(Name, Category) as Args:
+        yield Args
+
+
+# Decorator that records every call of a function as a stage of the active profiler
+def Profiled(Name):
+    def Decorator(Function):
+        @functools.wraps(Function)
+        def Wrapper(*Arguments, **Keywords):
+            if ActiveProfiler is None:
+                return Function(*Arguments, **Keywords)
+            with ActiveProfiler.Stage(Name):
+                return Function(*Arguments, **Keywords)
+        return Wrapper
+    return Decorator
+
+
+# #########################################################################
+# Profiled Backend
+# #########################################################################
+
+class ProfiledBackend(object):
+    '''NOTES:
+        Wraps a backend (PCAT_Backends.py) so that every one of its operations is recorded as an "operation" event of the profiler, nested in the stage that called it.
+        The feature and vertex counts come from Backend.Describe and are taken after the operation has been timed, so they do not add to its time (they do add to the run time).
+    '''
+    Operations = ["Read", "CreateOutput", "WriteResults", "SaveOutput", "SaveLayer", "LoadLayer", "PolygonToLine", "Buffer", "Simplify", "Erase", "Intersect", "Dissolve",
+                  "Clip", "ConvexHull", "Merge", "Explode", "AddConstantField", "AddValueField", "SpatialJoin", "NearPairs", "Subset", "ReadMeasure", "ReadRings", "ReadShapes", "ReadTable", "SpatialReference", "Delete", "Cleanup"]
+
+    def __init__(self, Backend, Profiler):
+        self.Backend = Backend
+        self.Profiler = Profiler
+
+    def __getattr__(self, Name):
+        Value = getattr(self.Backend, Name)
+        if Name not in self.Operations:
+            return Value
+
+        @functools.wraps(Value)
+        def Operation(*Arguments, **Keywords):
+            with self.Profiler.Stage(Name, "operation") as Args:
+                Result = Value(*Arguments, **Keywords)
+            Inputs = [self.Backend.Describe(Argument) for Argument in _Flatten(Arguments)]
+            Inputs = [Input for Input in Inputs if Input is not None]
+            Output = self.Backend.Describe(Result)
+            if Inputs:
+                Args["InputFeatures"] = sum(Input[0] for Input in Inputs)
+                Args["InputVertices"] = sum(Input[1] for Input in Inputs)
+            if Output is not None:
+                Args["OutputFeatures"], Args["OutputVertices"] = Output
+            Args["Arguments"] = [str(Argument) for Argument in Arguments if isinstance(Argument, (str, int, float))]
+            return Result
+        return Operation
+
+
+def _Flatten(Arguments):
+    for Argument in Arguments:
+        if isinstance(Argument, (list, tuple)):
+            for Item in Argument:
+                yield Item
+        else:
+            yield Argument
@@ -0,0 +1,303 @@
+'''
+RASTER CONNECTIVITY ENGINE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The vector connectivity calculation (ConnectivityZones_Fnx) finds the narrow areas between conservation sites with a
+negative and then a positive buffer of the whole negative space, which is by far the slowest part of the tool. This
+engine does the same morphological opening on a grid instead:
+
+    1) the negative space (and the convex hull) is rasterized at CellSize (a cell is inside when its center is), on a
+       grid over the hull and the two widths around it that the opening depends on (ZoneGrid_Fnx)
+    2) the erosion keeps the cells farther than Width from the edge of the negative space, and the opening keeps the
+       cells within Width of an eroded cell; both are thresholds of Euclidean distance transforms (scipy.ndimage)
+    3) "connected" (narrow) cells are negative space cells inside the hull that are not in the opening, and "near"
+       cells are the cells within Width of a narrow cell
+    4) each analysis site gets the maximum zone score (5 connected, 1 near, 0 otherwise) of the cells it covers and of
+       the cells next to them, since the vector calculation counts any intersection with a narrow or near area
+
+A sweep of several widths (RasterSweepZones_Fnx) rasterizes once and shares the distance transform of step 2's
+erosion, which is the same for every width; only the opening and the near zones are calculated per width.
+
+Speed and accuracy vs. cell size:
+    Nearly all the time goes to the three distance transforms of step 2 and 3 (about 0.1 s per million cells each);
+    the rasterization and the zonal scores take a few percent of it. So the engine is only faster than the vector
+    one at coarse cells. Zone edges are placed to within about half a cell, and a narrow area thinner than a cell can
+    hold no cell center at all. The vector opening leaves such slivers wherever the edge of the negative space turns
+    (a corner of a context patch cuts off a thin wedge of narrow area, less than a square meter for obtuse corners),
+    and a site touching only one of them is connected for the vector engine but not here, at any cell size.
+    Measured on the synthetic 1,000 parcel benchmark landscape (25 m width, open engine, zones and scores together,
+    best of three runs, in three sessions; the vector engine took 1.5 to 1.7 s):
+
+        cell size           seconds     sites scored differently from the vector engine (of 1,000)
+        2.5 m  (Width/10)   7.0 - 7.3   29 (28 lower and 1 higher; 15 of the 63 connected sites lower, 13 of them 0)
+        4.2 m  (Width/6)    2.5 - 3.0   35 (18 connected sites lower)
+        5 m    (Width/5)    1.5 - 1.9   39 (21 connected sites lower)
+        6.25 m (Width/4)    1.1         44 (40 lower and 4 higher; 21 of the 63 connected sites lower, 20 of them 0)
+        8.3 m  (Width/3)    0.5 - 0.6   56 (27 connected sites lower)
+
+    The default, Width / 4, is the finest of these that was faster than the vector engine in every run: use it for
+    a quick look at the connectivity, and the vector engine (or a finer --cell-size, at a cost) for the final scores.
+    Memory and time grow with the number of cells, (hull extent + 4 x Width)^2 / CellSize^2: a distance transform
+    needs about 30 bytes per cell while it runs, e.g. 20 km x 20 km at 2.5 m is 64 million cells, or about 2 GB.
+    Halving the cell size quadruples both.
+
+The rasterization is done here in NumPy (scanlines over the polygon rings returned by Backend.ReadRings), so the
+engine works the same with the arcpy and the open geometry backends. It needs scipy for the distance transforms.
+
+'''
+import os
+import numpy
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+import PCAT_Backends
+
+
+# #########################################################################
+# Rasterizing Polygons
+# #########################################################################
+
+# Grid of Rows x Columns square cells, with its top left corner at (XMin, YMax)
+class RasterGrid(object):
+    def __init__(self, XMin, YMax, CellSize, Rows, Columns):
+        self.XMin = float(XMin)
+        self.YMax = float(YMax)
+        self.CellSize = float(CellSize)
+        self.Rows = int(Rows)
+        self.Columns = int(Columns)
+
+    @property
+    def Shape(self):
+        return (self.Rows, self.Columns)
+
+    # Grid covering the envelope of the coordinates, with a margin of one cell all around
+    @classmethod
+    def FromCoordinates(cls, Coordinates, CellSize):
+        XMin, YMin = Coordinates.min(axis=0) - CellSize
+        XMax, YMax = Coordinates.max(axis=0) + CellSize
+        return cls(XMin, YMax, CellSize, numpy.ceil((YMax - YMin) / CellSize), numpy.ceil((XMax - XMin) / CellSize))
+
+    # Row and column of the cells containing the points (clipped to the grid)
+    def CellOf(self, X, Y):
+        Rows = numpy.clip(numpy.floor((self.YMax - Y) / self.CellSize).astype(numpy.int64), 0, self.Rows - 1)
+        Columns = numpy.clip(numpy.floor((X - self.XMin) / self.CellSize).astype(numpy.int64), 0, self.Columns - 1)
+        return Rows, Columns
+
+
+# Scanline fill of polygon rings: returns the runs of cells whose centers are inside each feature, as (Feature, Row, FirstColumn, LastColumn) arrays
+'''NOTES:
+    Coordinates, RingIDs and RingFeatures are as returned by Backend.ReadRings: the vertices of every ring, the ring each vertex belongs to, and the feature each ring belongs to.
+    Inside is decided by the even-odd rule within each feature, so holes are left out, while overlapping features are each filled.
+'''
+def PolygonSpans_Fnx(Coordinates, RingIDs, RingFeatures, Grid):
+    Empty = numpy.zeros(0, dtype=numpy.int64)
+    if len(Coordinates) < 2:
+        return Empty, Empty, Empty, Empty
+
+    # Edges between consecutive vertices of the same ring (rings are closed, the last vertex repeating the first)
+    SameRing = RingIDs[:-1] == RingIDs[1:]
+    X1, Y1 = Coordinates[:-1, 0][SameRing], Coordinates[:-1, 1][SameRing]
+    X2, Y2 = Coordinates[1:, 0][SameRing], Coordinates[1:, 1][SameRing]
+    EdgeFeatures = RingFeatures[RingIDs[:-1][SameRing]]
+    NotFlat = Y1 != Y2
+    X1, Y1, X2, Y2, EdgeFeatures = X1[NotFlat], Y1[NotFlat], X2[NotFlat], Y2[NotFlat], EdgeFeatures[NotFlat]
+
+    # Rows whose center line crosses each edge (half-open on the top end, so each vertex is only counted once)
+    CellSize = Grid.CellSize
+    YLow, YHigh = numpy.minimum(Y1, Y2), numpy.maximum(Y1, Y2)
+    FirstRow = numpy.maximum(numpy.floor((Grid.YMax - YHigh) / CellSize - 0.5).astype(numpy.int64) + 1, 0)
+    LastRow = numpy.minimum(numpy.floor((Grid.YMax - YLow) / CellSize - 0.5).astype(numpy.int64), Grid.Rows - 1)
+    RowCounts = numpy.maximum(LastRow - FirstRow + 1, 0)
+
+    # One crossing per edge and row
+    Edge = numpy.repeat(numpy.arange(len(X1)), RowCounts)
+    Offsets = numpy.cumsum(RowCounts) - RowCounts
+    Row = FirstRow[Edge] + numpy.arange(len(Edge)) - Offsets[Edge]
+    RowY = Grid.YMax - (Row + 0.5) * CellSize
+    CrossingX = X1[Edge] + (RowY - Y1[Edge]) * (X2[Edge] - X1[Edge]) / (Y2[Edge] - Y1[Edge])
+    CrossingFeature = EdgeFeatures[Edge]
+
+    # Pairing the crossings along each row of each feature (even-odd rule)
+    Order = numpy.lexsort((CrossingX, Row, CrossingFeature))
+    CrossingX, Row, CrossingFeature = CrossingX[Order], Row[Order], CrossingFeature[Order]
+    Start, End = CrossingX[0::2], CrossingX[1::2]
+    Row, Feature = Row[0::2], CrossingFeature[0::2]
+
+    # Cells whose centers fall between the two crossings
+    FirstColumn = numpy.maximum(numpy.ceil((Start - Grid.XMin) / CellSize - 0.5).astype(numpy.int64), 0)
+    LastColumn = numpy.minimum(numpy.ceil((End - Grid.XMin) / CellSize - 0.5).astype(numpy.int64) - 1, Grid.Columns - 1)
+    Keep = FirstColumn <= LastColumn
+    return Feature[Keep], Row[Keep], FirstColumn[Keep], LastColumn[Keep]
+
+
+# Number of spans covering each cell of the grid (of features, for the spans of PolygonSpans_Fnx)
+def SpansToCounts_Fnx(Rows, FirstColumns, LastColumns, Grid):
+    Counts = numpy.zeros((Grid.Rows, Grid.Columns + 1), dtype=numpy.int32)
+    numpy.add.at(Counts, (Rows, FirstColumns), 1)
+    numpy.add.at(Counts, (Rows, LastColumns + 1), -1)
+    return numpy.cumsum(Counts, axis=1)[:, :-1]
+
+
+# Boolean grid of the cells covered by any of the spans
+def SpansToMask_Fnx(Rows, FirstColumns, LastColumns, Grid):
+    return SpansToCounts_Fnx(Rows, FirstColumns, LastColumns, Grid) > 0
+
+
+# Number of True cells of Mask within each span, from the running total along each row
+def CountInSpans_Fnx(Mask, Rows, FirstColumns, LastColumns):
+    RunningTotal = numpy.zeros((Mask.shape[0], Mask.shape[1] + 1), dtype=numpy.int64)
+    numpy.cumsum(Mask, axis=1, out=RunningTotal[:, 1:])
+    return RunningTotal[Rows, LastColumns + 1] - RunningTotal[Rows, FirstColumns]
+
+
+# Rasterizes the polygons of a layer into a boolean grid (creating the grid from the layer's envelope when Grid is None)
+def RasterizeLayer_Fnx(Backend, Layer, CellSize=None, Grid=None):
+    Coordinates, RingIDs, RingKeys = Backend.ReadRings(Layer)
+    if Grid is None:
+        Grid = RasterGrid.FromCoordinates(Coordinates, CellSize)
+    Feature, Row, FirstColumn, LastColumn = PolygonSpans_Fnx(Coordinates, RingIDs, numpy.unique(RingKeys, return_inverse=True)[1], Grid)
+    return SpansToMask_Fnx(Row, FirstColumn, LastColumn, Grid), Grid
+
+
+# #########################################################################
+# Connectivity Zones
+# #########################################################################
+
+# Grid for the connectivity zones: the envelope of the hull, with the margin the opening needs around it (two widths, see MorphologicalZones_Fnx), within the envelope of the negative space
+'''NOTES:
+    The narrow areas are only kept inside the hull, and the opening of a cell only depends on the negative space within two widths of it, so the rest of the study area (a quarter mile around the hull)
+    does not need to be rasterized. Where the grid stops inside the negative space, the distance transforms treat the space beyond it as more negative space, which is what it is.
+'''
+def ZoneGrid_Fnx(Backend, NegativeSpace, ConvexHull, WidthMeters, CellMeters):
+    Grid = RasterGrid.FromCoordinates(Backend.ReadRings(NegativeSpace)[0], CellMeters)
+    HullCoordinates = Backend.ReadRings(ConvexHull)[0]
+    Margin = 2 * WidthMeters + 2 * CellMeters
+    # (cut on the cells of the whole negative space grid, so that the cells and the scores do not depend on the margin)
+    FirstRow, FirstColumn = Grid.CellOf(HullCoordinates[:, 0].min() - Margin, HullCoordinates[:, 1].max() + Margin)
+    LastRow, LastColumn = Grid.CellOf(HullCoordinates[:, 0].max() + Margin, HullCoordinates[:, 1].min() - Margin)
+    return RasterGrid(Grid.XMin + FirstColumn * CellMeters, Grid.YMax - FirstRow * CellMeters, CellMeters, LastRow - FirstRow + 1, LastColumn - FirstColumn + 1)
+
+
+# Distance (in meters) from every cell to the nearest True cell of Mask, measured to the edge of that cell rather than its center
+def _DistanceTo(Mask, CellSize):
+    if not Mask.any():
+        return numpy.full(Mask.shape, numpy.inf, dtype=numpy.float32)
+    return (ndimage.distance_transform_edt(~Mask).astype(numpy.float32) - 0.5) * CellSize
+
+
+# Connected (narrow) and near zones of a rasterized negative space, for the narrowness width in meters
+'''NOTES:
+    EdgeDistance (optional) is the distance from every cell to the edge of the negative space (_DistanceTo(~NegativeSpace, CellSize)), which does not depend on the width, so a sweep of several widths only calculates it once.
+'''
+def MorphologicalZones_Fnx(NegativeSpace, HullMask, WidthMeters, CellSize, EdgeDistance=None):
+    if EdgeDistance is None:
+        EdgeDistance = _DistanceTo(~NegativeSpace, CellSize)
+    # Erosion: negative space cells farther than the width from its edge
+    Eroded = EdgeDistance > WidthMeters
+    # Opening: cells within the width of an eroded cell (what is left of the negative space without its narrow areas)
+    Opening = NegativeSpace & (_DistanceTo(Eroded, CellSize) <= WidthMeters)
+    # Narrow areas are the rest of the negative space, inside the hull; near areas are within the width of a narrow area
+    Connected = NegativeSpace & ~Opening & HullMask
+    Near = (_DistanceTo(Connected, CellSize) <= WidthMeters) & ~Connected
+    return Connected, Near
+
+
+class ConnectivityRaster(object):
+    '''NOTES:
+        Holds the connected (narrow) and near zones as boolean arrays on Grid. Saved in (and loaded from) the prepared layer cache as one compressed .npz file.
+    '''
+    def __init__(self, Grid, Connected, Near):
+        self.Grid = Grid
+        self.Connected = Connected
+        self.Near = Near
+
+    def Save(self, Folder, Name):
+        Grid = self.Grid
+        numpy.savez_compressed(os.path.join(Folder, Name + ".npz"), Connected=self.Connected, Near=self.Near,
+                               Grid=numpy.array([Grid.XMin, Grid.YMax, Grid.CellSize, Grid.Rows, Grid.Columns]))
+
+    @classmethod
+    def Load(cls, Folder, Name):
+        with numpy.load(os.path.join(Folder, Name + ".npz")) as Saved:
+            XMin, YMax, CellSize, Rows, Columns = Saved["Grid"]
+            return cls(RasterGrid(XMin, YMax, CellSize, Rows, Columns), Saved["Connected"], Saved["Near"])
+
+    # Zonal maximum of the zone scores over the cells touched by each feature of Layer; returns (KeyField values, scores)
+    '''NOTES:
+        The vector connectivity counts any intersection with a zone, so a feature also scores the zones of the cells next to the cells whose centers it covers
+        (its spans are grown by one cell all around, the same as dilating the zones by one cell): a feature whose edge crosses a zone cell, or whose overlap with a zone holds no cell center, is not missed.
+        A feature too small to cover the center of any cell gets the score of the cells around the average of its vertices.
+    '''
+    def ZonalScores(self, Backend, Layer, KeyField, ConnectedScore=5, NearScore=1):
+        Coordinates, RingIDs, RingKeys = Backend.ReadRings(Layer, KeyField)
+        Keys, RingFeatures = numpy.unique(RingKeys, return_inverse=True)
+        Feature, Row, FirstColumn, LastColumn = PolygonSpans_Fnx(Coordinates, RingIDs, RingFeatures, self.Grid)
+
+        NoCells = numpy.bincount(Feature, weights=LastColumn - FirstColumn + 1, minlength=len(Keys)) == 0
+        if NoCells.any() and len(Coordinates):
+            VertexFeature = RingFeatures[RingIDs]
+            VertexCount = numpy.bincount(VertexFeature, minlength=len(Keys))
+            CenterX = numpy.bincount(VertexFeature, weights=Coordinates[:, 0], minlength=len(Keys)) / numpy.maximum(VertexCount, 1)
+            CenterY = numpy.bincount(VertexFeature, weights=Coordinates[:, 1], minlength=len(Keys)) / numpy.maximum(VertexCount, 1)
+            CellRows, CellColumns = self.Grid.CellOf(CenterX[NoCells], CenterY[NoCells])
+            Feature, Row = numpy.concatenate([Feature, numpy.flatnonzero(NoCells)]), numpy.concatenate([Row, CellRows])
+            FirstColumn, LastColumn = numpy.concatenate([FirstColumn, CellColumns]), numpy.concatenate([LastColumn, CellColumns])
+
+        # Every span, grown by one cell along its row, on its own row and the rows above and below it
+        Feature = numpy.tile(Feature, 3)
+        Row = numpy.concatenate([Row - 1, Row, Row + 1])
+        FirstColumn = numpy.tile(numpy.maximum(FirstColumn - 1, 0), 3)
+        LastColumn = numpy.tile(numpy.minimum(LastColumn + 1, self.Grid.Columns - 1), 3)
+        OnGrid = (Row >= 0) & (Row < self.Grid.Rows)
+        Feature, Row, FirstColumn, LastColumn = Feature[OnGrid], Row[OnGrid], FirstColumn[OnGrid], LastColumn[OnGrid]
+
+        ConnectedCells = numpy.bincount(Feature, weights=CountInSpans_Fnx(self.Connected, Row, FirstColumn, LastColumn), minlength=len(Keys))
+        NearCells = numpy.bincount(Feature, weights=CountInSpans_Fnx(self.Near, Row, FirstColumn, LastColumn), minlength=len(Keys))
+
+        Scores = numpy.where(ConnectedCells > 0, ConnectedScore, numpy.where(NearCells > 0, NearScore, 0))
+        return Keys, Scores
+
+
+# Raster version of ConnectivityZones_Fnx: rasterizes the negative space and hull at CellSize and finds the connected and near zones
+def RasterConnectivityZones_Fnx(Backend, NegativeSpace, ConvexHull, Width, CellSize):
+    if ndimage is None:
+        raise ImportError("The raster connectivity engine requires scipy")
+    WidthMeters = PCAT_Backends.LinearUnitToMeters_Fnx(Width)
+    CellMeters = PCAT_Backends.LinearUnitToMeters_Fnx(CellSize)
+
+    PCAT_Backends.AddMessage(" ... rasterizing negative space")
+    Grid = ZoneGrid_Fnx(Backend, NegativeSpace, ConvexHull, WidthMeters, CellMeters)
+    NegativeMask, Grid = RasterizeLayer_Fnx(Backend, NegativeSpace, Grid=Grid)
+    HullMask, Grid = RasterizeLayer_Fnx(Backend, ConvexHull, Grid=Grid)
+    PCAT_Backends.AddMessage("     " + str(Grid.Rows) + " x " + str(Grid.Columns) + " cells of " + str(CellMeters) + " m")
+
+    PCAT_Backends.AddMessage(" ... finding narrowness with distance transforms")
+    Connected, Near = MorphologicalZones_Fnx(NegativeMask, HullMask, WidthMeters, CellMeters)
+    return ConnectivityRaster(Grid, Connected, Near)
+
+
+# Raster connectivity zones for several narrowness widths at once; returns {Width: ConnectivityRaster}
+'''NOTES:
+    The negative space and hull are rasterized once, and the distance to the edge of the negative space is calculated once and thresholded at every width (the erosions);
+    only the openings and the near zones need a distance transform of their own per width. The zones of each width are those of RasterConnectivityZones_Fnx at the same CellSize.
+'''
+def RasterSweepZones_Fnx(Backend, NegativeSpace, ConvexHull, Widths, CellSize):
+    if ndimage is None:
+        raise ImportError("The raster connectivity engine requires scipy")
+    CellMeters = PCAT_Backends.LinearUnitToMeters_Fnx(CellSize)
+
+    PCAT_Backends.AddMessage(" ... rasterizing negative space")
+    Grid = ZoneGrid_Fnx(Backend, NegativeSpace, ConvexHull, max(PCAT_Backends.LinearUnitToMeters_Fnx(Width) for Width in Widths), CellMeters)
+    NegativeMask, Grid = RasterizeLayer_Fnx(Backend, NegativeSpace, Grid=Grid)
+    HullMask, Grid = RasterizeLayer_Fnx(Backend, ConvexHull, Grid=Grid)
+    PCAT_Backends.AddMessage("     " + str(Grid.Rows) + " x " + str(Grid.Columns) + " cells of " + str(CellMeters) + " m")
+    EdgeDistance = _DistanceTo(~NegativeMask, CellMeters)
+
+    Rasters = {}
+    for Width in Widths:
+        PCAT_Backends.AddMessage(" ... finding narrowness for a width of " + Width)
+        Connected, Near = MorphologicalZones_Fnx(NegativeMask, HullMask, PCAT_Backends.LinearUnitToMeters_Fnx(Width), CellMeters, EdgeDistance)
+        Rasters[Width] = ConnectivityRaster(Grid, Connected, Near)
+    return Rasters
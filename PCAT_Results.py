@@ -0,0 +1,144 @@
+'''
+COLUMNAR RESULTS STORE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+Every calculated field (SP_Lng, SP_Adj_Pct, the ring acreages and percentages, Con_Score, PCAT_Scr ...) is held as
+one NumPy array per field, indexed by Match_ID, while the calculation runs. The arithmetic between fields (percentages,
+the final weighted score) is done with whole arrays, and all of the fields are written into the output in one bulk
+update at the end of the run (Backend.WriteResults), instead of a join, field calculation and copy per stage.
+
+The store can also be saved as a metrics table (a CSV file with one row per Match_ID), which PCAT_Score.py reads to
+score the sites with other weights without running the geometry again, and some of its fields can be saved as NumPy
+arrays (.npz) that are quick to load back, for the checkpoints of a run (see PCAT_Checkpoint.py).
+
+'''
+import csv, collections
+import numpy
+
+
+class ResultsStore(object):
+    '''NOTES:
+        MatchIDs are the Match_ID values of the output, kept sorted so that any list of Match_IDs can be turned into array positions with numpy.searchsorted.
+        Columns holds one array per field, in the order the fields were added. Integer fields (e.g. Con_Score) keep an integer dtype.
+    '''
+    def __init__(self, MatchIDs):
+        self.MatchIDs = numpy.unique(numpy.asarray(MatchIDs, dtype=numpy.int64))
+        self.Columns = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.MatchIDs)
+
+    def __contains__(self, FieldName):
+        return FieldName in self.Columns
+
+    def FieldNames(self):
+        return list(self.Columns.keys())
+
+    # Array positions of the given Match_IDs (raises an error for a Match_ID that is not in the output)
+    def Positions(self, MatchIDs):
+        MatchIDs = numpy.asarray(MatchIDs, dtype=numpy.int64)
+        Positions = numpy.searchsorted(self.MatchIDs, MatchIDs)
+        Positions = numpy.minimum(Positions, max(len(self.MatchIDs) - 1, 0))
+        if len(MatchIDs) and (len(self.MatchIDs) == 0 or numpy.any(self.MatchIDs[Positions] != MatchIDs)):
+            raise KeyError("Match_ID values not found in the output")
+        return Positions
+
+    # Sums Values by Match_ID into an array aligned with MatchIDs (Match_IDs without any value get 0)
+    def SumByMatchID(self, MatchIDs, Values):
+        return numpy.bincount(self.Positions(MatchIDs), weights=numpy.asarray(Values, dtype=float), minlength=len(self))
+
+    # Sets a whole field at once; Values is either aligned with MatchIDs, or given for the Match_IDs in ForMatchIDs (the others are left as they are, NaN for a new field)
+    def Set(self, FieldName, Values, ForMatchIDs=None):
+        Values = numpy.asarray(Values)
+        if ForMatchIDs is None:
+            if len(Values) != len(self):
+                raise ValueError(FieldName + " has " + str(len(Values)) + " values for " + str(len(self)) + " sites")
+            self.Columns[FieldName] = Values.copy()
+            return
+        if FieldName not in self.Columns:
+            self.Columns[FieldName] = numpy.full(len(self), numpy.nan)
+        self.Columns[FieldName][self.Positions(ForMatchIDs)] = Values
+
+    # Copies every field of another (smaller) results store into this one, for its Match_IDs
+    def Update(self, Other):
+        for FieldName in Other.FieldNames():
+            self.Set(FieldName, Other.Get(FieldName), ForMatchIDs=Other.MatchIDs)
+
+    def Get(self, FieldName):
+        return self.Columns[FieldName]
+
+    # Weighted sum of fields, Weights being [[FieldName, Weight], ...]; NaN counts as 0
+    def WeightedSum(self, Weights):
+        Total = numpy.zeros(len(self))
+        for FieldName, Weight in Weights:
+            Total += numpy.nan_to_num(self.Columns[FieldName].astype(float)) * Weight
+        return Total
+
+
+    # Writes the store as a CSV table: a Match_ID column and one column per field (floats are written with full precision)
+    # With Append, the rows are added to the end of an existing table (with the same fields), e.g. one chunk of sites at a time
+    def SaveTable(self, TableFile, Append=False):
+        FieldNames = self.FieldNames()
+        with open(TableFile, "a" if Append else "w", newline="") as table:
+            writer = csv.writer(table)
+            if not Append:
+                writer.writerow(["Match_ID"] + FieldNames)
+            for Position, MatchID in enumerate(self.MatchIDs):
+                writer.writerow([int(MatchID)] + [_TableValue(self.Columns[FieldName][Position]) for FieldName in FieldNames])
+        return TableFile
+
+    # Saves FieldNames (default: every field) with the Match_IDs as NumPy arrays in an .npz file; the values are kept exactly, with their dtypes
+    def SaveColumns(self, ColumnsFile, FieldNames=None):
+        FieldNames = self.FieldNames() if FieldNames is None else FieldNames
+        with open(ColumnsFile, "wb") as columns:
+            numpy.savez(columns, Match_ID=self.MatchIDs, **dict((FieldName, self.Columns[FieldName]) for FieldName in FieldNames))
+        return ColumnsFile
+
+    # Sets the fields saved by SaveColumns (for the Match_IDs they were saved for); returns their names
+    def LoadColumns(self, ColumnsFile):
+        with numpy.load(ColumnsFile, allow_pickle=False) as columns:
+            FieldNames = [FieldName for FieldName in columns.files if FieldName != "Match_ID"]
+            MatchIDs = columns["Match_ID"]
+            for FieldName in FieldNames:
+                if len(MatchIDs) == len(self) and numpy.array_equal(MatchIDs, self.MatchIDs):
+                    self.Set(FieldName, columns[FieldName])
+                else:
+                    self.Set(FieldName, columns[FieldName], ForMatchIDs=MatchIDs)
+        return FieldNames
+
+    # Reads a table written by SaveTable (columns of whole numbers are read as integer fields)
+    @classmethod
+    def LoadTable(cls, TableFile):
+        with open(TableFile, newline="") as table:
+            reader = csv.reader(table)
+            FieldNames = next(reader)
+            Rows = list(reader)
+        if not FieldNames or FieldNames[0] != "Match_ID":
+            raise ValueError(TableFile + " is not a metrics table (its first column must be Match_ID)")
+        Columns = list(zip(*Rows)) if Rows else [[] for FieldName in FieldNames]
+        MatchIDs = numpy.array(Columns[0], dtype=numpy.int64)
+        Order = numpy.argsort(MatchIDs)
+        Results = cls(MatchIDs)
+        for FieldName, Cells in zip(FieldNames[1:], Columns[1:]):
+            if len(Cells) and all(Cell.lstrip("-").isdigit() for Cell in Cells):
+                Values = numpy.array(Cells, dtype=numpy.int64)
+            else:
+                Values = numpy.array([float(Cell) if Cell != "" else numpy.nan for Cell in Cells])
+            Results.Set(FieldName, Values[Order])
+        return Results
+
+
+# Table cell for a value (an empty cell for NaN)
+def _TableValue(Value):
+    if isinstance(Value, (numpy.integer, int)):
+        return int(Value)
+    Value = float(Value)
+    return "" if Value != Value else repr(Value)
+
+
+# (Numerator / Denominator) * 100, with 0 where the denominator is 0
+def Percent_Fnx(Numerator, Denominator):
+    Numerator = numpy.asarray(Numerator, dtype=float)
+    Denominator = numpy.asarray(Denominator, dtype=float)
+    Result = numpy.zeros(numpy.broadcast(Numerator, Denominator).shape)
+    numpy.divide(Numerator, Denominator, out=Result, where=Denominator > 0)
+    return Result * 100
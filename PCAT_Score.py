@@ -0,0 +1,109 @@
+'''
+SCENARIO SCORING FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+The final PCAT score is a weighted sum of the calculated fields (ScoreWeights in TNC_ArcPyConservationTool.py).
+Trying other weights does not need the geometry again: save the fields of a run as a metrics table
+(--metrics-table metrics.csv) and score it here with any number of weighting scenarios at once.
+
+The scenarios are an N x F weight matrix and the metrics an F x P matrix (P sites), so every score of every
+scenario comes from one matrix multiply. Each scenario's scores are then ranked (1 = highest score, ties share the
+best rank), and the scores and ranks of all of the scenarios are exported as a single table:
+
+    Match_ID, <Scenario>_Scr, <Scenario>_Rank, ...
+
+To use from the command line:
+    python PCAT_Score.py metrics.csv scenarios.json scores.csv
+
+The scenario file is either JSON, {"Scenario name": {"FieldName": Weight, ...}, ...}, or CSV, with a Scenario
+column and one column per field (an empty cell is a weight of 0):
+
+    Scenario,SP_Adj_Pct,QMi_Pr_Pct,HMi_Pr_Pct,Mi1_Pr_Pct,Mi2_Pr_Pct,Con_Score
+    Default,0.2,0.35,0.25,0.15,0.05,0.3
+    Connectivity,0.1,0.2,0.1,0.05,0.05,1.0
+
+'''
+import os, sys, csv, json, argparse, collections
+import numpy
+
+from PCAT_Results import ResultsStore
+
+
+# Reads a scenario file (JSON or CSV, see above); returns an ordered {scenario name: [[FieldName, Weight], ...]}
+def ReadScenarios_Fnx(ScenarioFile):
+    Scenarios = collections.OrderedDict()
+    if os.path.splitext(ScenarioFile)[1].lower() == ".json":
+        with open(ScenarioFile) as source:
+            for Name, Weights in json.load(source, object_pairs_hook=collections.OrderedDict).items():
+                Scenarios[Name] = [[FieldName, float(Weight)] for FieldName, Weight in (Weights.items() if isinstance(Weights, dict) else Weights)]
+        return Scenarios
+
+    with open(ScenarioFile, newline="") as source:
+        for row in csv.DictReader(source):
+            Name = row.pop("Scenario")
+            Scenarios[Name] = [[FieldName, float(Weight)] for FieldName, Weight in row.items() if Weight not in ("", None)]
+    return Scenarios
+
+
+# SCORE MATRIX FUNCTION:
+# Scores every site for every scenario with one matrix multiply; returns (scenario names, N x P score matrix in the order of Results.MatchIDs)
+'''NOTES:
+    Scenarios is {name: [[FieldName, Weight], ...]} (the same format as ScoreWeights). Missing values count as 0, as in the final score of a run.
+'''
+def ScoreMatrix_Fnx(Results, Scenarios):
+    ScenarioNames = list(Scenarios.keys())
+    FieldNames = []
+    for Weights in Scenarios.values():
+        FieldNames.extend(FieldName for FieldName, Weight in Weights if FieldName not in FieldNames)
+    Missing = [FieldName for FieldName in FieldNames if FieldName not in Results]
+    if Missing:
+        raise KeyError("Fields not in the metrics: " + ", ".join(Missing))
+
+    WeightMatrix = numpy.zeros((len(ScenarioNames), len(FieldNames)))
+    for Row, Name in enumerate(ScenarioNames):
+        for FieldName, Weight in Scenarios[Name]:
+            WeightMatrix[Row, FieldNames.index(FieldName)] += Weight
+    MetricMatrix = numpy.vstack([numpy.nan_to_num(Results.Get(FieldName).astype(float)) for FieldName in FieldNames]) if FieldNames else numpy.zeros((0, len(Results)))
+    return ScenarioNames, WeightMatrix.dot(MetricMatrix)
+
+
+# Ranks each row of a score matrix: 1 for the highest score, ties share the best rank (e.g. 1, 2, 2, 4)
+def Ranks_Fnx(Scores):
+    Scores = numpy.atleast_2d(Scores)
+    Order = numpy.argsort(-Scores, axis=1, kind="stable")
+    Sorted = numpy.take_along_axis(Scores, Order, axis=1)
+    Positions = numpy.broadcast_to(numpy.arange(Scores.shape[1]), Scores.shape)
+    # Each score takes the position of the first score of its group of ties
+    GroupStart = numpy.ones(Scores.shape, dtype=bool)
+    GroupStart[:, 1:] = Sorted[:, 1:] != Sorted[:, :-1]
+    SortedRanks = numpy.maximum.accumulate(numpy.where(GroupStart, Positions, 0), axis=1) + 1
+    Ranks = numpy.empty(Scores.shape, dtype=numpy.int64)
+    numpy.put_along_axis(Ranks, Order, SortedRanks, axis=1)
+    return Ranks
+
+
+# Exports the scores and ranks of every scenario as one table: Match_ID, <Scenario>_Scr, <Scenario>_Rank, ...
+def ExportScores_Fnx(TableFile, MatchIDs, ScenarioNames, Scores, Ranks):
+    Table = ResultsStore(MatchIDs)
+    for Row, Name in enumerate(ScenarioNames):
+        Table.Set(Name + "_Scr", Scores[Row])
+        Table.Set(Name + "_Rank", Ranks[Row])
+    return Table.SaveTable(TableFile)
+
+
+# Scores a metrics table (ResultsStore.SaveTable) with every scenario of a scenario file and exports the scores and ranks
+def ScoreScenarios_Fnx(MetricsTable, ScenarioFile, OutputTable):
+    Results = ResultsStore.LoadTable(MetricsTable)
+    Scenarios = ReadScenarios_Fnx(ScenarioFile)
+    ScenarioNames, Scores = ScoreMatrix_Fnx(Results, Scenarios)
+    ExportScores_Fnx(OutputTable, Results.MatchIDs, ScenarioNames, Scores, Ranks_Fnx(Scores))
+    print("Scored " + str(len(Results)) + " sites with " + str(len(ScenarioNames)) + " scenarios into " + OutputTable)
+    return OutputTable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scores a PCAT metrics table with several weighting scenarios at once.")
+    parser.add_argument("MetricsTable", help="metrics table written with --metrics-table")
+    parser.add_argument("ScenarioFile", help="weighting scenarios (.json or .csv)")
+    parser.add_argument("OutputTable", help="CSV table of the scores and ranks of every scenario")
+    Parameters = parser.parse_args(sys.argv[1:])
+    ScoreScenarios_Fnx(Parameters.MetricsTable, Parameters.ScenarioFile, Parameters.OutputTable)
@@ -0,0 +1,186 @@
+'''
+STREAMING (BOUNDED MEMORY) MODE FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+A normal run holds the whole analysis file, every intermediate layer and every calculated field in memory at once,
+which does not fit for statewide parcel fabrics (millions of polygons). In the streaming mode the sites are read,
+calculated and written a chunk at a time:
+
+    1) one pass over the analysis file records each site's feature id and the position of the center of its envelope
+       along a Hilbert curve (16 bytes per site; the geometries are not kept)
+    2) the sites are sorted along the curve and cut into chunks of ChunkSize sites, so every chunk is a compact area
+    3) for each chunk, the sites are read by feature id, the prepared context and exclusion are cut down with their
+       spatial indexes to the features within the halo distance of the chunk, every field is calculated
+       (ChunkFunction), and the sites are appended to the output (and to the metrics table)
+
+The connectivity areas are not built for the whole study area: each chunk finds the narrow and near areas in a window
+of three narrowness widths around its own sites (TNC_ArcPyConservationTool.ChunkZones_Fnx, with the windows of
+PCAT_GapGraph.py), so nothing the size of the study area but the prepared layers is held. Peak memory is bounded by
+the chunk size and by the prepared layers, which only depend on the context and exclusion (keep them between runs
+with --cache-folder). The values are exactly those of a normal run with the vector (or graph) connectivity, for the
+same reason as with PCAT_Parallel.py: every site sees the same context, exclusion and connectivity features it would
+see in the whole layers (the raster connectivity is not used in this mode). The sites are written in chunk (Hilbert)
+order rather than in input order; Match_ID still numbers them in input order.
+
+The streaming mode needs the open engine (OpenBackend writes the output a chunk at a time).
+
+To use from the command line:
+    python TNC_ArcPyConservationTool.py context.shp parcels.shp exclusion.shp "" "25 Meters" --engine open --chunk-size 50000
+
+'''
+import math
+import numpy
+
+try:
+    import shapely
+    import shapely.geometry
+except ImportError:
+    shapely = None
+
+try:
+    import fiona
+except ImportError:
+    fiona = None
+
+import PCAT_Backends
+import PCAT_Profile
+from PCAT_Backends import AddMessage
+from PCAT_Parallel import HaloPositions_Fnx
+from PCAT_Results import ResultsStore
+
+
+# Prepared layers cut down to the halo (the site metrics distance) of each chunk
+HaloLayers = ["ContextNoExclusion", "Exclusion"]
+
+
+# #########################################################################
+# Ordering the Sites
+# #########################################################################
+
+# Distance of each (X, Y) along a Hilbert curve of 2^Order x 2^Order cells over Bounds (XMin, YMin, XMax, YMax)
+def HilbertKeys_Fnx(X, Y, Bounds, Order=16):
+    Side = 2 ** Order
+    Scale = (Side - 1) / max(Bounds[2] - Bounds[0], Bounds[3] - Bounds[1], 1e-9)
+    HX = numpy.clip(((numpy.asarray(X) - Bounds[0]) * Scale).astype(numpy.int64), 0, Side - 1)
+    HY = numpy.clip(((numpy.asarray(Y) - Bounds[1]) * Scale).astype(numpy.int64), 0, Side - 1)
+    Keys = numpy.zeros(len(HX), dtype=numpy.int64)
+    Level = Side // 2
+    while Level > 0:
+        RX = (HX & Level) > 0
+        RY = (HY & Level) > 0
+        Keys += Level * Level * ((3 * RX) ^ RY)
+        # Rotating the quadrant, so that the curve stays continuous
+        Flip = ~RY & RX
+        HX = numpy.where(Flip, Side - 1 - HX, HX)
+        HY = numpy.where(Flip, Side - 1 - HY, HY)
+        HX, HY = numpy.where(RY, HX, HY), numpy.where(RY, HY, HX)
+        Level //= 2
+    return Keys
+
+
+# One pass over the analysis file: returns (feature ids, Hilbert keys of the centers of the envelopes), without keeping the geometries
+def ScanSites_Fnx(AnalysisFile, BatchSize=50000):
+    FeatureIDs, Keys = [], []
+    with fiona.open(AnalysisFile) as source:
+        Bounds = source.bounds
+        Batch, BatchIDs = [], []
+
+        def Flush():
+            Envelopes = shapely.bounds(numpy.array(Batch, dtype=object)).reshape(-1, 4)
+            CenterX = numpy.nan_to_num((Envelopes[:, 0] + Envelopes[:, 2]) / 2, nan=Bounds[0])
+            CenterY = numpy.nan_to_num((Envelopes[:, 1] + Envelopes[:, 3]) / 2, nan=Bounds[1])
+            FeatureIDs.append(numpy.array(BatchIDs, dtype=numpy.int64))
+            Keys.append(HilbertKeys_Fnx(CenterX, CenterY, Bounds))
+            del Batch[:], BatchIDs[:]
+
+        for feature in source:
+            Geometry = feature["geometry"]
+            Batch.append(shapely.geometry.shape(Geometry) if Geometry is not None else None)
+            BatchIDs.append(int(feature["id"]))
+            if len(Batch) >= BatchSize:
+                Flush()
+        if Batch:
+            Flush()
+    if not FeatureIDs:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(FeatureIDs), numpy.concatenate(Keys)
+
+
+# Splits the sites into chunks of at most ChunkSize consecutive sites along the Hilbert curve; returns a list of position arrays (sorted within each chunk)
+def ChunkPlan_Fnx(Keys, ChunkSize):
+    Order = numpy.argsort(Keys, kind="stable")
+    Chunks = int(math.ceil(len(Keys) / float(max(ChunkSize, 1))))
+    return [numpy.sort(Chunk) for Chunk in numpy.array_split(Order, max(Chunks, 1)) if len(Chunk)]
+
+
+# #########################################################################
+# Reading and Calculating a Chunk
+# #########################################################################
+
+# Reads the sites at Positions of the analysis file (an open fiona collection) into a FeatureLayer with the input fields and Match_ID (position + 1, as in CreateOutput)
+def ReadChunk_Fnx(source, FeatureIDs, Positions):
+    FieldNames = list(source.schema["properties"].keys())
+    Geometries, Values = [], dict((Name, []) for Name in FieldNames)
+    for Position in Positions:
+        feature = source[int(FeatureIDs[Position])]
+        Geometry = feature["geometry"]
+        Geometries.append(shapely.geometry.shape(Geometry) if Geometry is not None else None)
+        for Name in FieldNames:
+            Values[Name].append(feature["properties"][Name])
+    Fields = [(Name, numpy.array(Values[Name], dtype=object)) for Name in FieldNames]
+    Fields.append(("Match_ID", numpy.asarray(Positions, dtype=numpy.int64) + 1))
+    return PCAT_Backends.FeatureLayer(Geometries, Fields, source.crs, source.schema, source.driver)
+
+
+# The prepared layers with the halo layers cut down to the features near the sites (the other entries are shared as they are)
+def HaloPrepared_Fnx(Prepared, SiteGeometries, HaloDistance):
+    ChunkPrepared = dict(Prepared)
+    for Name in HaloLayers:
+        if Name in Prepared:
+            # A little more than the halo distance, since the buffers are only approximations of circles
+            ChunkPrepared[Name] = Prepared[Name].Take(HaloPositions_Fnx(Prepared[Name], SiteGeometries, HaloDistance + 1.0))
+    return ChunkPrepared
+
+
+# STREAMING FUNCTION:
+# Calculates and writes the output a chunk of sites at a time; returns the number of sites written
+'''NOTES:
+    ChunkFunction(Backend, SiteLayer, ChunkPrepared, Results) calculates every output field of the sites of a chunk into Results (a ResultsStore of their Match_IDs), including their connectivity areas.
+    HaloDistance is the largest distance (in meters) at which a context or exclusion feature can change a site's values, i.e. the largest buffer ring.
+    The progress messages of the chunks are turned off; one line is sent per chunk instead.
+    Writer is the writer of the output format (see PCAT_Output.OutputWriter_Fnx), opened with the schema of the analysis file and given each chunk with its results.
+    MetricsTable (optional) is written a chunk at a time as well (ResultsStore.SaveTable with Append).
+'''
+def StreamPCAT_Fnx(Backend, AnalysisFile, Writer, OutputFields, Prepared, ChunkFunction, HaloDistance, ChunkSize, MetricsTable=None):
+    AddMessage(" ... ordering the sites along a Hilbert curve")
+    with PCAT_Profile.Stage("scan sites"):
+        FeatureIDs, Keys = ScanSites_Fnx(AnalysisFile)
+        Chunks = ChunkPlan_Fnx(Keys, ChunkSize)
+    del Keys
+    AddMessage(" ... " + str(len(FeatureIDs)) + " sites in " + str(len(Chunks)) + " chunks of up to " + str(ChunkSize))
+
+    Written = 0
+    with fiona.open(AnalysisFile) as source:
+        with Writer.Open(source.schema, source.crs):
+            for Number, Positions in enumerate(Chunks):
+                with PCAT_Profile.Stage("chunk"):
+                    SiteLayer = ReadChunk_Fnx(source, FeatureIDs, Positions)
+                    for FieldName, FieldType, Precision, Scale in OutputFields:
+                        SiteLayer.Fields.setdefault(FieldName, numpy.full(len(SiteLayer), None, dtype=object))
+                    Results = ResultsStore(SiteLayer.Fields["Match_ID"])
+                    ChunkPrepared = HaloPrepared_Fnx(Prepared, SiteLayer.Geometries, HaloDistance)
+
+                    ShowMessages = PCAT_Backends.ShowMessages
+                    PCAT_Backends.ShowMessages = False
+                    try:
+                        ChunkFunction(Backend, SiteLayer, ChunkPrepared, Results)
+                    finally:
+                        PCAT_Backends.ShowMessages = ShowMessages
+
+                    Backend.WriteResults(SiteLayer, Results)
+                    Writer.Write(SiteLayer, Results)
+                    if MetricsTable:
+                        Results.SaveTable(MetricsTable, Append=Number > 0)
+                Written += len(SiteLayer)
+                AddMessage("     " + str(Number + 1) + " of " + str(len(Chunks)) + " chunks done (" + str(Written) + " sites" +
+                           (", " + str(int(PCAT_Backends.ResidentMB_Fnx())) + " MB resident" if PCAT_Backends.ResidentMB_Fnx() is not None else "") + ")")
+    return Written
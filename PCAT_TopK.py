@@ -0,0 +1,239 @@
+'''
+TOP-K RANKING FOR THE PCAT TOOL (TNC_ArcPyConservationTool.py)
+
+Most uses of the tool only need the best 50 to 200 sites by PCAT_Scr, but a full run calculates every field of every
+site, and almost all of that time goes into intersecting the four buffer rings with the context. The top-K mode
+finds the same K sites while calculating the rings for only a fraction of the sites:
+
+    1) the fields that are quick to calculate are calculated exactly for every site: the perimeter percentage, the
+       connectivity score and the acreage of every ring minus the exclusion (the buffers and the erase, without the
+       intersect with the context)
+    2) for every site and ring, an upper bound of the conserved acres in the ring is summed from a grid of the
+       context (each cell holds the most context acres it can contain, from the envelopes and acreages of the
+       context features) over the cells the ring can reach, and capped at the ring's acreage plus the acres by which
+       context features overlap each other (without overlaps, no ring can be more than 100 % conserved). That gives
+       an upper bound of each site's final score
+    3) the sites are calculated in full in the order of their bounds, a batch at a time (the batches double in
+       size), until the bound of the next site is below the K-th best score found so far: no site left can then
+       make the top K
+
+The bounds only ever over-estimate (with a small allowance for floating point and overlay tolerances), so the K
+sites, their fields and their order are exactly those of ranking the output of a full run by PCAT_Scr (ties are
+broken by Match_ID). How many sites need the full calculation depends on the landscape: the fewer sites surrounded
+by a lot of conservation land, the fewer.
+
+To use from the command line:
+    python TNC_ArcPyConservationTool.py context.shp parcels.shp exclusion.shp "" "25 Meters" --top-k 100
+
+'''
+import math
+import numpy
+
+import PCAT_Backends
+from PCAT_Backends import AddMessage, SquareMetersPerAcre
+from PCAT_Boundary import GridIndex
+
+
+# Allowance on the upper bounds for floating point and overlay (XY tolerance) differences: relative, and in acres
+RelativeSlack = 1e-4
+AcreSlack = 1e-6
+
+# Largest number of cells of the context grid, of grid cells a context feature is spread over, and sites compared with the larger context features at once
+MaxTableCells = 4000000
+MaxFeatureCells = 4096
+ChunkSites = 20000
+
+
+# #########################################################################
+# Upper Bounds
+# #########################################################################
+
+# Envelopes (XMin, YMin, XMax, YMax) and acreages of the polygons of Layer, from their rings (holes count as area, which only raises the bounds)
+def PolygonAcres_Fnx(Backend, Layer):
+    Coordinates, RingIDs, RingKeys = Backend.ReadRings(Layer)
+    if len(RingKeys) == 0:
+        return numpy.zeros((0, 4)), numpy.zeros(0)
+    # Shoelace formula on the vertices moved to the first vertex of their ring (which keeps the large map coordinates from cancelling out)
+    First = numpy.searchsorted(RingIDs, numpy.arange(len(RingKeys)))
+    Local = Coordinates - Coordinates[First][RingIDs]
+    Same = RingIDs[:-1] == RingIDs[1:]
+    Cross = (Local[:-1, 0] * Local[1:, 1] - Local[1:, 0] * Local[:-1, 1]) * Same
+    RingAcres = numpy.abs(numpy.bincount(RingIDs[:-1], weights=Cross, minlength=len(RingKeys))) / 2 / SquareMetersPerAcre
+
+    Features, RingFeatures = numpy.unique(RingKeys, return_inverse=True)
+    Acres = numpy.bincount(RingFeatures, weights=RingAcres, minlength=len(Features))
+    VertexFeatures = RingFeatures[RingIDs]
+    Envelopes = numpy.column_stack([numpy.full(len(Features), numpy.inf), numpy.full(len(Features), numpy.inf),
+                                    numpy.full(len(Features), -numpy.inf), numpy.full(len(Features), -numpy.inf)])
+    numpy.minimum.at(Envelopes[:, 0], VertexFeatures, Coordinates[:, 0])
+    numpy.minimum.at(Envelopes[:, 1], VertexFeatures, Coordinates[:, 1])
+    numpy.maximum.at(Envelopes[:, 2], VertexFeatures, Coordinates[:, 0])
+    numpy.maximum.at(Envelopes[:, 3], VertexFeatures, Coordinates[:, 1])
+    return Envelopes, Acres
+
+
+# CONTEXT ACRES BOUND FUNCTION:
+# Upper bound of the context acres within each Distance of each site: an array with one row per site (SiteBounds) and one column per distance
+'''NOTES:
+    The context is summarized on a grid: a cell holds, for every feature whose envelope overlaps it, the smaller of the feature's acreage and the overlap of its envelope with the cell.
+    A site's ring lies within the site's envelope grown by the ring distance with rounded corners, so the bound is the sum of the cells each row of that shape overlaps (from a prefix sum along every row of the grid, and a summed-area table for the rows beside the envelope).
+    Features over MaxFeatureCells cells count in full for every site whose expanded envelope they overlap, through a grid index (PCAT_Boundary.GridIndex), ChunkSites sites at a time.
+'''
+def ContextAcreBounds_Fnx(ContextEnvelopes, ContextAcres, SiteBounds, Distances):
+    Bounds = numpy.zeros((len(SiteBounds), len(Distances)))
+    if len(ContextAcres) == 0 or len(SiteBounds) == 0:
+        return Bounds
+    Valid = ~numpy.isnan(SiteBounds).any(axis=1)
+    SiteBounds = numpy.where(Valid[:, None], SiteBounds, 0.0)
+
+    # Cells of about an eighth of the typical feature, or larger when the grid would have more than MaxTableCells cells
+    Origin = ContextEnvelopes[:, :2].min(axis=0)
+    Width, Height = max(ContextEnvelopes[:, 2].max() - Origin[0], 1.0), max(ContextEnvelopes[:, 3].max() - Origin[1], 1.0)
+    Sizes = numpy.maximum(ContextEnvelopes[:, 2] - ContextEnvelopes[:, 0], ContextEnvelopes[:, 3] - ContextEnvelopes[:, 1])
+    CellSize = max(float(numpy.median(Sizes)) / 8, math.sqrt(Width * Height / MaxTableCells), 1e-3)
+    Columns, Rows = int(Width // CellSize) + 1, int(Height // CellSize) + 1
+
+    def Cell(Values, OriginValue, Count):
+        return numpy.clip(numpy.floor((Values - OriginValue) / CellSize), 0, Count - 1).astype(numpy.int64)
+
+    Column0, Column1 = Cell(ContextEnvelopes[:, 0], Origin[0], Columns), Cell(ContextEnvelopes[:, 2], Origin[0], Columns)
+    Row0, Row1 = Cell(ContextEnvelopes[:, 1], Origin[1], Rows), Cell(ContextEnvelopes[:, 3], Origin[1], Rows)
+    CellCounts = (Column1 - Column0 + 1) * (Row1 - Row0 + 1)
+    Small = numpy.flatnonzero(CellCounts <= MaxFeatureCells)
+    Large = numpy.flatnonzero(CellCounts > MaxFeatureCells)
+
+    # Every cell of every small feature's envelope, with the smaller of the feature's acreage and the area of the envelope in the cell
+    Grid = numpy.zeros(Rows * Columns)
+    for Chunk in numpy.array_split(Small, max(1, int(CellCounts[Small].sum() // 20000000) + 1)):
+        Owners = numpy.repeat(Chunk, CellCounts[Chunk])
+        Offsets = numpy.arange(len(Owners)) - numpy.repeat(numpy.cumsum(CellCounts[Chunk]) - CellCounts[Chunk], CellCounts[Chunk])
+        Spans = Column1[Owners] - Column0[Owners] + 1
+        CellColumns, CellRows = Column0[Owners] + Offsets % Spans, Row0[Owners] + Offsets // Spans
+        OverlapX = (numpy.minimum(ContextEnvelopes[Owners, 2], Origin[0] + (CellColumns + 1) * CellSize) -
+                    numpy.maximum(ContextEnvelopes[Owners, 0], Origin[0] + CellColumns * CellSize))
+        OverlapY = (numpy.minimum(ContextEnvelopes[Owners, 3], Origin[1] + (CellRows + 1) * CellSize) -
+                    numpy.maximum(ContextEnvelopes[Owners, 1], Origin[1] + CellRows * CellSize))
+        # (the edge cells of an envelope are counted in full, which keeps a rounding error in the overlaps from lowering the bound)
+        OverlapX = numpy.where((CellColumns == Column0[Owners]) | (CellColumns == Column1[Owners]), CellSize, numpy.maximum(OverlapX, 0))
+        OverlapY = numpy.where((CellRows == Row0[Owners]) | (CellRows == Row1[Owners]), CellSize, numpy.maximum(OverlapY, 0))
+        Grid += numpy.bincount(CellRows * Columns + CellColumns, weights=numpy.minimum(ContextAcres[Owners], OverlapX * OverlapY / SquareMetersPerAcre),
+                               minlength=Rows * Columns)
+    Grid = Grid.reshape(Rows, Columns)
+    RowSums = numpy.zeros((Rows, Columns + 1))
+    RowSums[:, 1:] = Grid.cumsum(axis=1)
+    Table = numpy.zeros((Rows + 1, Columns + 1))
+    Table[1:, :] = RowSums.cumsum(axis=0)
+    del Grid
+
+    SiteRow0, SiteRow1 = Cell(SiteBounds[:, 1], Origin[1], Rows), Cell(SiteBounds[:, 3], Origin[1], Rows)
+    Inside = lambda Values, OriginValue, Count: numpy.clip(numpy.floor((Values - OriginValue) / CellSize), -1, Count).astype(numpy.int64)
+    for Ring, Distance in enumerate(Distances):
+        # The rows beside the site's envelope, across its full expanded width
+        Column0 = numpy.clip(Inside(SiteBounds[:, 0] - Distance, Origin[0], Columns), 0, Columns)
+        Column1 = numpy.clip(Inside(SiteBounds[:, 2] + Distance, Origin[0], Columns) + 1, 0, Columns)
+        Bounds[:, Ring] = (Table[SiteRow1 + 1, Column1] - Table[SiteRow0, Column1] - Table[SiteRow1 + 1, Column0] + Table[SiteRow0, Column0])
+
+        # The rows above and below it, each across the width of the rounded corners at the nearest edge of the row
+        for Step in range(1, int(Distance // CellSize) + 2):
+            for Row, Gap in ((SiteRow1 + Step, Origin[1] + (SiteRow1 + Step) * CellSize - SiteBounds[:, 3]),
+                             (SiteRow0 - Step, SiteBounds[:, 1] - (Origin[1] + (SiteRow0 - Step + 1) * CellSize))):
+                InReach = (Row >= 0) & (Row < Rows) & (Gap <= Distance)
+                Reach = numpy.sqrt(numpy.maximum(Distance ** 2 - numpy.maximum(Gap, 0) ** 2, 0))
+                Column0 = numpy.clip(Inside(SiteBounds[:, 0] - Reach, Origin[0], Columns), 0, Columns)
+                Column1 = numpy.clip(Inside(SiteBounds[:, 2] + Reach, Origin[0], Columns) + 1, 0, Columns)
+                Row = numpy.clip(Row, 0, Rows - 1)
+                Bounds[:, Ring] += numpy.where(InReach, RowSums[Row, Column1] - RowSums[Row, Column0], 0.0)
+
+    # The large features, one chunk of sites at a time
+    if len(Large):
+        Index = GridIndex(ContextEnvelopes[Large])
+        for Start in range(0, len(SiteBounds), ChunkSites):
+            Chunk = SiteBounds[Start:Start + ChunkSites]
+            for Ring, Distance in enumerate(Distances):
+                Pairs = Index.Query(Chunk, Distance)
+                Bounds[Start:Start + len(Chunk), Ring] += numpy.bincount(Pairs[0], weights=ContextAcres[Large][Pairs[1]], minlength=len(Chunk))
+
+    # (the prefix sums can be off by a rounding error of their largest sums)
+    Bounds += ContextAcres.sum() * 1e-12
+    Bounds[~Valid] = 0.0
+    return Bounds
+
+
+# RING PERCENT BOUND FUNCTION:
+# Upper bounds of the conserved percentage of every ring of every site (one row per site of Results, one column per ring)
+'''NOTES:
+    BufferAcres are the exact acreages of the rings minus the exclusion (one row per site of Results, one column per ring), i.e. the denominators of the percentages.
+    ContextLayer is the context minus the exclusion, as used for the rings; it is dissolved once to measure how much its features overlap each other.
+'''
+def RingPercentBounds_Fnx(Backend, OutputLayer, ContextLayer, Results, BufferAcres, Distances):
+    AddMessage(" ... bounding the conserved acres within the buffers")
+    MatchIDs, Shapes, SiteBounds = Backend.ReadShapes(OutputLayer, "Match_ID")
+    SiteBounds = SiteBounds[numpy.argsort(MatchIDs)][numpy.searchsorted(numpy.sort(MatchIDs), Results.MatchIDs)]
+    del Shapes
+    ContextEnvelopes, ContextAcres = PolygonAcres_Fnx(Backend, ContextLayer)
+    AcreBounds = ContextAcreBounds_Fnx(ContextEnvelopes, ContextAcres, SiteBounds, Distances)
+
+    # Acres counted more than once where the context features overlap (no conserved acres within a ring can go beyond its acreage plus these)
+    Dissolved = Backend.Dissolve(ContextLayer)
+    OverlapAcres = Backend.ReadMeasure(ContextLayer, [], "AREA")[1].sum() - Backend.ReadMeasure(Dissolved, [], "AREA")[1].sum()
+    Backend.Delete(Dissolved)
+    OverlapAcres = max(OverlapAcres, 0.0) + RelativeSlack * ContextAcres.sum()
+    AddMessage("     " + "%.1f" % OverlapAcres + " acres of overlapping context")
+
+    AcreBounds = numpy.minimum(AcreBounds, BufferAcres + OverlapAcres) * (1 + RelativeSlack) + AcreSlack
+    Bounds = numpy.zeros_like(AcreBounds)
+    numpy.divide(AcreBounds * 100, BufferAcres, out=Bounds, where=BufferAcres > 0)
+    return Bounds
+
+
+# Upper bound of the final score of every site: the weighted sum of the exact fields in Results, with Bounds (a dictionary {FieldName: upper bounds}) for the others
+def BoundScores_Fnx(Results, Weights, Bounds):
+    Total = numpy.zeros(len(Results))
+    for FieldName, Weight in Weights:
+        if FieldName in Bounds:
+            # (all of the bounded fields are at least 0, which bounds them for a negative weight)
+            Total += (Bounds[FieldName] if Weight >= 0 else 0.0) * Weight
+        else:
+            Total += numpy.nan_to_num(Results.Get(FieldName).astype(float)) * Weight
+    return Total + 1e-9 * (1 + numpy.abs(Total))
+
+
+# #########################################################################
+# Ranking
+# #########################################################################
+
+# TOP-K FUNCTION:
+# Calculates the sites in the order of their bounds until no site left can make the top K; returns (Match_IDs of the top K, best first, their scores, number of sites calculated)
+'''NOTES:
+    ScoreFunction(MatchIDs) calculates the sites with the given (sorted) Match_IDs in full and returns their final scores, in the same order.
+    Sites are ranked by score, then by Match_ID. A site is only left out when its bound is below the K-th best score, so ties with the K-th site are always calculated.
+'''
+def TopK_Fnx(MatchIDs, BoundScores, ScoreFunction, K, FirstBatch=None):
+    MatchIDs = numpy.asarray(MatchIDs, dtype=numpy.int64)
+    Order = numpy.lexsort((MatchIDs, -BoundScores))
+    Scores = numpy.full(len(MatchIDs), numpy.nan)
+    BatchSize = FirstBatch or max(2 * K, 64)
+    Done = 0
+    while Done < len(Order):
+        Calculated = Scores[Order[:Done]]
+        Threshold = numpy.partition(Calculated, len(Calculated) - K)[len(Calculated) - K] if len(Calculated) >= K else -numpy.inf
+        # (the bounds are sorted, so the sites that can still make the top K come first)
+        Reachable = int(numpy.count_nonzero(BoundScores[Order[Done:]] >= Threshold))
+        if Reachable == 0:
+            break
+        Batch = numpy.sort(Order[Done:Done + min(BatchSize, Reachable)])
+
+        ShowMessages = PCAT_Backends.ShowMessages
+        PCAT_Backends.ShowMessages = False
+        try:
+            Scores[Batch] = ScoreFunction(MatchIDs[Batch])
+        finally:
+            PCAT_Backends.ShowMessages = ShowMessages
+        Done += len(Batch)
+        BatchSize *= 2
+        AddMessage("     " + str(Done) + " of " + str(len(Order)) + " sites calculated" +
+                   (", K-th best score so far %.4f" % numpy.sort(Scores[Order[:Done]])[-K] if Done >= K else ""))
+
+    Calculated = Order[:Done]
+    Ranked = Calculated[numpy.lexsort((MatchIDs[Calculated], -Scores[Calculated]))][:K]
+    return MatchIDs[Ranked], Scores[Ranked], Done
@@ -1,547 +1,1139 @@
-'''
-THIS SCRIPT CALCULATES A FINAL RANKING FOR POTENTIAL CONSERVATION SITES ACCORDING TO ITS PROXIMITY AND CONNECTIVITY TO EXISTING CONSERVATION SITES. IT ALSO HAS THE ABILITY TO EXLCUDE A PORTION OF THE STUDY AREA.
-
-Author: Lauren Payne-Riley
-Current Status: DRAFT (see report for known issues and proposed additions)
-
-To create an ArcToolbox tool with which to execute this script, do the following.
-1   In  ArcMap > Catalog > Toolboxes > My Toolboxes, either select an existing toolbox
-    or right-click on My Toolboxes and use New > Toolbox to create (then rename) a new one.
-2   Drag (or use ArcToolbox > Add Toolbox to add) this toolbox to ArcToolbox.
-3   Right-click on the toolbox in ArcToolbox, and use Add > Script to open a dialog box.
-4   In this Add Script dialog box, use Label to name the tool being created, and press Next.
-5   In a new dialog box, browse to the .py file to be invoked by this tool, and press Next.
-6   In the next dialog box, specify the following inputs (using dropdown menus wherever possible)
-    before pressing OK or Finish.
-        DISPLAY NAME              DATA TYPE       PROPERTY>DIRECTION>VALUE       
-        Context File              Shapefile       Input
-        Analysis File             Shapefile       Input
-        Exclusion File            Shapefile       Input
-        Workspace                 Shapefile       Input
-        Buffer Distanace (Meters) Linear Unit     Input
-           
-   To later revise any of this, right-click to the tool's name and select Properties.
-
-'''
-# #########################################################################
-# Setting Up: Importing Packages and Setting the Environment
-# #########################################################################
-
-import sys, os, string, math, arcpy, traceback, numpy, time
-
-# Allow output to overwite any existing grid of the same name
-arcpy.env.overwriteOutput = True
-
-
-# This ensures that when using a table join the original field names will be use and not appended by the name of each of the joining fields (this is necessary to ensure accurate field names can be called within the buffer function) 
-arcpy.env.qualifiedFieldNames = False
-
-
-# #########################################################################
-# Defining Functions
-# #########################################################################
-
-
-# PERIMETER PERCENTAGE FUNCTION:
-# This function calculates the % of the perimeter of the analysis site that is already under conservation, minus areas of exclusion
-'''NOTES:
-    Fieldnames inputs require quotation marks around them
-    For simplicity I have chosen to name the output, context, and exclusion shapefile variables inputs as the exact same name as the actual files. This is not necessary.
-'''
-def PerimeterPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, PeriFieldName, PercentPeriContextFieldName):
-    #Making Temporary Shapefiles
-    PerimeterOnly                   = nameOfOutputShapefile[:-4] + "_temp1" + ".shp"    
-    Perimeter_NoExclusion           = nameOfOutputShapefile[:-4] + "_temp2" + ".shp"
-    Conxt_PeriOverlap               = nameOfOutputShapefile[:-4] + "_temp3"  + ".shp"
-    Perimeter_NoExclusion2          = nameOfOutputShapefile[:-4] + "_temp4"  + ".shp"
-    Conxt_PeriOverlap2              = nameOfOutputShapefile[:-4] + "_temp5"  + ".shp"
-    Conxt_PeriOverlap3              = nameOfOutputShapefile[:-4] + "_temp6"  + ".shp"
-    Peri_Join                       = nameOfOutputShapefile[:-4] + "_temp7"  + ".shp"
-    SmartOutput2                    = nameOfOutputShapefile[:-4] + "_temp8"  + ".shp"
-        
-    # Converting the Analysis Sites to be only their Perimeters (this removes the issue of locations where segments of the land under consideration are cross-listed as already under conservation - although this data error is likely mostly due to how the sample data was processed, this will ensure that the problem does not arise in the future)
-    arcpy.AddMessage(" ... converting polygon to line")
-    arcpy.PolygonToLine_management(nameOfOutputShapefile, PerimeterOnly, "IGNORE_NEIGHBORS")
-
-    #Erasing Exclusion file from buffer (input, erase features, output):
-    arcpy.AddMessage(" ... erasing exclusion")
-    arcpy.Erase_analysis(PerimeterOnly, ExclusionFile, Perimeter_NoExclusion)
-    
-    #Make area into a layer before using intersect:
-    arcpy.MakeFeatureLayer_management (Perimeter_NoExclusion, "AnalysisPeri_lr")
-    arcpy.MakeFeatureLayer_management (ContextFile, "ContextFile_lr")
-
-    #Find Intersection (input, output)     
-    arcpy.AddMessage(" ... intersecting")
-    clusterTolerance = "" 
-    arcpy.Intersect_analysis(["AnalysisPeri_lr", "ContextFile_lr"], Conxt_PeriOverlap, "", clusterTolerance, "LINE") #Notice the use of "LINE" here instead of "INPUT" in order to get a line as the output, instead of a polygon
-
-
-    #Add Field and Calculate length of line for Perimeter (no exclusion)
-    arcpy.AddMessage(" ... calculating areas")
-    arcpy.Copy_management(Perimeter_NoExclusion, Perimeter_NoExclusion2)
-    arcpy.AddField_management(Perimeter_NoExclusion2, "Peri_M", "DOUBLE", 10, 5)
-    arcpy.CalculateField_management(Perimeter_NoExclusion2,"Peri_M","!shape.length@meters!","PYTHON_9.3")
-    
-    #Adding Field for Later
-    arcpy.AddField_management(Perimeter_NoExclusion2, "Cnxt_Metrs", "DOUBLE", 10, 5,"","","NULLABLE","NON_REQUIRED","")
-    # arcpy.CalculateField_management(QrtMile_Buff_NoExclusion_2,"Cnxt_Acr","0","PYTHON_9.3")
-
-    #Repeat for Context Buffer Intersection
-    arcpy.Copy_management(Conxt_PeriOverlap, Conxt_PeriOverlap2)
-    arcpy.AddField_management(Conxt_PeriOverlap2, "Peri_Cnt", "DOUBLE", 10, 5)
-    arcpy.CalculateField_management(Conxt_PeriOverlap2,"Peri_Cnt","!shape.length@meters!","PYTHON_9.3")
-    
-    
-    #Dissolve the context interserction by Match_ID to reduce the number of columns (also makes multipart)
-    arcpy.Dissolve_management (Conxt_PeriOverlap2, Conxt_PeriOverlap3, "Match_ID", [["Peri_Cnt", "SUM"]], "MULTI_PART", "")
- 
-    #Make area into a layer before joining:
-    arcpy.MakeFeatureLayer_management (Perimeter_NoExclusion2, "SmartPerimeter_lr")
-    arcpy.MakeFeatureLayer_management (Conxt_PeriOverlap3, "SmartIntersectPeri_lr")
-
-    # Join the feature layer to buffer layer
-    arcpy.AddMessage(" ... joining")
-    arcpy.AddJoin_management ("SmartPerimeter_lr", "Match_ID", "SmartIntersectPeri_lr", "Match_ID")
-
-    
-    # Copy the layer to a new permanent feature class
-    arcpy.CopyFeatures_management ("SmartPerimeter_lr", Peri_Join)
-    
-    # Time to join these values back into the final output table under their appropriate field names
-    arcpy.AddMessage(" ... joining to Final Table")
-    arcpy.MakeFeatureLayer_management (nameOfOutputShapefile, "OutputFile_lr")
-    arcpy.MakeFeatureLayer_management (Peri_Join, "Peri_Join_lr")
-    
-    # Join the feature layer to buffer layer
-    arcpy.AddJoin_management ("OutputFile_lr", "Match_ID", "Peri_Join_lr", "Match_ID")
-
-    # Populate a field with values from the joined fields
-    arcpy.AddMessage(" ... calculating final table fields")
-    Calculation_Peri = "!Peri_M!"
-    #Calculation_ContPeri = "!SUM_Peri_C!"
-    Calculation_PcrtPeri = "(!SUM_Peri_C!/ !Peri_M!)*100"
-    arcpy.CalculateField_management ("OutputFile_lr", PeriFieldName, Calculation_Peri, "PYTHON_9.3")
-    #arcpy.CalculateField_management ("OutputFile_lr", ContextPeriFieldName, Calculation_ContPeri, "PYTHON_9.3")
-    arcpy.CalculateField_management ("OutputFile_lr", PercentPeriContextFieldName, Calculation_PcrtPeri, "PYTHON_9.3")
-
-    # Remove the join
-    arcpy.AddMessage(" ... removing join")
-    arcpy.RemoveJoin_management ("OutputFile_lr", "")
-    
-    # Copy the layer to a new permanent feature class
-    arcpy.CopyFeatures_management ("OutputFile_lr", SmartOutput2)
-   
-    #Cleaning Up...
-    arcpy.AddMessage(" ... deleting temporary files")
-    arcpy.Delete_management(PerimeterOnly)
-    arcpy.Delete_management(Perimeter_NoExclusion)
-    arcpy.Delete_management(Conxt_PeriOverlap)
-    arcpy.Delete_management(Perimeter_NoExclusion2)
-    arcpy.Delete_management(Conxt_PeriOverlap2)
-    arcpy.Delete_management(Conxt_PeriOverlap3)
-    arcpy.Delete_management(Peri_Join)
-    
-    #Cleaning any cached memory (seemed to help prevent errors of overwriting internal variables)
-    arcpy.ClearWorkspaceCache_management() 
-
-    return SmartOutput2
-    
-    
-# AREA PERCENTAGE FUNCTION:
-# This function calculates the % of existing conservation land within a given buffer distance of land under analysis, minus areas of exclusion
-'''NOTES:
-    BuffDistance should be entered in the format of a linear unit and is quickest when measured in meters (the same unit as the maps)
-    Fieldnames inputs require quotation marks around them
-    For simplicity I have chosen to name the output, context, and exclusion shapefile variables inputs as the exact same name as the actual files. This is not necessary.
-    Finally, I have left the variable names as I originally created them when I made a test run using a Quarter Mile Buffer. At the moment I am using this copy simply becuase I am certain that it runs, but I would like to clean up and streamline these names before I submit this more formally to TNC.
-'''
-def AreaPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, BuffDist, AreaFieldName, ContextAreaFieldName, PercentContextFieldName):
-    #Making Temporary Shapefiles
-    QrtMile_Buffer                  = nameOfOutputShapefile[:-4] + "_temp21" + ".shp"    
-    QrtMile_Buff_NoExclusion        = nameOfOutputShapefile[:-4] + "_temp22" + ".shp"
-    QrtMile_Buff_Conxt_Intsect      = nameOfOutputShapefile[:-4] + "_temp23"  + ".shp"
-    QrtMile_Buff_Conxt_Intsect_2    = nameOfOutputShapefile[:-4] + "_temp24"  + ".shp"
-    QrtMile_Buff_Conxt_Intsect_3    = nameOfOutputShapefile[:-4] + "_temp25"  + ".shp"
-    QrtMile_Buff_NoExclusion_2      = nameOfOutputShapefile[:-4] + "_temp26"  + ".shp"
-    Buff_Join                       = nameOfOutputShapefile[:-4] + "_temp27"  + ".shp"
-    SmartOutput                     = nameOfOutputShapefile[:-4] + "_temp28"  + ".shp"
-        
-    #Buffer by Quarter Mile (input, output, distance, type)
-    arcpy.AddMessage(" ... buffering")
-    arcpy.Buffer_analysis(nameOfOutputShapefile, QrtMile_Buffer, BuffDist, "OUTSIDE_ONLY", "ROUND", "NONE", "", "")
-
-    #Erasing Exclusion file from buffer (input, erase features, output):
-    arcpy.AddMessage(" ... erasing exclusion")
-    arcpy.Erase_analysis(QrtMile_Buffer, ExclusionFile, QrtMile_Buff_NoExclusion)
-
-    #Make area into a layer before using intersect:
-    arcpy.MakeFeatureLayer_management (QrtMile_Buff_NoExclusion, "QrtMiBuf_NoE_lr")
-    arcpy.MakeFeatureLayer_management (ContextFile, "ContextFile_lr")
-
-    #Find Intersection (input, output)     
-    arcpy.AddMessage(" ... intersecting")
-    clusterTolerance = "" 
-    arcpy.Intersect_analysis(["QrtMiBuf_NoE_lr", "ContextFile_lr"], QrtMile_Buff_Conxt_Intsect, "", clusterTolerance, "INPUT")
-    
-    #Add Field and Calculate Area for buffer
-    arcpy.AddMessage(" ... calculating areas")
-    arcpy.Copy_management(QrtMile_Buff_NoExclusion, QrtMile_Buff_NoExclusion_2)
-    arcpy.AddField_management(QrtMile_Buff_NoExclusion_2, "B1_Acr", "DOUBLE", 10, 5)
-    arcpy.CalculateField_management(QrtMile_Buff_NoExclusion_2,"B1_Acr","!shape.area@acres!","PYTHON_9.3")
-    
-    #Adding Field for Later
-    arcpy.AddField_management(QrtMile_Buff_NoExclusion_2, "Cnxt_Acr", "DOUBLE", 10, 5,"","","NULLABLE","NON_REQUIRED","")
-    # arcpy.CalculateField_management(QrtMile_Buff_NoExclusion_2,"Cnxt_Acr","0","PYTHON_9.3")
-
-    #Repeat for Context Buffer Intersection
-    arcpy.Copy_management(QrtMile_Buff_Conxt_Intsect, QrtMile_Buff_Conxt_Intsect_2)
-    arcpy.AddField_management(QrtMile_Buff_Conxt_Intsect_2, "B1_Acr_Cnt", "DOUBLE", 10, 5)
-    arcpy.CalculateField_management(QrtMile_Buff_Conxt_Intsect_2,"B1_Acr_Cnt","!shape.area@acres!","PYTHON_9.3")
-    
-    
-    #Dissolve the context interserction by Match_ID to have only one acreage sum per original analysis buffer
-    arcpy.Dissolve_management (QrtMile_Buff_Conxt_Intsect_2, QrtMile_Buff_Conxt_Intsect_3, "Match_ID", [["B1_Acr_Cnt", "SUM"]], "MULTI_PART", "")
-
-    #Make area into a layer before joining:
-    arcpy.MakeFeatureLayer_management (QrtMile_Buff_NoExclusion_2, "QrtMiBuf_NoE_2_lr")
-    arcpy.MakeFeatureLayer_management (QrtMile_Buff_Conxt_Intsect_3, "BufContIntersect_lr")
-
-    # Join the feature layer to buffer layer
-    arcpy.AddMessage(" ... joining")
-    arcpy.AddJoin_management ("QrtMiBuf_NoE_2_lr", "Match_ID", "BufContIntersect_lr", "Match_ID")
-     
-    # Copy the layer to a new permanent feature class
-    arcpy.CopyFeatures_management ("QrtMiBuf_NoE_2_lr", Buff_Join)
-    
-    # Time to join these values back into the final output table under their appropriate field names
-    arcpy.AddMessage(" ... joining to Final Table")
-    arcpy.MakeFeatureLayer_management (nameOfOutputShapefile, "OutputFile_lr")
-    arcpy.MakeFeatureLayer_management (Buff_Join, "Buff_Join_lr")
-    
-    # Join the feature layer to buffer layer
-    arcpy.AddJoin_management ("OutputFile_lr", "Match_ID", "Buff_Join_lr", "Match_ID")
-
-    # Populate a field with values from the joined fields
-    arcpy.AddMessage(" ... calculating final table fields")
-    Calculation_Area = "!B1_Acr!"
-    Calculation_ContArea = "!SUM_B1_Acr!"
-    Calculation_PcrtArea = "(!SUM_B1_Acr!/ !B1_Acr!)*100"
-    arcpy.CalculateField_management ("OutputFile_lr", AreaFieldName, Calculation_Area, "PYTHON_9.3")
-    arcpy.CalculateField_management ("OutputFile_lr", ContextAreaFieldName, Calculation_ContArea, "PYTHON_9.3")
-    arcpy.CalculateField_management ("OutputFile_lr", PercentContextFieldName, Calculation_PcrtArea, "PYTHON_9.3")
-
-    # Remove the join
-    arcpy.AddMessage(" ... removing join")
-    arcpy.RemoveJoin_management ("OutputFile_lr", "")
-    
-    # Copy the layer to a new permanent feature class
-    arcpy.CopyFeatures_management ("OutputFile_lr", SmartOutput)
-   
-    #Cleaning Up...
-    arcpy.AddMessage(" ... deleting temporary files")
-    arcpy.Delete_management(QrtMile_Buffer)
-    arcpy.Delete_management(QrtMile_Buff_NoExclusion)
-    arcpy.Delete_management(QrtMile_Buff_Conxt_Intsect)
-    arcpy.Delete_management(QrtMile_Buff_Conxt_Intsect_2)
-    arcpy.Delete_management(QrtMile_Buff_Conxt_Intsect_3)
-    arcpy.Delete_management(QrtMile_Buff_NoExclusion_2)
-    arcpy.Delete_management(Buff_Join)
-    
-    #Cleaning any cached memory (seemed to help prevent errors of overwriting internal variables)
-    arcpy.ClearWorkspaceCache_management() 
-
-    return SmartOutput
-
-
-# #########################################################################
-# Running the Script
-# #########################################################################
-    
-try:
-    # #########################################################################
-    # Requesting User Input
-    # #########################################################################
-
-    # Request user input of data type = Shapefile and direction = Input
-    ContextFile = arcpy.GetParameterAsText(0)
-
-    # Potential Sites (Analysis File):
-    # Request user input of data type = Shapefile and direction = Input
-    AnalysisFile = arcpy.GetParameterAsText(1)
-
-    # Area to Eliminate (Exclusion Area):
-    # Request user input of data type = Shapefile and direction = Input
-    ExclusionFile = arcpy.GetParameterAsText(2)
-    
-    # Setting Workspace in which to store files
-    # Request user input of data type = File and direction = Input
-    Workspace = arcpy.GetParameterAsText(3)
-    arcpy.env.workspace = Workspace
-    arcpy.env.scratchWorkspace = Workspace
-    
-    
-    #Hard-coded alternatives to user input (faster):
-    #AnalysisFile = r"C:\Users\LaurenPR\Dropbox\670_Geospatial_Software\ArcPython\FinalProject_TNC\PCAT Analysis Data\PCAT_Analysis_File.shp"
-    #ContextFile = r"C:\Users\LaurenPR\Dropbox\670_Geospatial_Software\ArcPython\FinalProject_TNC\PCAT Analysis Data\PCAT_Context_File.shp"
-    #ExclusionFile = r"C:\Users\LaurenPR\Dropbox\670_Geospatial_Software\ArcPython\FinalProject_TNC\PCAT Analysis Data\PCAT_Exclusion_File.shp"
-    # Workspace = r"C:\Users\LaurenPR\Dropbox\670_Geospatial_Software\ArcPython\FinalProject_TNC\ScratchFolder"
-    # arcpy.env.workspace = Workspace
-    # arcpy.env.scratchWorkspace = Workspace
-
-    # Output File:
-    nameOfOutputShapefile = AnalysisFile[:-4] + "_PCAT"  + ".shp"
-    arcpy.AddMessage("The output shapefile name is " + nameOfOutputShapefile + "\n")
-    
-    
-    # #######################################################################
-    # I. Adding fields
-    # #######################################################################
-    
-    # Replicate the input shapefile to add new fields to the replica
-    arcpy.Copy_management(AnalysisFile, nameOfOutputShapefile)
-    arcpy.AddMessage(" ... adding field names")
-
-    # Add a series of fields to replica (Name, Type, Size):
-    arcpy.AddField_management(nameOfOutputShapefile, "Match_ID", "Long", 8)
-    arcpy.AddField_management(nameOfOutputShapefile, "SP_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "SP_Lng", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "SP_Adj_Pct", "Float", 5,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "QMi_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "QMi_Pr_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "QMi_Pr_Pct", "Float", 5,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "HMi_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "HMi_Pr_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "HMi_Pr_Pct", "Float", 5,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "Mi1_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "Mi1_Pr_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "Mi1_Pr_Pct", "Float", 5,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "Mi2_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "Mi2_Pr_Acr", "Double", 9,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "Mi2_Pr_Pct", "Float", 5,2)
-    arcpy.AddField_management(nameOfOutputShapefile, "PCAT_Scr", "Float", 5,2)
-    
-    # Populate the Match_ID with the a random sequential number (similar to FID)
-    arcpy.CalculateField_management(nameOfOutputShapefile,"Match_ID","!FID! +1","PYTHON_9.3")
-      
-    # Calculating the area (in acres) of the analysis sites:    
-    arcpy.CalculateField_management(nameOfOutputShapefile,"SP_Acr","!shape.area@acres!","PYTHON_9.3")
-   
-    # #######################################################################
-    # II. Calculating Percentage of Conserved PERIMETER (minus Exclusion Areas)
-    # #######################################################################
-    
-    # Percentage of Perimeter Under Conservation Protection (minus Exclusion)
-    arcpy.AddMessage("Calculating Conservation of Perimeter")
-    PERI =  PerimeterPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, "SP_Lng", "SP_Adj_Pct")
-    arcpy.Copy_management(PERI, nameOfOutputShapefile)
-    
-    # #######################################################################
-    # III. Calculating Percentage of Conserved AREA w/in Buffers (minus Exclusion Areas)
-    # #######################################################################
-    
-    # Quarter Mile Buffer
-    arcpy.AddMessage("Calculating Conservation within Quarter Mile Buffer")
-    QRTMIBUFF =  AreaPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, "402.3300", "QMi_Acr", "QMi_Pr_Acr", "QMi_Pr_Pct")
-    arcpy.Copy_management(QRTMIBUFF, nameOfOutputShapefile)
-    
-    # Half Mile Buffer
-    arcpy.AddMessage("Calculating Conservation within Half Mile Buffer")
-    HLFMIBUFF =  AreaPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, "804.6720", "HMi_Acr", "HMi_Pr_Acr", "HMi_Pr_Pct")
-    arcpy.Copy_management(HLFMIBUFF, nameOfOutputShapefile)
-    
-    # One Mile Buffer
-    arcpy.AddMessage("Calculating Conservation within One Mile Buffer")
-    ONEMIBUFF =  AreaPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, "1609.34", "Mi1_Acr", "Mi1_Pr_Acr", "Mi1_Pr_Pct")
-    arcpy.Copy_management(ONEMIBUFF, nameOfOutputShapefile)
-    
-    # Two Mile Buffer
-    arcpy.AddMessage("Calculating Conservation within Two Mile Buffer")
-    TWOMIBUFF =  AreaPercent_Fnx(nameOfOutputShapefile, ContextFile, ExclusionFile, "3218.69", "Mi2_Acr", "Mi2_Pr_Acr", "Mi2_Pr_Pct")
-    arcpy.Copy_management(TWOMIBUFF, nameOfOutputShapefile)
-
-    
-    # ####################################################################
-    # IV. Finding "Connectivity" Potential of Conservation Sites
-    ####################################################################
-    
-    arcpy.AddMessage("Calculating Connectivity Potential")
-    
-    # Creating temporary GIS files:
-    ConvexHull_temp                 = nameOfOutputShapefile[:-4] + "_temp31" + ".shp"
-    StudyArea_temp                  = nameOfOutputShapefile[:-4] + "_temp32" + ".shp"
-    NegSpacebtwConservation_temp    = nameOfOutputShapefile[:-4] + "_temp33"  + ".shp"
-    InnerBuffer_temp                = nameOfOutputShapefile[:-4] + "_temp34"  + ".shp"
-    OutterBuffer_temp               = nameOfOutputShapefile[:-4] + "_temp35"  + ".shp"
-    NarrowAreas_temp                = nameOfOutputShapefile[:-4] + "_temp36"  + ".shp"
-    NarrowAreas_NoBuffer_temp       = nameOfOutputShapefile[:-4] + "_temp37"  + ".shp"
-    NearConnectivity_temp           = nameOfOutputShapefile[:-4] + "_temp38"  + ".shp"
-    Connectivity2_temp              = nameOfOutputShapefile[:-4] + "_temp39"  + ".shp"
-    NearConnectivity2_temp          = nameOfOutputShapefile[:-4] + "_temp40"  + ".shp"
-    ConnectivityMeasure_temp        = nameOfOutputShapefile[:-4] + "_temp41"  + ".shp"
-    ConnectivityMeasure_temp2       = nameOfOutputShapefile[:-4] + "_temp42"  + ".shp"
-    SmartFinal                      = nameOfOutputShapefile[:-4] + "_temp43"  + ".shp"
-
-    
-    # Start timing
-    timeStart_C           = time.clock()
-    
-    ### 1) create a "study area" layer, from which to determine the "negative space" (all the land that is not under conservation easement) around existing conservation sites.
-    
-    # Creat a Convex Hull around study area(note that a minimum enclosing rectangle, circle, etc. could also work but would include additional area):
-    arcpy.AddMessage(" ... creating convex hull")
-    arcpy.MinimumBoundingGeometry_management(ContextFile, ConvexHull_temp, "CONVEX_HULL", "NONE")
-
-    # Buffer out from the Convex Hull to include some extra space around the outside conservation sites (otherwise the connectivity of sites located on the outskirts of the study area gets skewed)
-    arcpy.AddMessage(" ... buffering")
-    Distance2 = "0.25 Miles" #note: this parameter could be easily changed given the study area size
-    arcpy.Buffer_analysis(ConvexHull_temp, StudyArea_temp, Distance2, "FULL", "ROUND", "NONE")
-
-    
-    # Create a shapefile of the "negative space" around conservation sites    
-    arcpy.AddMessage(" ... creating negative space")
-    xyTol = "1 Meters"
-    arcpy.Erase_analysis(StudyArea_temp, ContextFile, NegSpacebtwConservation_temp, xyTol)
-
-    # #### 2) Next we will find areas of "narrowness" between the conservation sites using the negative space shapefile generated above. This is an important step that will help identify potential conservation sites that will 
-    
-    # Read user-specified width and generate a negative version of it as well
-    arcpy.AddMessage(" ... finding narrowness (this is slow)")
-    positiveWidth           = arcpy.GetParameterAsText(3) #Linear Unit, input
-    negativeWidth           = "-" + positiveWidth
-    # arcpy.AddMessage(negativeWidth)
-
-    # positiveWidth             = "25 Meters"
-    # negativeWidth             = "-25 Meters"
-
-    # Buffer into each input polygon and then back out from what's left to remove "narrow" areas  
-    arcpy.Buffer_analysis(NegSpacebtwConservation_temp,  InnerBuffer_temp, negativeWidth, "FULL", "ROUND", "NONE")
-    # NOTE "If the negative buffer distance is large enough to collapse the polygon to nothing, a null geometry will be generated. A warning message will be given, and any null geometry features will not be written to the output feature class." ~ ESRI
-    
-    arcpy.Buffer_analysis(InnerBuffer_temp, OutterBuffer_temp, positiveWidth, "FULL", "ROUND", "NONE")
-    
-    # Subtract the original negative space shapefile from the above shapefile without 
-    # narrowness, to generate a file with only narrow areas between conservation sites
-    arcpy.AddMessage(" ... selecting only narrow areas")
-    arcpy.Erase_analysis(OutterBuffer_temp, NegSpacebtwConservation_temp, NarrowAreas_temp, "")
-    
-    #Clip away the extra buffer around the study area (otherwise all the area surrounding the outside buffer appears to have a high connectivity score):
-    arcpy.Clip_analysis(NarrowAreas_temp, ConvexHull_temp, NarrowAreas_NoBuffer_temp)
-
-    # #### 3) The above layer shows all the areas that would help increase the connectivity between existing conservation sites. You may want to also give a weight to a distance away from one of these areas. In which case the following buffer could be used: 
-
-    # Distance to Connectivity     = arcpy.GetParameterAsText(5)
-    arcpy.AddMessage(" ... calculating another buffer (this can take even longer)")
-    # Distance3 = "25 Meters" #note: this parameter could be easily changed given the study area size
-    arcpy.Buffer_analysis(NarrowAreas_NoBuffer_temp, NearConnectivity_temp, positiveWidth, "OUTSIDE_ONLY", "ROUND", "NONE")
-    # NOTE, could also generate a distance to grid but I imagine that at a certain cutoff point being close to a "narrow" area of connectivity is no longer benefitial. 
-
-    # Give the connectivity a score (In this case )
-    arcpy.AddMessage(" ... calculating connectivity score")
-    ConnectivityScore_Connected   = "5"  # = arcpy.GetParameterAsText(6) #STRING
-    ConnectivityScore_Near        = "1"  # = arcpy.GetParameterAsText(7) #STRING
-
-    CommonConnectivityScoreName   = "Con_Score" # = arcpy.GetParameterAsText(8) #STRING
-    
-    
-    # Replicate the input shapefile and add a new field to the replica
-    arcpy.Copy_management(NarrowAreas_NoBuffer_temp, Connectivity2_temp)
-    arcpy.AddField_management(Connectivity2_temp, CommonConnectivityScoreName, "SHORT", 6)
-    arcpy.CalculateField_management(Connectivity2_temp, CommonConnectivityScoreName, ConnectivityScore_Connected,"PYTHON_9.3")
-
-    # Replicate the input shapefile and add a new field to the replica
-    arcpy.Copy_management(NearConnectivity_temp, NearConnectivity2_temp)
-    arcpy.AddField_management(NearConnectivity2_temp, CommonConnectivityScoreName, "SHORT", 6)
-    arcpy.CalculateField_management(NearConnectivity2_temp, CommonConnectivityScoreName, ConnectivityScore_Near,"PYTHON_9.3")
-    
-    # MERGE these layers based on their new common connecitity score name:
-    arcpy.AddMessage(" ... merging connectivity score")
-    arcpy.Merge_management([Connectivity2_temp, NearConnectivity2_temp], ConnectivityMeasure_temp)
-    
-    arcpy.AddMessage(" ... dissolving connectivity score") # to reduce columns as I was overwhelmed by field mapping in merge
-    arcpy.Dissolve_management (ConnectivityMeasure_temp, ConnectivityMeasure_temp2, "FID", [["Con_Score", "FIRST"]], "MULTI_PART", "")
-
-    # In order to combine this information with the final output layer, we must use join
-    # However, join requires that we make a feature layer first of the data we want to use:
-    arcpy.AddMessage(" ... joining connectivity score to final tabulation")
-    
-    arcpy.MakeFeatureLayer_management (ConnectivityMeasure_temp2, "Connectivity")
-    arcpy.MakeFeatureLayer_management (nameOfOutputShapefile, "Analysis2_ly")
-
-    
-    # Join the feature layer to a table
-    arcpy.SpatialJoin_analysis ("Analysis2_ly", "Connectivity", SmartFinal, "JOIN_ONE_TO_ONE", "KEEP_ALL", "", "INTERSECT", "", "")
-    
-    # Stop timing
-    timeStop_C        = time.clock()
-    timeTaken_C       = (timeStop_C - timeStart_C)/60
-    arcpy.AddMessage("\nElapsed time for Connectivity Calculation = " + str(timeTaken_C) + " minutes\n")
-
-   
-    # Since each shapefile-generating method (unlike grid-generating metdhods) immediately writes its output to disk, final results need not be explicitly saved, but intermediate results must be explicitly deleted.
-    '''
-    arcpy.AddMessage(" ... deleting temporary files")
-    arcpy.Delete_management(ConvexHull_temp)
-    arcpy.Delete_management(StudyArea_temp)
-    arcpy.Delete_management(NegSpacebtwConservation_temp)
-    arcpy.Delete_management(InnerBuffer_temp)
-    arcpy.Delete_management(OutterBuffer_temp)
-    arcpy.Delete_management(NarrowAreas_temp)
-    arcpy.Delete_management(NarrowAreas_NoBuffer_temp)
-    arcpy.Delete_management(NearConnectivity_temp)
-    arcpy.Delete_management(Connectivity2_temp)
-    arcpy.Delete_management(NearConnectivity2_temp)
-    arcpy.Delete_management(ConnectivityMeasure_temp)
-    arcpy.Delete_management(ConnectivityMeasure_temp2)
-    arcpy.Delete_management(SmartFinal)
-    '''
-    
-    # ####################################################################
-    # V. Final Site Ranking
-    ####################################################################
-    arcpy.AddMessage("Calculating Final Score!")
-    
-    #Making another Layer
-    arcpy.MakeFeatureLayer_management (SmartFinal, "Final_lr")
-    
-    #Final Calculation
-    FinalCalculation = "(!SP_Adj_Pct! * .2) + (!QMi_Pr_Pct! * .35) + (!HMi_Pr_Pct! * .25) + (!Mi1_Pr_Pct! * .15) + (!Mi2_Pr_Pct! * .05) + (!FIRST_Con_! * 0.3)"
-    
-    arcpy.CalculateField_management("Final_lr", "PCAT_Scr", FinalCalculation, "PYTHON_9.3")
-
-    #Copying to Final Output
-    arcpy.CopyFeatures_management ("Final_lr", nameOfOutputShapefile)
-
-    
-except Exception as e:
-    # If unsuccessful, end gracefully by indicating why
-    arcpy.AddError('\n' + "Script failed because: \t\t" + e.message )
-    # ... and where
-    exceptionreport = sys.exc_info()[2]
-    fullermessage   = traceback.format_tb(exceptionreport)[0]
-    arcpy.AddError("at this location: \n\n" + fullermessage + "\n")
-
-
-    
-    
-# #######################################################################
-# #######################################################################
-# TOOLS USED: SYNTAX STRUCTURE REFERENCES FOR EDITING
-# #######################################################################
-
-# Data management:
-    # arcpy.AddField_management(table, fieldname, type, precision, scale, length, alias, nullability, required, domain) 
-    # arcpy.CalculateField_management(in_table, field, expression, {expression_type}, {code_block})
-    # arcpy.MakeFeatureLayer_management(in_features, out_layer, {where_clause}, {workspace}, {field_info})
-    # arcpy.AddJoin_management(in_layer_or_view, in_field, join_table, join_field, {join_type})
-    # arcpy.Merge_management([Connectivity2_temp, NearConnectivity2_temp], ConnectivityMeasure_temp, fieldMappings)
-
-
-# Shapefile manipulation:
-    # arcpy.Intersect_analysis(in_features, out_feature_class, {join_attributes}, {cluster_tolerance}, {output_type})
-    # arcpy.Erase_analysis(in_features, erase_features, out_feature_class, {cluster_tolerance})
-    # arcpy.PolygonToLine_management(in_features, out_feature_class, {neighbor_option})
-    # arcpy.Buffer_analysis(in_features, out_feature_class, buffer_distance_or_field, {line_side}, {line_end_type}, {dissolve_option}, {dissolve_field}, {method})
-    # arcpy.Clip_analysis (in_features, clip_features, out_feature_class, {cluster_tolerance})
-    # arcpy.Dissolve_management (in_features, out_feature_class, {dissolve_field}, {statistics_fields}, {multi_part}, {unsplit_lines})
-    # arcpy.SpatialJoin_analysis (target_features, join_features, out_feature_class, {join_operation}, {join_type}, {field_mapping}, {match_option}, {search_radius}, {distance_field_name})
+'''
+THIS SCRIPT CALCULATES A FINAL RANKING FOR POTENTIAL CONSERVATION SITES ACCORDING TO ITS PROXIMITY AND CONNECTIVITY TO EXISTING CONSERVATION SITES. IT ALSO HAS THE ABILITY TO EXLCUDE A PORTION OF THE STUDY AREA.
+
+Author: Lauren Payne-Riley
+Current Status: DRAFT (see report for known issues and proposed additions)
+
+To create an ArcToolbox tool with which to execute this script, do the following.
+1   In  ArcMap > Catalog > Toolboxes > My Toolboxes, either select an existing toolbox
+    or right-click on My Toolboxes and use New > Toolbox to create (then rename) a new one.
+2   Drag (or use ArcToolbox > Add Toolbox to add) this toolbox to ArcToolbox.
+3   Right-click on the toolbox in ArcToolbox, and use Add > Script to open a dialog box.
+4   In this Add Script dialog box, use Label to name the tool being created, and press Next.
+5   In a new dialog box, browse to the .py file to be invoked by this tool, and press Next.
+6   In the next dialog box, specify the following inputs (using dropdown menus wherever possible)
+    before pressing OK or Finish.
+        DISPLAY NAME              DATA TYPE       PROPERTY>DIRECTION>VALUE       
+        Context File              Shapefile       Input
+        Analysis File             Shapefile       Input
+        Exclusion File            Shapefile       Input
+        Workspace                 Shapefile       Input
+        Buffer Distanace (Meters) Linear Unit     Input
+           
+   To later revise any of this, right-click to the tool's name and select Properties.
+
+To run the script without ArcMap (or without an ArcGIS license), use the open-source engine from the command line:
+    python TNC_ArcPyConservationTool.py <Context File> <Analysis File> <Exclusion File> [<Workspace>] [<Buffer Distance>] --engine open
+The open engine needs shapely (>= 2.0) and fiona, and reads and writes shapefiles or GeoPackages (see PCAT_Backends.py).
+
+'''
+# #########################################################################
+# Setting Up: Importing Packages and Setting the Environment
+# #########################################################################
+
+import sys, os, string, math, traceback, argparse, collections, functools, numpy, time
+
+# arcpy is only needed for the "arcpy" engine; the "open" engine runs without ArcGIS (see PCAT_Backends.py)
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+import PCAT_Backends
+from PCAT_Backends import AddMessage, AddError
+from PCAT_Results import ResultsStore, Percent_Fnx
+import PCAT_Cache
+import PCAT_Raster
+import PCAT_Parallel
+import PCAT_Profile
+import PCAT_Boundary
+import PCAT_Streaming
+import PCAT_Checkpoint
+import PCAT_TopK
+import PCAT_Preview
+import PCAT_Output
+import PCAT_GapGraph
+import PCAT_Generalize
+
+
+# #########################################################################
+# Output Fields and Parameters
+# #########################################################################
+
+# Fields added to the output (Name, Type, Precision, Scale)
+OutputFields = [["Match_ID",   "Long",   8, None],
+                ["SP_Acr",     "Double", 9, 2],
+                ["SP_Lng",     "Double", 9, 2],
+                ["SP_Adj_Pct", "Float",  5, 2],
+                ["QMi_Acr",    "Double", 9, 2],
+                ["QMi_Pr_Acr", "Double", 9, 2],
+                ["QMi_Pr_Pct", "Float",  5, 2],
+                ["HMi_Acr",    "Double", 9, 2],
+                ["HMi_Pr_Acr", "Double", 9, 2],
+                ["HMi_Pr_Pct", "Float",  5, 2],
+                ["Mi1_Acr",    "Double", 9, 2],
+                ["Mi1_Pr_Acr", "Double", 9, 2],
+                ["Mi1_Pr_Pct", "Float",  5, 2],
+                ["Mi2_Acr",    "Double", 9, 2],
+                ["Mi2_Pr_Acr", "Double", 9, 2],
+                ["Mi2_Pr_Pct", "Float",  5, 2],
+                ["Con_Score",  "Short",  6, None],
+                ["PCAT_Scr",   "Float",  5, 2]]
+
+# Quarter Mile, Half Mile, One Mile and Two Mile Buffers: [BuffDist, AreaFieldName, ContextAreaFieldName, PercentContextFieldName]
+BuffRings = [["402.3300", "QMi_Acr", "QMi_Pr_Acr", "QMi_Pr_Pct"],
+             ["804.6720", "HMi_Acr", "HMi_Pr_Acr", "HMi_Pr_Pct"],
+             ["1609.34",  "Mi1_Acr", "Mi1_Pr_Acr", "Mi1_Pr_Pct"],
+             ["3218.69",  "Mi2_Acr", "Mi2_Pr_Acr", "Mi2_Pr_Pct"]]
+
+# Extra space around the convex hull of the context for the connectivity study area (note: this parameter could be easily changed given the study area size)
+StudyAreaBuffer = "0.25 Miles"
+
+# Rank of each site in the output of the top-K mode (see PCAT_TopK.py)
+RankField = ["PCAT_Rank", "Long", 8, None]
+
+# Fields of the output of the preview mode (see PCAT_Preview.py): the site acreage and the buffer ring fields
+PreviewFields = [Field for Field in OutputFields if Field[0] in ["Match_ID", "SP_Acr"] + [FieldName for Ring in BuffRings for FieldName in Ring[1:]]]
+
+# Weights of the final score: [FieldName, Weight]
+ScoreWeights = [["SP_Adj_Pct", .2],
+                ["QMi_Pr_Pct", .35],
+                ["HMi_Pr_Pct", .25],
+                ["Mi1_Pr_Pct", .15],
+                ["Mi2_Pr_Pct", .05],
+                ["Con_Score",  0.3]]
+
+
+# #########################################################################
+# Defining Functions
+# #########################################################################
+
+'''NOTES:
+    Every function below does its geoprocessing through a backend (see PCAT_Backends.py), so the same calculation runs with arcpy or with the open-source engine.
+    OutputLayer, ContextLayer and ExclusionLayer are whatever the backend uses for a layer: a shapefile path for arcpy, an in-memory FeatureLayer for the open engine.
+    RunPCAT_Fnx passes the context minus the exclusion (see PrepareLayers_Fnx) as the ContextLayer; the overlays give the same values with the full context, since the exclusion is also erased from the perimeter and the rings.
+    Each function sets its fields in Results (a ResultsStore, see PCAT_Results.py: one array per field, indexed by Match_ID). Nothing is written into the output until RunPCAT_Fnx writes all of the fields at the end.
+'''
+
+
+# PERIMETER PERCENTAGE FUNCTION:
+# This function calculates the % of the perimeter of the analysis site that is already under conservation, minus areas of exclusion
+@PCAT_Profile.Profiled("perimeter")
+def PerimeterPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, PeriFieldName, PercentPeriContextFieldName):
+    # Converting the Analysis Sites to be only their Perimeters (this removes the issue of locations where segments of the land under consideration are cross-listed as already under conservation - although this data error is likely mostly due to how the sample data was processed, this will ensure that the problem does not arise in the future)
+    AddMessage(" ... converting polygon to line")
+    PerimeterOnly = Backend.PolygonToLine(OutputLayer)
+
+    #Erasing Exclusion file from the perimeter (input, erase features):
+    AddMessage(" ... erasing exclusion")
+    Perimeter_NoExclusion = Backend.Erase(PerimeterOnly, ExclusionLayer)
+
+    #Find Intersection (notice the use of "LINE" here instead of "INPUT" in order to get a line as the output, instead of a polygon)
+    AddMessage(" ... intersecting")
+    Conxt_PeriOverlap = Backend.Intersect(Perimeter_NoExclusion, ContextLayer, "LINE")
+
+    #Length of the perimeter (no exclusion) and of the perimeter shared with the context, by Match_ID
+    AddMessage(" ... calculating lengths")
+    Keys, Meters = Backend.ReadMeasure(Perimeter_NoExclusion, ["Match_ID"], "LENGTH")
+    PerimeterMeters = Results.SumByMatchID(Keys[:, 0], Meters)
+    Keys, Meters = Backend.ReadMeasure(Conxt_PeriOverlap, ["Match_ID"], "LENGTH")
+    ContextMeters = Results.SumByMatchID(Keys[:, 0], Meters)
+
+    # Populate the final table fields
+    AddMessage(" ... calculating final table fields")
+    Results.Set(PeriFieldName, PerimeterMeters)
+    Results.Set(PercentPeriContextFieldName, Percent_Fnx(ContextMeters, PerimeterMeters))
+
+    #Cleaning Up...
+    AddMessage(" ... deleting temporary files")
+    Backend.Delete(PerimeterOnly, Perimeter_NoExclusion, Conxt_PeriOverlap)
+
+    return Results
+
+
+# SHARED BOUNDARY PERCENTAGE FUNCTION:
+# This function calculates the same fields as PerimeterPercent_Fnx, but from the boundary segments in a single sweep instead of three overlays (see PCAT_Boundary.py)
+'''NOTES:
+    SnapTolerance is a linear unit: parts of the perimeter closer than that to a context boundary count as shared with the context, and parts closer than that to an exclusion boundary as excluded.
+    Where context features overlap, the shared part is counted once (PerimeterPercent_Fnx counts it once per feature, which can give more than 100 %); elsewhere the values match PerimeterPercent_Fnx up to floating point differences.
+'''
+@PCAT_Profile.Profiled("perimeter (shared boundary)")
+def SharedBoundaryPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, PeriFieldName, PercentPeriContextFieldName, SnapTolerance="0.001 Meters"):
+    AddMessage(" ... measuring shared boundaries")
+    Keys, PerimeterMeters, ContextMeters, ExcludedMeters = PCAT_Boundary.SharedBoundary_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, "Match_ID", SnapTolerance)
+    AddMessage("     " + str(int(round(ExcludedMeters.sum()))) + " meters of perimeter removed by the exclusion")
+
+    # Populate the final table fields
+    AddMessage(" ... calculating final table fields")
+    PerimeterMeters = Results.SumByMatchID(Keys, PerimeterMeters)
+    Results.Set(PeriFieldName, PerimeterMeters)
+    Results.Set(PercentPeriContextFieldName, Percent_Fnx(Results.SumByMatchID(Keys, ContextMeters), PerimeterMeters))
+
+    return Results
+
+
+# AREA PERCENTAGE FUNCTION:
+# This function calculates the % of existing conservation land within a given buffer distance of land under analysis, minus areas of exclusion
+'''NOTES:
+    BuffDist should be entered in the format of a linear unit and is quickest when measured in meters (the same unit as the maps)
+    This is MultiRingAreaPercent_Fnx with a single ring, kept for calculating (or checking) one buffer distance on its own.
+'''
+@PCAT_Profile.Profiled("buffer ring")
+def AreaPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, BuffDist, AreaFieldName, ContextAreaFieldName, PercentContextFieldName):
+    return MultiRingAreaPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, [[BuffDist, AreaFieldName, ContextAreaFieldName, PercentContextFieldName]])
+
+
+# MULTI-RING AREA PERCENTAGE FUNCTION:
+# This function calculates the same fields as AreaPercent_Fnx (buffer acres, conserved acres and % conserved, minus areas of exclusion), but for every buffer distance in a single pass
+'''NOTES:
+    BuffRings is a list with one entry per ring: [BuffDist, AreaFieldName, ContextAreaFieldName, PercentContextFieldName]. BuffDist uses the same linear unit format as AreaPercent_Fnx.
+    The buffers for all of the distances are merged into one layer (each tagged with a Ring_ID), so the Erase of the exclusion and the Intersect with the context only run once instead of once per distance.
+    The acreages are summed by Match_ID for each Ring_ID as arrays, so there are no joins and no copies of the output shapefile.
+    A buffer with no conservation land in it gets 0 acres and 0 %. Otherwise the values match running AreaPercent_Fnx once per distance, up to floating point differences in the overlays.
+    With a Tolerance (a linear unit), the sites, context and exclusion are simplified to within it, and the arcs of the buffers generalized to within it, before the overlays (see PCAT_Generalize.py).
+'''
+@PCAT_Profile.Profiled("buffer rings")
+def MultiRingAreaPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, BuffRings, Tolerance=None):
+    AllRings_NoExclusion, RingTemps = RingBuffers_Fnx(Backend, OutputLayer, ExclusionLayer, BuffRings, Tolerance)
+    if Tolerance:
+        AddMessage(" ... simplifying context")
+        ContextLayer = Backend.Simplify(ContextLayer, Tolerance)
+        RingTemps.append(ContextLayer)
+
+    #Find Intersection with the context for all of the rings at once
+    AddMessage(" ... intersecting")
+    AllRings_Conxt_Intsect = Backend.Intersect(AllRings_NoExclusion, ContextLayer, "INPUT")
+
+    # Summing the acreage of each ring and of the conservation land within each ring, by Match_ID and Ring_ID
+    AddMessage(" ... calculating areas")
+    RingKeys, RingAcres = Backend.ReadMeasure(AllRings_NoExclusion, ["Match_ID", "Ring_ID"], "AREA")
+    ContextKeys, ContextAcres = Backend.ReadMeasure(AllRings_Conxt_Intsect, ["Match_ID", "Ring_ID"], "AREA")
+
+    # Populate every ring's fields
+    AddMessage(" ... calculating final table fields")
+    for RingID, Ring in enumerate(BuffRings):
+        InRing = RingKeys[:, 1] == RingID
+        BufferArea = Results.SumByMatchID(RingKeys[InRing, 0], RingAcres[InRing])
+        InRing = ContextKeys[:, 1] == RingID
+        ContextArea = Results.SumByMatchID(ContextKeys[InRing, 0], ContextAcres[InRing])
+        Results.Set(Ring[1], BufferArea)
+        Results.Set(Ring[2], ContextArea)
+        Results.Set(Ring[3], Percent_Fnx(ContextArea, BufferArea))
+
+    #Cleaning Up...
+    AddMessage(" ... deleting temporary files")
+    Backend.Delete(*(RingTemps + [AllRings_NoExclusion, AllRings_Conxt_Intsect]))
+
+    return Results
+
+
+# RING BUFFERS FUNCTION:
+# This function buffers the sites by every ring distance and erases the exclusion from the buffers, in one layer tagged with Ring_ID
+'''NOTES:
+    Returns (the rings minus the exclusion, the other intermediate layers to delete along with it).
+    With a Tolerance (a linear unit), the sites and the exclusion are simplified and the arcs of the buffers generalized to within it.
+'''
+def RingBuffers_Fnx(Backend, OutputLayer, ExclusionLayer, BuffRings, Tolerance=None):
+    Generalized = []
+    if Tolerance:
+        AddMessage(" ... simplifying sites and exclusion")
+        OutputLayer, ExclusionLayer = Backend.Simplify(OutputLayer, Tolerance), Backend.Simplify(ExclusionLayer, Tolerance)
+        Generalized = [OutputLayer, ExclusionLayer]
+
+    #Buffer by each distance and tag each buffer with its ring number
+    AddMessage(" ... buffering all rings")
+    RingBuffers = []
+    for RingID, Ring in enumerate(BuffRings):
+        RingBuffers.append(Backend.AddConstantField(Backend.Buffer(OutputLayer, Ring[0], "OUTSIDE_ONLY", Tolerance), "Ring_ID", RingID))
+
+    # Merging the rings so that the overlays below only run once
+    AllRings_Buffer = Backend.Merge(RingBuffers)
+
+    #Erasing Exclusion file from all of the rings at once (input, erase features):
+    AddMessage(" ... erasing exclusion")
+    AllRings_NoExclusion = Backend.Erase(AllRings_Buffer, ExclusionLayer)
+
+    return AllRings_NoExclusion, Generalized + RingBuffers + [AllRings_Buffer]
+
+
+# SITE METRICS FUNCTION:
+# This function calculates everything that only depends on the context and exclusion near each site: the perimeter percentage and all of the buffer ring percentages
+'''NOTES:
+    The values of a site only depend on the context and exclusion features within the largest buffer ring of it, which is what allows PCAT_Parallel.py to run this function on spatial tiles of the sites.
+    PerimeterMethod is "overlay" (PerimeterPercent_Fnx) or "boundary" (SharedBoundaryPercent_Fnx, with SnapTolerance).
+    Parts are the parts of SiteMetricParts to calculate (both by default; a run with checkpoints calculates, and records, one at a time).
+    Tolerance (optional, a linear unit) generalizes the geometry of the buffer rings (see MultiRingAreaPercent_Fnx); the perimeter is always calculated at full precision.
+'''
+def SiteMetrics_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, PerimeterMethod="overlay", SnapTolerance="0.001 Meters",
+                    Parts=("perimeter", "buffer rings"), Tolerance=None):
+    # Percentage of Perimeter Under Conservation Protection (minus Exclusion)
+    if "perimeter" in Parts:
+        AddMessage("Calculating Conservation of Perimeter")
+        if PerimeterMethod == "boundary":
+            SharedBoundaryPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, "SP_Lng", "SP_Adj_Pct", SnapTolerance)
+        else:
+            PerimeterPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, "SP_Lng", "SP_Adj_Pct")
+
+    # Quarter Mile, Half Mile, One Mile and Two Mile Buffers, all calculated in one pass
+    if "buffer rings" in Parts:
+        AddMessage("Calculating Conservation within Quarter Mile, Half Mile, One Mile and Two Mile Buffers")
+        MultiRingAreaPercent_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, BuffRings, Tolerance)
+
+    return Results
+
+
+# Parts of SiteMetrics_Fnx and the fields they calculate: [Part, FieldNames]
+SiteMetricParts = [["perimeter",    ["SP_Lng", "SP_Adj_Pct"]],
+                   ["buffer rings", [FieldName for Ring in BuffRings for FieldName in Ring[1:]]]]
+
+# Fields calculated by SiteMetrics_Fnx (and kept in the site metrics cache)
+SiteFieldNames = [FieldName for Part, FieldNames in SiteMetricParts for FieldName in FieldNames]
+
+
+# CACHED METRICS FUNCTION:
+# This function fills the results store with the cached fields of the sites that have not changed, and returns the sites that still have to be calculated
+'''NOTES:
+    MetricsCache is a PCAT_Cache.SiteMetricsCache. Sites are found in it by a hash of their geometry, so a new, split or reshaped site is always calculated again.
+    Cached sites within HaloDistance of a context or exclusion feature that was added, removed or changed since they were stored are calculated again (see SiteMetricsCache.UpdateInputs).
+    Returns (Match_IDs whose site fields must be calculated, Match_IDs whose connectivity score must be calculated, (Match_IDs, geometry hashes, envelopes) of every site for StoreCachedMetrics_Fnx).
+'''
+def ReadCachedMetrics_Fnx(Backend, MetricsCache, ContextFile, OutputLayer, Prepared, Results, HaloDistance):
+    AddMessage(" ... comparing context and exclusion with the cached metrics")
+    ContextKeys, ContextShapes, ContextBounds = Backend.ReadShapes(Backend.Read(ContextFile))
+    ExclusionKeys, ExclusionShapes, ExclusionBounds = Backend.ReadShapes(Prepared["Exclusion"])
+    HullKeys, HullShapes, HullBounds = Backend.ReadShapes(Prepared["ConvexHull"])
+    Deleted = MetricsCache.UpdateInputs({"Context": (ContextShapes, ContextBounds), "Exclusion": (ExclusionShapes, ExclusionBounds)},
+                                        HullShapes[0] if HullShapes else None, HaloDistance)
+    if Deleted > 0:
+        AddMessage("     " + str(Deleted) + " cached sites are near changed context or exclusion")
+
+    AddMessage(" ... looking up the sites")
+    MatchIDs, SiteShapes, SiteBounds = Backend.ReadShapes(OutputLayer, "Match_ID")
+    GeometryHashes = [PCAT_Cache.ShapeHash_Fnx(Shape) for Shape in SiteShapes]
+    Fields, Found, ConScores = MetricsCache.Lookup(GeometryHashes, SiteFieldNames)
+    for FieldName, Values in Fields.items():
+        Results.Set(FieldName, Values[Found], ForMatchIDs=MatchIDs[Found])
+    Results.Set("Con_Score", ConScores[ConScores >= 0], ForMatchIDs=MatchIDs[ConScores >= 0])
+    AddMessage("     " + str(int(Found.sum())) + " of " + str(len(MatchIDs)) + " sites are cached")
+
+    return MatchIDs[~Found], MatchIDs[ConScores < 0], (MatchIDs, GeometryHashes, SiteBounds)
+
+
+# Stores the fields of the sites that were calculated in this run into the site metrics cache
+def StoreCachedMetrics_Fnx(MetricsCache, Results, Sites, CalculatedMatchIDs):
+    MatchIDs, GeometryHashes, SiteBounds = Sites
+    Calculated = numpy.flatnonzero(numpy.isin(MatchIDs, CalculatedMatchIDs))
+    Positions = Results.Positions(MatchIDs[Calculated])
+    Fields = collections.OrderedDict((FieldName, Results.Get(FieldName)[Positions]) for FieldName in SiteFieldNames)
+    MetricsCache.Store([GeometryHashes[Position] for Position in Calculated], SiteBounds[Calculated], Fields, Results.Get("Con_Score")[Positions])
+
+
+# Returns the layer and a results store for the sites in MatchIDs (the output and its results store themselves, when that is every site)
+def SiteSubset_Fnx(Backend, OutputLayer, Results, MatchIDs):
+    if len(MatchIDs) == len(Results):
+        return OutputLayer, Results
+    return Backend.Subset(OutputLayer, "Match_ID", MatchIDs), ResultsStore(MatchIDs)
+
+
+# PREPARED LAYERS FUNCTION:
+# This function prepares everything that only depends on the context and exclusion files (and the parameters), so it can be cached and reused by later runs
+'''NOTES:
+    Returns a dictionary of layers:
+        Exclusion                           the exclusion layer (with a spatial index)
+        ContextNoExclusion                  the context minus the exclusion
+        ContextDissolved                    the context dissolved into a single feature
+        ConvexHull, NegativeSpace           the study area hull and the "negative space" around the conservation sites
+        NarrowAreas, NearAreas              the connectivity areas for the narrowness Width (see ConnectivityZones_Fnx), for the "vector" and "graph" ConnectivityMethods
+        GapGraph                            the close pairs of context patches (see PCAT_GapGraph.py), for the "graph" ConnectivityMethod
+        ConnectivityRaster                  the connected and near zones on a grid of CellSize cells (see PCAT_Raster.py), for the "raster" ConnectivityMethod
+    and ZoneSeconds, the time the connectivity areas (or raster) took to build, or to load from the cache, which the connectivity time of a run includes.
+    With a Cache (PCAT_Cache.PreparedLayerCache), the layers are loaded from the cache when the content of both files and the parameters are unchanged, and otherwise prepared and saved into it.
+    With Zones False, the connectivity areas are left out, for building them on their own with PrepareZones_Fnx (or a chunk at a time in the streaming mode, see ChunkZones_Fnx);
+    the Cache entry then only holds the other layers, whatever the ConnectivityMethod.
+    The layers are never generalized: --generalize only applies to the buffer rings, so the connectivity areas, and the Con_Score of every site, are the same as without it.
+'''
+@PCAT_Profile.Profiled("prepare context and exclusion")
+def PrepareLayers_Fnx(Backend, ContextFile, ExclusionFile, Width, Cache=None, ConnectivityMethod="vector", CellSize=None, Zones=True):
+    PreparedNames = ["Exclusion", "ContextNoExclusion", "ContextDissolved", "ConvexHull", "NegativeSpace"]
+    if ConnectivityMethod in ("vector", "graph") and Zones:
+        PreparedNames += ["NarrowAreas", "NearAreas"]
+    # (without the connectivity areas, the layers do not depend on the connectivity parameters)
+    if not Zones:
+        ConnectivityMethod, CellSize = None, None
+
+    if Cache is not None:
+        CacheParameters = {"Engine": Backend.Name, "Width": Width, "StudyAreaBuffer": StudyAreaBuffer, "ConnectivityMethod": ConnectivityMethod, "CellSize": CellSize}
+        CacheKey = PCAT_Cache.CacheKey_Fnx([ContextFile, ExclusionFile], CacheParameters)
+        EntryFolder = Cache.Get(CacheKey)
+        if EntryFolder is not None:
+            AddMessage(" ... loading prepared context and exclusion from the cache")
+            ZoneNames = [Name for Name in PreparedNames if Name in ("NarrowAreas", "NearAreas")]
+            Prepared = dict((Name, Backend.LoadLayer(EntryFolder, Name)) for Name in PreparedNames if Name not in ZoneNames)
+            ZoneStart = time.time()
+            for Name in ZoneNames:
+                Prepared[Name] = Backend.LoadLayer(EntryFolder, Name)
+            if ConnectivityMethod == "raster":
+                Prepared["ConnectivityRaster"] = PCAT_Raster.ConnectivityRaster.Load(EntryFolder, "ConnectivityRaster")
+            elif ConnectivityMethod == "graph" and os.path.isfile(os.path.join(EntryFolder, "GapGraph.npz")):
+                Prepared["GapGraph"] = PCAT_GapGraph.GapGraph.Load(EntryFolder, "GapGraph")
+            Prepared["ZoneSeconds"] = time.time() - ZoneStart
+            return Prepared
+
+    ContextLayer = Backend.Read(ContextFile)
+    ExclusionLayer = Backend.Read(ExclusionFile)
+
+    #Erasing Exclusion file from the context (input, erase features):
+    AddMessage(" ... erasing exclusion from context")
+    ContextNoExclusion = Backend.Erase(ContextLayer, ExclusionLayer)
+
+    # Dissolving the context, so that the negative space below only has to erase a single feature
+    AddMessage(" ... dissolving context")
+    ContextDissolved = Backend.Dissolve(ContextLayer)
+
+    ### create a "study area" layer, from which to determine the "negative space" (all the land that is not under conservation easement) around existing conservation sites.
+
+    # Creat a Convex Hull around study area(note that a minimum enclosing rectangle, circle, etc. could also work but would include additional area):
+    AddMessage(" ... creating convex hull")
+    ConvexHull = Backend.ConvexHull(ContextLayer)
+
+    # Buffer out from the Convex Hull to include some extra space around the outside conservation sites (otherwise the connectivity of sites located on the outskirts of the study area gets skewed)
+    AddMessage(" ... buffering")
+    StudyArea = Backend.Buffer(ConvexHull, StudyAreaBuffer, "FULL")
+
+    # Create the "negative space" around conservation sites
+    AddMessage(" ... creating negative space")
+    xyTol = "1 Meters"
+    NegativeSpace = Backend.Erase(StudyArea, ContextDissolved, xyTol)
+
+    Prepared = {"Exclusion": ExclusionLayer, "ContextNoExclusion": ContextNoExclusion, "ContextDissolved": ContextDissolved,
+                "ConvexHull": ConvexHull, "NegativeSpace": NegativeSpace}
+    if Zones:
+        PrepareZones_Fnx(Backend, Prepared, Width, ConnectivityMethod, CellSize, StudyArea)
+
+    if Cache is not None:
+        AddMessage(" ... saving prepared context and exclusion to the cache")
+        def SavePrepared(Folder):
+            for Name in PreparedNames:
+                Backend.SaveLayer(Prepared[Name], Folder, Name)
+            if ConnectivityMethod == "raster":
+                Prepared["ConnectivityRaster"].Save(Folder, "ConnectivityRaster")
+            elif "GapGraph" in Prepared:
+                Prepared["GapGraph"].Save(Folder, "GapGraph")
+        Cache.Put(CacheKey, SavePrepared)
+
+    Backend.Delete(StudyArea)
+    return Prepared
+
+
+# PREPARED ZONES FUNCTION:
+# This function adds the connectivity areas of the ConnectivityMethod to the prepared layers (see PrepareLayers_Fnx), with the time they took as ZoneSeconds; returns Prepared
+'''NOTES:
+    StudyArea (optional) is the buffered convex hull the negative space was made from, which the "graph" ConnectivityMethod needs; it is buffered again when it is not given.
+'''
+def PrepareZones_Fnx(Backend, Prepared, Width, ConnectivityMethod="vector", CellSize=None, StudyArea=None):
+    ZoneStart = time.time()
+    if ConnectivityMethod == "raster":
+        Prepared["ConnectivityRaster"] = PCAT_Raster.RasterConnectivityZones_Fnx(Backend, Prepared["NegativeSpace"], Prepared["ConvexHull"], Width, CellSize)
+    elif ConnectivityMethod == "graph" and GapGraphWidth_Fnx(Width):
+        GraphStudyArea = StudyArea if StudyArea is not None else Backend.Buffer(Prepared["ConvexHull"], StudyAreaBuffer, "FULL")
+        Prepared["NarrowAreas"], Prepared["NearAreas"], Prepared["GapGraph"] = PCAT_GapGraph.GapGraphZones_Fnx(Backend, Prepared["ContextDissolved"], GraphStudyArea, Prepared["ConvexHull"], Width)
+        if GraphStudyArea is not StudyArea:
+            Backend.Delete(GraphStudyArea)
+    else:
+        if ConnectivityMethod == "graph":
+            AddMessage(" ... the width is too large for the gap graph (it must be less than half of the study area buffer), buffering the whole negative space")
+        Prepared["NarrowAreas"], Prepared["NearAreas"] = ConnectivityZones_Fnx(Backend, Prepared["NegativeSpace"], Prepared["ConvexHull"], Width)
+    Prepared["ZoneSeconds"] = time.time() - ZoneStart
+    return Prepared
+
+
+# CONNECTIVITY ZONES FUNCTION:
+# This function finds the areas of "narrowness" between the conservation sites (the "connected" areas), and the areas near them
+'''NOTES:
+    Width is the narrowness width as a linear unit (e.g. "25 Meters"). Gaps between conservation sites narrower than twice this width are "narrow areas".
+    The near areas are the land within Width of a narrow area (outside of the narrow area itself).
+'''
+@PCAT_Profile.Profiled("connectivity zones")
+def ConnectivityZones_Fnx(Backend, NegativeSpace, ConvexHull, Width):
+    # Generate a negative version of the width as well
+    AddMessage(" ... finding narrowness (this is slow)")
+    positiveWidth           = Width
+    negativeWidth           = "-" + positiveWidth
+
+    # Buffer into each input polygon and then back out from what's left to remove "narrow" areas
+    InnerBuffer = Backend.Buffer(NegativeSpace, negativeWidth, "FULL")
+    # NOTE "If the negative buffer distance is large enough to collapse the polygon to nothing, a null geometry will be generated. A warning message will be given, and any null geometry features will not be written to the output feature class." ~ ESRI
+    OutterBuffer = Backend.Buffer(InnerBuffer, positiveWidth, "FULL")
+
+    # Subtract the above layer without narrowness from the original negative space, to generate a layer with only narrow areas between conservation sites
+    AddMessage(" ... selecting only narrow areas")
+    NarrowAreas = Backend.Erase(NegativeSpace, OutterBuffer)
+
+    #Clip away the extra buffer around the study area (otherwise all the area surrounding the outside buffer appears to have a high connectivity score):
+    NarrowAreas_NoBuffer = Backend.Clip(NarrowAreas, ConvexHull)
+
+    # The above layer shows all the areas that would help increase the connectivity between existing conservation sites. Being a short distance away from one of these areas is also given a (smaller) score:
+    AddMessage(" ... calculating another buffer (this can take even longer)")
+    NearConnectivity = Backend.Buffer(NarrowAreas_NoBuffer, positiveWidth, "OUTSIDE_ONLY")
+    # NOTE, could also generate a distance to grid but I imagine that at a certain cutoff point being close to a "narrow" area of connectivity is no longer benefitial.
+
+    Backend.Delete(InnerBuffer, OutterBuffer, NarrowAreas)
+    return NarrowAreas_NoBuffer, NearConnectivity
+
+
+# Whether the gap graph (PCAT_GapGraph.py) gives the narrow areas of a narrowness width: twice the width must be less than the study area buffer, so that its edge never makes a narrow area
+def GapGraphWidth_Fnx(Width):
+    return 2 * PCAT_Backends.LinearUnitToMeters_Fnx(Width) < PCAT_Backends.LinearUnitToMeters_Fnx(StudyAreaBuffer)
+
+
+# CHUNK ZONES FUNCTION:
+# This function finds the narrow and near areas that a group of sites can touch, in a window around them only, for the streaming mode (see PCAT_Streaming.py); returns Prepared with them
+'''NOTES:
+    Prepared needs ContextPatches (the dissolved context split into patches) and StudyArea (the buffered convex hull), besides the ConvexHull.
+    The window is the convex hull of the sites buffered by three widths (PCAT_GapGraph.WindowDistance_Fnx), so the narrow and near areas that touch the sites are the same as those of
+    ConnectivityZones_Fnx on the whole negative space (see PCAT_GapGraph.WindowZones_Fnx), and the cost grows with the chunk rather than with the study area.
+'''
+def ChunkZones_Fnx(Backend, SiteLayer, Prepared, Width):
+    SiteHull = Backend.ConvexHull(SiteLayer)
+    Window = Backend.Buffer(SiteHull, PCAT_GapGraph.WindowDistance_Fnx(Width), "FULL")
+    NarrowAreas, NearAreas = PCAT_GapGraph.WindowZones_Fnx(Backend, Window, SiteHull, Prepared["ContextPatches"], Prepared["StudyArea"], Prepared["ConvexHull"], Width)
+    Backend.Delete(SiteHull, Window)
+    return dict(Prepared, NarrowAreas=NarrowAreas, NearAreas=NearAreas)
+
+
+# CONNECTIVITY FUNCTION:
+# This function scores the "connectivity" potential of the analysis sites: how well they fill the narrow gaps between existing conservation sites
+'''NOTES:
+    Prepared is the dictionary of layers from PrepareLayers_Fnx (which holds the narrow and near areas, or the ConnectivityRaster).
+    Sites that touch a narrow area score ConnectedScore, sites within the narrowness width of one score NearScore, and all other sites score 0.
+    With a ConnectivityRaster, a site's score is the highest zone score of the grid cells it covers.
+'''
+@PCAT_Profile.Profiled("connectivity")
+def Connectivity_Fnx(Backend, OutputLayer, Prepared, Results, ScoreFieldName="Con_Score", ConnectedScore=5, NearScore=1):
+    # Give the connectivity a score, from the narrow and near areas each site intersects
+    AddMessage(" ... calculating connectivity score")
+    if "ConnectivityRaster" in Prepared:
+        MatchIDs, SiteScores = Prepared["ConnectivityRaster"].ZonalScores(Backend, OutputLayer, "Match_ID", ConnectedScore, NearScore)
+        Scores = numpy.zeros(len(Results), dtype=int)
+        Scores[Results.Positions(MatchIDs)] = SiteScores
+        Results.Set(ScoreFieldName, Scores)
+        return Results
+
+    MatchIDs, ConnectedCounts = Backend.SpatialJoin(OutputLayer, Prepared["NarrowAreas"], "Match_ID")
+    Connected = Results.SumByMatchID(MatchIDs, ConnectedCounts) > 0
+    MatchIDs, NearCounts = Backend.SpatialJoin(OutputLayer, Prepared["NearAreas"], "Match_ID")
+    Near = Results.SumByMatchID(MatchIDs, NearCounts) > 0
+    Results.Set(ScoreFieldName, numpy.where(Connected, ConnectedScore, numpy.where(Near, NearScore, 0)))
+
+    return Results
+
+
+# CONNECTIVITY SWEEP FUNCTION:
+# This function scores the connectivity potential of the sites for every narrowness width of SweepWidths, into one field per width (see SweepFieldName_Fnx)
+'''NOTES:
+    The negative space and convex hull of Prepared are shared by every width. With the "raster" ConnectivityMethod, the negative space is also rasterized once, and the distance transform of the erosion is shared (see PCAT_Raster.RasterSweepZones_Fnx);
+    CellSize then defaults to a quarter of the smallest width (in a run, of the smallest of Width and the sweep widths, see RunPCAT_Fnx); the opening and the near zones still take two distance transforms per width. With the "vector" ConnectivityMethod, the negative space
+    is buffered in and out for each width (ConnectivityZones_Fnx), so a sweep costs about as much as the connectivity of one run per width,
+    and with the "graph" ConnectivityMethod a gap graph is built and its windows buffered for each width (PCAT_GapGraph.GapGraphZones_Fnx, for the widths it allows).
+    The score of each width is the Con_Score a run with that Width would calculate (with the raster ConnectivityMethod, at the same CellSize).
+'''
+@PCAT_Profile.Profiled("connectivity sweep")
+def ConnectivitySweep_Fnx(Backend, OutputLayer, Prepared, Results, SweepWidths, ConnectivityMethod="vector", CellSize=None):
+    if ConnectivityMethod == "raster":
+        CellSize = CellSize or str(min(PCAT_Backends.LinearUnitToMeters_Fnx(Width) for Width in SweepWidths) / 4) + " Meters"
+        Rasters = PCAT_Raster.RasterSweepZones_Fnx(Backend, Prepared["NegativeSpace"], Prepared["ConvexHull"], SweepWidths, CellSize)
+        for Width in SweepWidths:
+            Connectivity_Fnx(Backend, OutputLayer, {"ConnectivityRaster": Rasters[Width]}, Results, SweepFieldName_Fnx(Width))
+    else:
+        StudyArea = Backend.Buffer(Prepared["ConvexHull"], StudyAreaBuffer, "FULL") if ConnectivityMethod == "graph" else None
+        for Width in SweepWidths:
+            AddMessage(" ... width of " + Width)
+            if ConnectivityMethod == "graph" and GapGraphWidth_Fnx(Width):
+                NarrowAreas, NearAreas, Graph = PCAT_GapGraph.GapGraphZones_Fnx(Backend, Prepared["ContextDissolved"], StudyArea, Prepared["ConvexHull"], Width)
+            else:
+                NarrowAreas, NearAreas = ConnectivityZones_Fnx(Backend, Prepared["NegativeSpace"], Prepared["ConvexHull"], Width)
+            Connectivity_Fnx(Backend, OutputLayer, {"NarrowAreas": NarrowAreas, "NearAreas": NearAreas}, Results, SweepFieldName_Fnx(Width))
+            Backend.Delete(NarrowAreas, NearAreas)
+        if StudyArea is not None:
+            Backend.Delete(StudyArea)
+    for Width in SweepWidths:
+        Results.Set(SweepFieldName_Fnx(Width), Results.Get(SweepFieldName_Fnx(Width)).astype(int))
+    return Results
+
+
+# Name of the connectivity field of a sweep width: Con_ and the width in meters with at most two decimals (e.g. Con_25, Con_12_5), and fewer decimals where needed to fit the 10 characters of a shapefile field name
+def SweepFieldName_Fnx(Width):
+    Meters = PCAT_Backends.LinearUnitToMeters_Fnx(Width)
+    if not Meters > 0:
+        raise ValueError("The sweep width " + str(Width) + " must be more than 0")
+    for Decimals in (2, 1, 0):
+        Text = "%.*f" % (Decimals, Meters)
+        if "." in Text:
+            Text = Text.rstrip("0").rstrip(".")
+        FieldName = "Con_" + Text.replace(".", "_")
+        if len(FieldName) <= 10:
+            return FieldName
+    raise ValueError("The sweep width " + str(Width) + " is too large for a field name (it must be less than 1,000,000 meters)")
+
+
+# Connectivity fields of the sweep widths, {FieldName: Width}: a width given more than once is only scored once, and different widths that would share a field name are an error
+def SweepFields_Fnx(SweepWidths):
+    Fields = collections.OrderedDict()
+    for Width in SweepWidths or []:
+        FieldName = SweepFieldName_Fnx(Width)
+        if FieldName in Fields and PCAT_Backends.LinearUnitToMeters_Fnx(Fields[FieldName]) != PCAT_Backends.LinearUnitToMeters_Fnx(Width):
+            raise ValueError("The sweep widths " + str(Fields[FieldName]) + " and " + str(Width) + " would both be written to " + FieldName +
+                             " (field names keep two decimals of the width in meters at most, and fewer from 1,000 meters)")
+        Fields.setdefault(FieldName, Width)
+    return Fields
+
+
+# FINAL SCORE FUNCTION:
+# This function calculates the final PCAT score of each site as the weighted sum of its calculated values
+'''NOTES:
+    Weights is [[FieldName, Weight], ...] (see ScoreWeights). Missing values count as 0.
+'''
+@PCAT_Profile.Profiled("final score")
+def FinalScore_Fnx(Results, Weights, ScoreFieldName="PCAT_Scr"):
+    Results.Set(ScoreFieldName, Results.WeightedSum(Weights))
+    return Results
+
+
+# CHUNK METRICS FUNCTION:
+# This function calculates every output field of a group of sites (sections I to V below) from the prepared layers near them, for the streaming mode (see PCAT_Streaming.py)
+'''NOTES:
+    Prepared only needs the context and exclusion within HaloDistance of the sites (PCAT_Streaming.HaloPrepared_Fnx); the values are the same as with the whole layers.
+    The connectivity areas of the Width are found around the sites only (ChunkZones_Fnx), so Prepared also needs the layers ChunkZones_Fnx uses.
+'''
+def ChunkMetrics_Fnx(Backend, SiteLayer, Prepared, Results, HaloDistance, Width, Workers=1, Tiles=None, PerimeterMethod="overlay", SnapTolerance="0.001 Meters", Tolerance=None):
+    Keys, SiteAcres = Backend.ReadMeasure(SiteLayer, ["Match_ID"], "AREA")
+    Results.Set("SP_Acr", Results.SumByMatchID(Keys[:, 0], SiteAcres))
+
+    MetricsFunction = functools.partial(SiteMetrics_Fnx, PerimeterMethod=PerimeterMethod, SnapTolerance=SnapTolerance, Tolerance=Tolerance)
+    if Workers > 1:
+        PCAT_Parallel.TiledMetrics_Fnx(SiteLayer, Prepared["ContextNoExclusion"], Prepared["Exclusion"], Results, MetricsFunction, HaloDistance, Workers, Tiles)
+    else:
+        MetricsFunction(Backend, SiteLayer, Prepared["ContextNoExclusion"], Prepared["Exclusion"], Results)
+
+    ChunkPrepared = ChunkZones_Fnx(Backend, SiteLayer, Prepared, Width)
+    Connectivity_Fnx(Backend, SiteLayer, ChunkPrepared, Results)
+    Backend.Delete(ChunkPrepared["NarrowAreas"], ChunkPrepared["NearAreas"])
+    Results.Set("Con_Score", Results.Get("Con_Score").astype(int))
+    FinalScore_Fnx(Results, ScoreWeights)
+    return Results
+
+
+# TOP-K FUNCTION:
+# This function finds the TopK sites with the highest final score, calculating the buffer rings only for the sites that can still make the top TopK (see PCAT_TopK.py)
+'''NOTES:
+    The perimeter, the connectivity and the ring acreages are calculated for every site; the conserved acres within the rings only for the sites whose upper bound can reach the K-th best score.
+    Returns the Match_IDs of the TopK sites, best first. Every field of those sites is in Results, with exactly the values of a full run (with the same generalization Tolerance).
+'''
+@PCAT_Profile.Profiled("top-k ranking")
+def TopKScores_Fnx(Backend, OutputLayer, Prepared, Results, TopK, RingDistance, Workers=1, Tiles=None, PerimeterMethod="overlay", SnapTolerance="0.001 Meters", Tolerance=None):
+    ContextLayer, ExclusionLayer = Prepared["ContextNoExclusion"], Prepared["Exclusion"]
+
+    # The fields that are quick to calculate, for every site
+    SiteMetrics_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, PerimeterMethod, SnapTolerance, Parts=["perimeter"])
+    AddMessage("Calculating Connectivity Potential")
+    Connectivity_Fnx(Backend, OutputLayer, Prepared, Results)
+    Results.Set("Con_Score", Results.Get("Con_Score").astype(int))
+    AddMessage("Calculating the acreage of the buffers")
+    AllRings_NoExclusion, RingTemps = RingBuffers_Fnx(Backend, OutputLayer, ExclusionLayer, BuffRings, Tolerance)
+    RingKeys, RingAcres = Backend.ReadMeasure(AllRings_NoExclusion, ["Match_ID", "Ring_ID"], "AREA")
+    Backend.Delete(*(RingTemps + [AllRings_NoExclusion]))
+    BufferAcres = numpy.column_stack([Results.SumByMatchID(RingKeys[RingKeys[:, 1] == RingID, 0], RingAcres[RingKeys[:, 1] == RingID]) for RingID in range(len(BuffRings))])
+
+    # Upper bounds of the ring percentages, and so of the final score (from the context as the rings will be intersected with it)
+    BoundContext = Backend.Simplify(ContextLayer, Tolerance) if Tolerance else ContextLayer
+    PercentBounds = PCAT_TopK.RingPercentBounds_Fnx(Backend, OutputLayer, BoundContext, Results, BufferAcres,
+                                                    [PCAT_Backends.LinearUnitToMeters_Fnx(Ring[0]) for Ring in BuffRings])
+    if BoundContext is not ContextLayer:
+        Backend.Delete(BoundContext)
+    BoundScores = PCAT_TopK.BoundScores_Fnx(Results, ScoreWeights, dict((Ring[3], PercentBounds[:, RingID]) for RingID, Ring in enumerate(BuffRings)))
+
+    # Calculates the buffer rings and the final score of the sites with the given Match_IDs
+    def CalculateSites(MatchIDs):
+        SiteLayer, SiteResults = Backend.Subset(OutputLayer, "Match_ID", MatchIDs), ResultsStore(MatchIDs)
+        Positions = Results.Positions(SiteResults.MatchIDs)
+        for FieldName in Results.FieldNames():
+            SiteResults.Set(FieldName, Results.Get(FieldName)[Positions])
+        MetricsFunction = functools.partial(SiteMetrics_Fnx, PerimeterMethod=PerimeterMethod, SnapTolerance=SnapTolerance, Parts=["buffer rings"], Tolerance=Tolerance)
+        if Workers > 1:
+            PCAT_Parallel.TiledMetrics_Fnx(SiteLayer, ContextLayer, ExclusionLayer, SiteResults, MetricsFunction, RingDistance, Workers, Tiles)
+        else:
+            MetricsFunction(Backend, SiteLayer, ContextLayer, ExclusionLayer, SiteResults)
+        FinalScore_Fnx(SiteResults, ScoreWeights)
+        Results.Update(SiteResults)
+        Backend.Delete(SiteLayer)
+        return SiteResults.Get("PCAT_Scr")
+
+    AddMessage("Calculating Conservation within the Buffers, best bounds first")
+    TopMatchIDs, TopScores, Calculated = PCAT_TopK.TopK_Fnx(Results.MatchIDs, BoundScores, CalculateSites, TopK)
+    AddMessage(" ... the buffers of " + str(Calculated) + " of " + str(len(Results)) + " sites were calculated")
+    return TopMatchIDs
+
+
+# FULL PRECISION METRICS FUNCTION:
+# This function calculates the fields that generalization changes (the buffer rings and the final score) at full precision, for the sites of SiteLayer
+'''NOTES:
+    Results must already hold the perimeter and connectivity fields of the sites (neither is generalized), so with a tolerance of 0 every field is the one of a run without generalization.
+'''
+def FullPrecisionMetrics_Fnx(Backend, SiteLayer, Prepared, Results):
+    MultiRingAreaPercent_Fnx(Backend, SiteLayer, Prepared["ContextNoExclusion"], Prepared["Exclusion"], Results, BuffRings)
+    FinalScore_Fnx(Results, ScoreWeights)
+    return Results
+
+
+# Parameters of every checkpointed stage of a run (see PCAT_Checkpoint.py): {Stage: {Parameter: Value}}
+def CheckpointParameters_Fnx(Engine, Width, ConnectivityMethod, CellSize, PerimeterMethod, SnapTolerance, SweepWidths=None, GeneralizeTolerance=None):
+    StageParameters = collections.OrderedDict()
+    StageParameters["perimeter"] = {"Engine": Engine, "PerimeterMethod": PerimeterMethod}
+    if PerimeterMethod == "boundary":
+        StageParameters["perimeter"]["SnapTolerance"] = SnapTolerance
+    StageParameters["buffer rings"] = {"Engine": Engine, "BuffRings": [Ring[0] for Ring in BuffRings]}
+    StageParameters["connectivity"] = {"Engine": Engine, "Width": Width, "StudyAreaBuffer": StudyAreaBuffer, "ConnectivityMethod": ConnectivityMethod, "CellSize": CellSize}
+    # (the perimeter and the connectivity are never generalized)
+    if GeneralizeTolerance:
+        StageParameters["buffer rings"]["GeneralizeTolerance"] = GeneralizeTolerance
+    # (the final score is calculated from the fields of every other stage)
+    StageParameters["final score"] = {"ScoreWeights": ScoreWeights, "Stages": dict(StageParameters)}
+    if SweepWidths:
+        StageParameters["connectivity sweep"] = {"Engine": Engine, "SweepWidths": SweepWidths, "StudyAreaBuffer": StudyAreaBuffer, "ConnectivityMethod": ConnectivityMethod, "CellSize": CellSize}
+    return StageParameters
+
+
+# Name of the output of a run: <AnalysisFile>_PCAT, _PCAT_Top<TopK> in the top-K mode or _PCAT_Preview in the preview mode, with the extension of the OutputFormat (see PCAT_Output.OutputExtension_Fnx)
+def OutputName_Fnx(AnalysisFile, OutputFormat=None, TopK=None, Preview=None):
+    AnalysisRoot, AnalysisExtension = os.path.splitext(AnalysisFile)
+    OutputExtension = PCAT_Output.OutputExtension_Fnx(OutputFormat, AnalysisExtension)
+    if Preview:
+        return AnalysisRoot + "_PCAT_Preview" + OutputExtension
+    if TopK:
+        return AnalysisRoot + "_PCAT_Top" + str(TopK) + OutputExtension
+    return AnalysisRoot + "_PCAT" + OutputExtension
+
+
+# PCAT FUNCTION:
+# This function runs the whole calculation (sections I to V below) and returns the name of the output
+'''NOTES:
+    Engine is "arcpy" (ArcGIS geoprocessing tools) or "open" (Shapely/Fiona, runs without ArcGIS). Both produce the same output fields.
+    The output is written next to the analysis file as <AnalysisFile>_PCAT with the same extension (shapefile or GeoPackage).
+    CacheFolder (optional) keeps the prepared context and exclusion layers between runs, up to CacheMaxMB megabytes (see PCAT_Cache.py).
+    ConnectivityMethod is "vector" (buffers of the negative space), "graph" (buffers of windows around the close pairs of context patches only, with the same result, see PCAT_GapGraph.py)
+    or "raster" (distance transforms on a grid of CellSize cells, see PCAT_Raster.py).
+    CellSize is a linear unit and defaults to a quarter of Width (or of the smallest sweep width, when that is smaller), the finest cells that were faster than the vector engine on the benchmark landscape.
+    With Workers above 1 (open engine only), the perimeter and buffer percentages are calculated on Tiles spatial tiles of the sites in that many processes (see PCAT_Parallel.py), with the same results.
+    MetricsCacheFile (optional) is a SQLite file that keeps the fields of every site between runs, so that only new or changed sites, and sites near changed context or exclusion, are calculated.
+    MetricsTable (optional) is a CSV file to save every calculated field into, by Match_ID, for scoring other weights with PCAT_Score.py.
+    ProfileFile (optional) is a trace-event JSON file to record the time, memory and feature counts of every stage and geoprocessing operation into (see PCAT_Profile.py);
+    CProfileFolder (optional) also saves a cProfile of every stage there.
+    MemoryBudgetMB is the memory the arcpy engine keeps its intermediate layers in before it writes them to a scratch GeoPackage (the open engine always keeps them in memory).
+    PerimeterMethod is "overlay" or "boundary" (the shared-boundary engine, see PCAT_Boundary.py), which treats boundaries within SnapTolerance (a linear unit) as shared.
+    With a ChunkSize (open engine only), the sites are read, calculated and written ChunkSize at a time in Hilbert curve order, so the memory used does not grow with the analysis file (see PCAT_Streaming.py).
+    With TopK, only the TopK sites with the highest final score are written, best first (by PCAT_Rank), to <AnalysisFile>_PCAT_Top<TopK>; the other sites are only calculated as far as needed to rule them out (see PCAT_TopK.py).
+    With Preview (a cell size, as a linear unit), only the buffer ring fields are calculated, approximately, on grids of that cell size (see PCAT_Preview.py), and written to <AnalysisFile>_PCAT_Preview;
+    the errors against the exact calculation are reported for a random sample of PreviewSample sites (0 for none).
+    SweepWidths (optional) is a list of narrowness widths (linear units) to also score the connectivity for, into one Con_<width> field per width (see ConnectivitySweep_Fnx); only in a full run.
+    GapGraphFile (optional) is a CSV file to export the edges of the gap graph into, with the "graph" ConnectivityMethod (see PCAT_GapGraph.GapGraph.SaveTable).
+    With a GeneralizeTolerance (a linear unit), the geometry of the buffer rings is generalized to within it before the overlays (see PCAT_Generalize.py);
+    a full run then reports the errors against the full precision calculation for a random sample of GeneralizeSample sites (0 for none).
+    OutputFormat (optional) is "shapefile", "geopackage" or "geoparquet" (see PCAT_Output.py); by default the output has the format of the analysis file.
+    With Checkpoints (off by default, since they hash the input files), every stage saves its fields into <output>_<extension>_checkpoint as soon as it is done, and with Resume the stages completed by an earlier run on the same inputs (and with the same parameters) are loaded instead of calculated (see PCAT_Checkpoint.py);
+    without a CacheFolder, the prepared context and exclusion are also kept there, so a resumed run does not prepare them again. Resume turns the checkpoints on.
+    Backend and PreparedStore are passed by the batch runner (PCAT_Batch.py), which keeps the backend of the engine and the prepared layers between its runs.
+'''
+def RunPCAT_Fnx(ContextFile, AnalysisFile, ExclusionFile, Workspace="", Width="25 Meters", Engine="arcpy", CacheFolder=None, CacheMaxMB=2048,
+                ConnectivityMethod="vector", CellSize=None, Workers=1, Tiles=None, MetricsCacheFile=None,
+                MetricsTable=None, ProfileFile=None, CProfileFolder=None, MemoryBudgetMB=4096,
+                PerimeterMethod="overlay", SnapTolerance="0.001 Meters", ChunkSize=None, Resume=False, Checkpoints=False, TopK=None,
+                Preview=None, PreviewSample=200, SweepWidths=None, GapGraphFile=None, GeneralizeTolerance=None, GeneralizeSample=200, OutputFormat=None,
+                Backend=None, PreparedStore=None):
+    # Setting Workspace in which to store files
+    if Engine == "arcpy" and Workspace:
+        arcpy.env.workspace = Workspace
+        arcpy.env.scratchWorkspace = Workspace
+
+    # Output File:
+    nameOfOutputShapefile = OutputName_Fnx(AnalysisFile, OutputFormat)
+    AddMessage("The output shapefile name is " + nameOfOutputShapefile + "\n")
+
+    if Backend is None:
+        Backend = PCAT_Backends.GetBackend_Fnx(Engine, nameOfOutputShapefile, MemoryBudgetMB)
+
+    if ChunkSize and Engine != "open":
+        AddMessage("The streaming mode needs the open engine, calculating all of the sites at once")
+        ChunkSize = None
+
+    # One connectivity field per sweep width (the same width given twice is only scored once)
+    SweepWidths = list(SweepFields_Fnx(SweepWidths).values())
+    if SweepWidths and (Preview or TopK or ChunkSize):
+        AddMessage("The connectivity sweep is only calculated in a full run (not in the preview, top-K or streaming modes)")
+        SweepWidths = []
+
+    # Recording every stage and geoprocessing operation
+    Profiler = None
+    if ProfileFile or CProfileFolder:
+        Profiler = PCAT_Profile.Activate_Fnx(PCAT_Profile.Profiler(CProfileFolder))
+        Backend = PCAT_Profile.ProfiledBackend(Backend, Profiler)
+
+    # In the preview mode, the buffer ring fields are approximated on grids of the context and exclusion, which needs none of the prepared layers
+    if Preview:
+        nameOfPreviewOutput = OutputName_Fnx(AnalysisFile, OutputFormat, Preview=Preview)
+        AddMessage("Previewing the conservation within the buffers, saved to " + nameOfPreviewOutput)
+        with PCAT_Profile.Stage("create output"):
+            OutputLayer = Backend.CreateOutput(AnalysisFile, nameOfPreviewOutput, PreviewFields)
+        Keys, SiteAcres = Backend.ReadMeasure(OutputLayer, ["Match_ID"], "AREA")
+        Results = ResultsStore(Keys[:, 0])
+        Results.Set("SP_Acr", Results.SumByMatchID(Keys[:, 0], SiteAcres))
+        ContextLayer, ExclusionLayer = Backend.Read(ContextFile), Backend.Read(ExclusionFile)
+        PCAT_Preview.PreviewRings_Fnx(Backend, OutputLayer, ContextLayer, ExclusionLayer, Results, BuffRings, PCAT_Backends.LinearUnitToMeters_Fnx(Preview))
+
+        if PreviewSample:
+            AddMessage("Checking the preview against the exact calculation")
+            ExactFunction = lambda Backend, SiteLayer, SiteResults: MultiRingAreaPercent_Fnx(Backend, SiteLayer, ContextLayer, ExclusionLayer, SiteResults, BuffRings)
+            PCAT_Preview.PreviewErrors_Fnx(Backend, OutputLayer, Results, ExactFunction, [FieldName for Ring in BuffRings for FieldName in Ring[1:]], PreviewSample)
+
+        AddMessage("Writing results to the output")
+        with PCAT_Profile.Stage("write output"):
+            Backend.WriteResults(OutputLayer, Results)
+            PCAT_Output.OutputWriter_Fnx(Backend, nameOfPreviewOutput, PreviewFields).Save(OutputLayer, Results)
+        if MetricsTable:
+            AddMessage("Saving the metrics table " + MetricsTable)
+            Results.SaveTable(MetricsTable)
+        FinishRun_Fnx(Backend, Profiler, ProfileFile)
+        return nameOfPreviewOutput
+
+    # Recording every stage as it is completed (and loading the stages an earlier run completed, with Resume); only in a full run
+    Checkpoint = None
+    if (Checkpoints or Resume) and not (TopK or ChunkSize):
+        if not all(os.path.isfile(InputFile) for InputFile in (ContextFile, AnalysisFile, ExclusionFile)):
+            AddMessage("Checkpoints need the context, analysis and exclusion to be files (shapefiles or GeoPackages), running without them")
+        else:
+            AddMessage("Checking the checkpoints" if Resume else "Starting the checkpoints")
+            Checkpoint = PCAT_Checkpoint.Checkpoint(PCAT_Backends.RunFileName_Fnx(nameOfOutputShapefile, "_checkpoint"), [ContextFile, AnalysisFile, ExclusionFile], Resume)
+
+    # Preparing (or loading from the cache) the layers that only depend on the context and exclusion files
+    # (without a cache folder, a run with checkpoints keeps them in its checkpoint folder, so that a resumed run does not prepare them again)
+    AddMessage("Preparing Context and Exclusion")
+    Cache = PCAT_Cache.PreparedLayerCache(CacheFolder, CacheMaxMB * 1024 ** 2) if CacheFolder else None
+    if Cache is None and Checkpoint:
+        Cache = PCAT_Cache.PreparedLayerCache(os.path.join(Checkpoint.CheckpointFolder, "prepared"), CacheMaxMB * 1024 ** 2)
+    # (one cell size for the run and every width of its sweep: a quarter of the smallest of them, see PCAT_Raster.py for its speed and accuracy)
+    if ConnectivityMethod == "raster" and not CellSize:
+        CellSize = str(min(PCAT_Backends.LinearUnitToMeters_Fnx(Width) for Width in SweepWidths + [Width]) / 4) + " Meters"
+    if PreparedStore is not None:
+        Prepared = PreparedStore.Get(Backend, ContextFile, ExclusionFile, Width, Cache, ConnectivityMethod, CellSize, Zones=not ChunkSize)
+    else:
+        # (the streaming mode finds the connectivity areas a chunk at a time, see ChunkZones_Fnx)
+        Prepared = PrepareLayers_Fnx(Backend, ContextFile, ExclusionFile, Width, Cache, ConnectivityMethod, CellSize, Zones=not ChunkSize)
+    if GapGraphFile:
+        if "GapGraph" in Prepared:
+            AddMessage("Saving the gap graph " + GapGraphFile)
+            Prepared["GapGraph"].SaveTable(GapGraphFile)
+        else:
+            AddMessage("There is no gap graph to save (it is only built by the graph connectivity method, for widths below half of the study area buffer)")
+
+    # Largest distance at which context or exclusion can change a site's perimeter or buffer values: the largest buffer ring
+    RingDistance = max(PCAT_Backends.LinearUnitToMeters_Fnx(Ring[0]) for Ring in BuffRings)
+
+    if Workers > 1 and Engine != "open":
+        AddMessage("Parallel execution needs the open engine, calculating the sites in a single process")
+        Workers = 1
+
+    # In the top-K mode, only the sites that can make the top TopK are calculated in full, and only those are written
+    if TopK:
+        if ChunkSize or MetricsCacheFile or Resume:
+            AddMessage("The streaming mode, the site metrics cache and checkpoints are not used in the top-K mode")
+        nameOfTopKOutput = OutputName_Fnx(AnalysisFile, OutputFormat, TopK=TopK)
+        AddMessage("Finding the top " + str(TopK) + " sites, saved to " + nameOfTopKOutput)
+        with PCAT_Profile.Stage("create output"):
+            OutputLayer = Backend.CreateOutput(AnalysisFile, nameOfTopKOutput, OutputFields + [RankField])
+        Keys, SiteAcres = Backend.ReadMeasure(OutputLayer, ["Match_ID"], "AREA")
+        Results = ResultsStore(Keys[:, 0])
+        Results.Set("SP_Acr", Results.SumByMatchID(Keys[:, 0], SiteAcres))
+        TopMatchIDs = TopKScores_Fnx(Backend, OutputLayer, Prepared, Results, TopK, RingDistance, Workers, Tiles, PerimeterMethod, SnapTolerance, GeneralizeTolerance)
+
+        AddMessage("Writing the top " + str(len(TopMatchIDs)) + " sites to the output")
+        with PCAT_Profile.Stage("write output"):
+            TopLayer, TopResults = Backend.Subset(OutputLayer, "Match_ID", TopMatchIDs), ResultsStore(TopMatchIDs)
+            Positions = Results.Positions(TopResults.MatchIDs)
+            for FieldName in Results.FieldNames():
+                TopResults.Set(FieldName, Results.Get(FieldName)[Positions])
+            TopResults.Set(RankField[0], numpy.arange(1, len(TopMatchIDs) + 1), ForMatchIDs=TopMatchIDs)
+            TopResults.Set(RankField[0], TopResults.Get(RankField[0]).astype(int))
+            Backend.WriteResults(TopLayer, TopResults)
+            PCAT_Output.OutputWriter_Fnx(Backend, nameOfTopKOutput, OutputFields + [RankField]).Save(TopLayer, TopResults)
+        if MetricsTable:
+            AddMessage("Saving the metrics table " + MetricsTable)
+            TopResults.SaveTable(MetricsTable)
+        FinishRun_Fnx(Backend, Profiler, ProfileFile)
+        return nameOfTopKOutput
+
+    # In the streaming mode, the sites are read, calculated (sections I to V below) and written a chunk at a time
+    if ChunkSize:
+        if MetricsCacheFile:
+            AddMessage("The site metrics cache is not used in the streaming mode")
+        if Resume:
+            AddMessage("The streaming mode can not resume from checkpoints, calculating every chunk")
+        if ConnectivityMethod == "raster":
+            AddMessage("The streaming mode finds the connectivity areas of each chunk with buffers (as the vector method does), not on a grid")
+        AddMessage("Calculating the sites a chunk at a time")
+        # The context patches and the study area, for the windows of the chunks' connectivity areas
+        StreamPrepared = dict(Prepared, ContextPatches=Backend.Explode(Prepared["ContextDissolved"]), StudyArea=Backend.Buffer(Prepared["ConvexHull"], StudyAreaBuffer, "FULL"))
+        ChunkFunction = functools.partial(ChunkMetrics_Fnx, HaloDistance=RingDistance, Width=Width, Workers=Workers, Tiles=Tiles,
+                                          PerimeterMethod=PerimeterMethod, SnapTolerance=SnapTolerance, Tolerance=GeneralizeTolerance)
+        Writer = PCAT_Output.OutputWriter_Fnx(Backend, nameOfOutputShapefile, OutputFields)
+        PCAT_Streaming.StreamPCAT_Fnx(Backend, AnalysisFile, Writer, OutputFields, StreamPrepared, ChunkFunction, RingDistance, ChunkSize, MetricsTable)
+        Backend.Delete(StreamPrepared["ContextPatches"], StreamPrepared["StudyArea"])
+        FinishRun_Fnx(Backend, Profiler, ProfileFile)
+        return nameOfOutputShapefile
+
+    # #######################################################################
+    # I. Adding fields
+    # #######################################################################
+
+    # Replicate the input shapefile, add the new fields to the replica and populate the Match_ID with a sequential number (similar to FID)
+    AddMessage(" ... adding field names")
+    with PCAT_Profile.Stage("create output"):
+        RunFields = OutputFields + [[SweepFieldName_Fnx(Width), "Short", 6, None] for Width in SweepWidths]
+        OutputLayer = Backend.CreateOutput(AnalysisFile, nameOfOutputShapefile, RunFields)
+
+    # Calculating the area (in acres) of the analysis sites, which also starts the results store (one array per field, indexed by Match_ID)
+    Keys, SiteAcres = Backend.ReadMeasure(OutputLayer, ["Match_ID"], "AREA")
+    Results = ResultsStore(Keys[:, 0])
+    Results.Set("SP_Acr", Results.SumByMatchID(Keys[:, 0], SiteAcres))
+
+    StageParameters = CheckpointParameters_Fnx(Engine, Width, ConnectivityMethod, CellSize, PerimeterMethod, SnapTolerance, SweepWidths, GeneralizeTolerance)
+
+    # Largest distance at which context or exclusion can change a site's connectivity score: three narrowness widths (the narrow areas move by up to two widths, the near areas by one more)
+    ConnectivityDistance = 3 * PCAT_Backends.LinearUnitToMeters_Fnx(Width) + (2 * PCAT_Backends.LinearUnitToMeters_Fnx(CellSize) if ConnectivityMethod == "raster" else 0)
+
+    # With a site metrics cache, only the sites that are not cached are calculated
+    SiteMatchIDs = ConnectivityMatchIDs = Results.MatchIDs
+    if MetricsCacheFile:
+        AddMessage("Reading cached site metrics")
+        CacheParameters = {"Engine": Engine, "Width": Width, "BuffRings": [Ring[0] for Ring in BuffRings], "StudyAreaBuffer": StudyAreaBuffer,
+                           "ConnectivityMethod": ConnectivityMethod, "CellSize": CellSize}
+        # (only recorded for the shared-boundary engine, so that existing caches of overlay runs stay valid)
+        if PerimeterMethod == "boundary":
+            CacheParameters["SnapTolerance"] = SnapTolerance
+        if GeneralizeTolerance:
+            CacheParameters["GeneralizeTolerance"] = GeneralizeTolerance
+        MetricsCache = PCAT_Cache.SiteMetricsCache(MetricsCacheFile, CacheParameters)
+        with PCAT_Profile.Stage("read cached metrics"):
+            SiteMatchIDs, ConnectivityMatchIDs, Sites = ReadCachedMetrics_Fnx(Backend, MetricsCache, ContextFile, OutputLayer, Prepared, Results,
+                                                                              max(RingDistance, ConnectivityDistance) + 1.0)
+
+    # #######################################################################
+    # II. Calculating Percentage of Conserved PERIMETER (minus Exclusion Areas)
+    # III. Calculating Percentage of Conserved AREA w/in Buffers (minus Exclusion Areas)
+    # #######################################################################
+
+    Parts = [Part for Part, FieldNames in SiteMetricParts if not (Checkpoint and Checkpoint.Resume(Part, Results, StageParameters[Part]))]
+    # (with checkpoints, the perimeter and the buffer rings are calculated and recorded one after the other)
+    for StageParts in ([[Part] for Part in Parts] if Checkpoint else [Parts]):
+        if not StageParts:
+            continue
+        StageStart = time.time()
+        if len(SiteMatchIDs):
+            SiteLayer, SiteResults = SiteSubset_Fnx(Backend, OutputLayer, Results, SiteMatchIDs)
+            MetricsFunction = functools.partial(SiteMetrics_Fnx, PerimeterMethod=PerimeterMethod, SnapTolerance=SnapTolerance, Parts=StageParts, Tolerance=GeneralizeTolerance)
+            if Workers > 1:
+                AddMessage("Calculating Conservation of " + " and ".join(StageParts) + " in parallel")
+                with PCAT_Profile.Stage("tiled site metrics"):
+                    PCAT_Parallel.TiledMetrics_Fnx(SiteLayer, Prepared["ContextNoExclusion"], Prepared["Exclusion"], SiteResults, MetricsFunction, RingDistance, Workers, Tiles)
+            else:
+                MetricsFunction(Backend, SiteLayer, Prepared["ContextNoExclusion"], Prepared["Exclusion"], SiteResults)
+            if SiteResults is not Results:
+                Results.Update(SiteResults)
+                Backend.Delete(SiteLayer)
+        if Checkpoint:
+            Checkpoint.Save(StageParts[0], Results, dict(SiteMetricParts)[StageParts[0]], StageParameters[StageParts[0]], time.time() - StageStart)
+
+    # ####################################################################
+    # IV. Finding "Connectivity" Potential of Conservation Sites
+    ####################################################################
+
+    AddMessage("Calculating Connectivity Potential")
+
+    # Start timing
+    timeStart_C           = time.time()
+
+    if not (Checkpoint and Checkpoint.Resume("connectivity", Results, StageParameters["connectivity"])):
+        if len(ConnectivityMatchIDs):
+            SiteLayer, SiteResults = SiteSubset_Fnx(Backend, OutputLayer, Results, ConnectivityMatchIDs)
+            Connectivity_Fnx(Backend, SiteLayer, Prepared, SiteResults)
+            if SiteResults is not Results:
+                Results.Update(SiteResults)
+                Backend.Delete(SiteLayer)
+        Results.Set("Con_Score", Results.Get("Con_Score").astype(int))
+        if Checkpoint:
+            Checkpoint.Save("connectivity", Results, ["Con_Score"], StageParameters["connectivity"], time.time() - timeStart_C + Prepared["ZoneSeconds"])
+
+    # Stop timing (the connectivity zones were built, or loaded, with the prepared layers)
+    timeStop_C        = time.time()
+    timeTaken_C       = (timeStop_C - timeStart_C + Prepared["ZoneSeconds"])/60
+    AddMessage("\nElapsed time for Connectivity Calculation = " + str(timeTaken_C) + " minutes (" + str(Prepared["ZoneSeconds"]/60) + " of them for the connectivity zones)\n")
+
+    # Connectivity for every width of the sweep, sharing the negative space (and, with the raster engine, its distance transform)
+    if SweepWidths:
+        AddMessage("Calculating Connectivity Potential for widths of " + ", ".join(SweepWidths))
+        if not (Checkpoint and Checkpoint.Resume("connectivity sweep", Results, StageParameters["connectivity sweep"])):
+            StageStart = time.time()
+            ConnectivitySweep_Fnx(Backend, OutputLayer, Prepared, Results, SweepWidths, ConnectivityMethod, CellSize)
+            if Checkpoint:
+                Checkpoint.Save("connectivity sweep", Results, [SweepFieldName_Fnx(Width) for Width in SweepWidths], StageParameters["connectivity sweep"], time.time() - StageStart)
+
+    # ####################################################################
+    # V. Final Site Ranking
+    ####################################################################
+    AddMessage("Calculating Final Score!")
+    if not (Checkpoint and Checkpoint.Resume("final score", Results, StageParameters["final score"])):
+        FinalScore_Fnx(Results, ScoreWeights)
+        if Checkpoint:
+            Checkpoint.Save("final score", Results, ["PCAT_Scr"], StageParameters["final score"], 0.0)
+
+    # Measuring how far the generalization moved the fields, on a sample of the sites
+    if GeneralizeTolerance and GeneralizeSample:
+        AddMessage("Checking the generalization against the full precision calculation")
+        ExactFunction = lambda Backend, SiteLayer, SiteResults: FullPrecisionMetrics_Fnx(Backend, SiteLayer, Prepared, SiteResults)
+        Errors = PCAT_Generalize.GeneralizationErrors_Fnx(Backend, OutputLayer, Results, ExactFunction,
+                                                          [FieldName for Ring in BuffRings for FieldName in Ring[1:]] + ["PCAT_Scr"], GeneralizeSample)
+        # With a tolerance of 0 nothing is generalized, so the full precision reference must give back the fields of the run itself
+        if PCAT_Backends.LinearUnitToMeters_Fnx(GeneralizeTolerance) <= 0 and any(FieldErrors["Changed"] for FieldErrors in Errors.values()):
+            AddMessage("WARNING: with a tolerance of 0, the full precision reference differs from the run for " +
+                       ", ".join(FieldName for FieldName, FieldErrors in Errors.items() if FieldErrors["Changed"]))
+
+    # Keeping the newly calculated sites for the next run
+    if MetricsCacheFile:
+        AddMessage("Storing site metrics in the cache")
+        StoreCachedMetrics_Fnx(MetricsCache, Results, Sites, numpy.union1d(SiteMatchIDs, ConnectivityMatchIDs))
+        MetricsCache.Close()
+
+    # Writing all of the calculated fields into the output in one bulk update
+    AddMessage("Writing results to the output")
+    with PCAT_Profile.Stage("write output"):
+        Backend.WriteResults(OutputLayer, Results)
+        PCAT_Output.OutputWriter_Fnx(Backend, nameOfOutputShapefile, RunFields).Save(OutputLayer, Results)
+    if MetricsTable:
+        AddMessage("Saving the metrics table " + MetricsTable)
+        Results.SaveTable(MetricsTable)
+
+    # The output is complete, so the checkpoints are no longer needed
+    if Checkpoint:
+        Checkpoint.Finish()
+
+    FinishRun_Fnx(Backend, Profiler, ProfileFile)
+    return nameOfOutputShapefile
+
+
+# Cleans up the temporary layers and ends the profile of a run (Profiler is None when the run was not profiled)
+def FinishRun_Fnx(Backend, Profiler, ProfileFile):
+    #Cleaning Up...
+    Backend.Cleanup()
+
+    if Profiler is not None:
+        PCAT_Profile.Activate_Fnx(None)
+        Profiler.Summary()
+        if ProfileFile:
+            AddMessage("Profile saved to " + Profiler.Save(ProfileFile))
+
+
+# Reads the tool parameters (ArcToolbox passes them to the script in the same order)
+def ParseArguments_Fnx(Arguments):
+    parser = argparse.ArgumentParser(description="Ranks potential conservation sites by their proximity and connectivity to existing conservation sites.")
+    parser.add_argument("ContextFile", help="existing conservation sites (shapefile or GeoPackage)")
+    parser.add_argument("AnalysisFile", help="potential sites to rank (shapefile or GeoPackage)")
+    parser.add_argument("ExclusionFile", help="area to exclude from the calculations, e.g. water (shapefile or GeoPackage)")
+    parser.add_argument("Workspace", nargs="?", default="", help="workspace in which to store files (arcpy engine)")
+    parser.add_argument("Width", nargs="?", default="25 Meters", help="narrowness width for the connectivity score, as a linear unit (default: 25 Meters)")
+    parser.add_argument("--engine", choices=["arcpy", "open"], default="arcpy" if arcpy is not None else "open",
+                        help="geometry engine: arcpy (ArcGIS) or open (Shapely/Fiona); defaults to arcpy when ArcGIS is available")
+    parser.add_argument("--cache-folder", default=None, help="folder in which to keep the prepared context and exclusion layers between runs")
+    parser.add_argument("--cache-size", type=int, default=2048, help="maximum size of the cache folder in megabytes (default: 2048)")
+    parser.add_argument("--connectivity", choices=["vector", "graph", "raster"], default="vector",
+                        help="connectivity calculation: vector (buffers), graph (buffers around the close pairs of context patches only, see PCAT_GapGraph.py) or raster (distance transforms, needs scipy)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes for the perimeter and buffer calculations (open engine; default: 1)")
+    parser.add_argument("--tiles", type=int, default=None, help="number of spatial tiles for --workers (default: 4 per worker)")
+    parser.add_argument("--metrics-cache", default=None, help="SQLite file in which to keep the fields of every site between runs, so that only changed sites are calculated again")
+    parser.add_argument("--metrics-table", default=None, help="CSV file in which to save every calculated field by Match_ID (for PCAT_Score.py)")
+    parser.add_argument("--profile", default=None, help="trace-event JSON file in which to record the time, memory and feature counts of every stage (see PCAT_Profile.py)")
+    parser.add_argument("--profile-stages", default=None, help="folder in which to save a cProfile of every stage")
+    parser.add_argument("--memory-budget", type=int, default=4096, help="megabytes of memory for intermediate layers before they are written to a scratch GeoPackage (arcpy engine; default: 4096)")
+    parser.add_argument("--cell-size", default=None, help="cell size of the raster connectivity, as a linear unit (default: a quarter of Width, or of the smallest sweep width)")
+    parser.add_argument("--perimeter", choices=["overlay", "boundary"], default="overlay",
+                        help="perimeter calculation: overlay (line overlays) or boundary (shared-boundary segment sweep, see PCAT_Boundary.py)")
+    parser.add_argument("--snap-tolerance", default="0.001 Meters", help="distance within which boundaries count as shared, as a linear unit (--perimeter boundary; default: 0.001 Meters)")
+    parser.add_argument("--resume", action="store_true", help="load the stages completed by an earlier (failed or stopped) run from its checkpoints instead of calculating them again")
+    parser.add_argument("--checkpoints", action="store_true", help="save a checkpoint after every stage, for --resume (hashes the input files and saves the prepared layers and the fields of every stage)")
+    parser.add_argument("--top-k", type=int, default=None, help="only find (and write) the given number of sites with the highest final score, calculating the other sites only as far as needed to rule them out")
+    parser.add_argument("--preview", nargs="?", const="30 Meters", default=None,
+                        help="only approximate the buffer ring fields on grids of the given cell size, as a linear unit (default: 30 Meters), in seconds (see PCAT_Preview.py)")
+    parser.add_argument("--preview-sample", type=int, default=200, help="number of sites to check the preview against the exact calculation (0 for none; default: 200)")
+    parser.add_argument("--sweep-widths", nargs="+", default=None,
+                        help="also score the connectivity for each of these narrowness widths (linear units, or meters), into one Con_<width> field per width")
+    parser.add_argument("--gap-graph", default=None, help="CSV file in which to save the edges of the gap graph (--connectivity graph)")
+    parser.add_argument("--generalize", default=None,
+                        help="simplify the geometry and the buffer arcs to within this tolerance, as a linear unit, before the buffer ring and connectivity overlays (see PCAT_Generalize.py)")
+    parser.add_argument("--generalize-sample", type=int, default=200, help="number of sites to check the generalization against the full precision calculation (0 for none; default: 200)")
+    parser.add_argument("--output-format", choices=list(PCAT_Output.OutputFormats), default=None,
+                        help="format of the output: shapefile, geopackage (with a table of the calculated fields only) or geoparquet (columnar, see PCAT_Output.py); default: that of the analysis file")
+    parser.add_argument("--chunk-size", type=int, default=None, help="streaming mode: number of sites to read, calculate and write at a time (open engine; default: all at once)")
+    Parsed = parser.parse_args(Arguments)
+
+    # ArcToolbox passes "#" for parameters that were left empty
+    if Parsed.Workspace == "#":
+        Parsed.Workspace = ""
+    if Parsed.Width in ("", "#"):
+        Parsed.Width = "25 Meters"
+    return Parsed
+
+
+# #########################################################################
+# Running the Script
+# #########################################################################
+
+if __name__ == "__main__":
+    try:
+        Parameters = ParseArguments_Fnx(sys.argv[1:])
+        RunPCAT_Fnx(Parameters.ContextFile, Parameters.AnalysisFile, Parameters.ExclusionFile, Parameters.Workspace, Parameters.Width, Parameters.engine,
+                    Parameters.cache_folder, Parameters.cache_size, Parameters.connectivity, Parameters.cell_size,
+                    Parameters.workers, Parameters.tiles, Parameters.metrics_cache,
+                    Parameters.metrics_table, Parameters.profile, Parameters.profile_stages,
+                    Parameters.memory_budget, Parameters.perimeter, Parameters.snap_tolerance, Parameters.chunk_size,
+                    Parameters.resume, Parameters.checkpoints, Parameters.top_k,
+                    Parameters.preview, Parameters.preview_sample, Parameters.sweep_widths, Parameters.gap_graph,
+                    Parameters.generalize, Parameters.generalize_sample, Parameters.output_format)
+
+    except Exception as e:
+        # If unsuccessful, end gracefully by indicating why
+        AddError('\n' + "Script failed because: \t\t" + str(e))
+        # ... and where
+        exceptionreport = sys.exc_info()[2]
+        fullermessage   = traceback.format_tb(exceptionreport)[0]
+        AddError("at this location: \n\n" + fullermessage + "\n")
+
+
+
+# #######################################################################
+# #######################################################################
+# TOOLS USED: SYNTAX STRUCTURE REFERENCES FOR EDITING
+# #######################################################################
+
+# Data management:
+    # arcpy.AddField_management(table, fieldname, type, precision, scale, length, alias, nullability, required, domain) 
+    # arcpy.CalculateField_management(in_table, field, expression, {expression_type}, {code_block})
+    # arcpy.MakeFeatureLayer_management(in_features, out_layer, {where_clause}, {workspace}, {field_info})
+    # arcpy.AddJoin_management(in_layer_or_view, in_field, join_table, join_field, {join_type})
+    # arcpy.Merge_management([Connectivity2_temp, NearConnectivity2_temp], ConnectivityMeasure_temp, fieldMappings)
+
+
+# Shapefile manipulation:
+    # arcpy.Intersect_analysis(in_features, out_feature_class, {join_attributes}, {cluster_tolerance}, {output_type})
+    # arcpy.Erase_analysis(in_features, erase_features, out_feature_class, {cluster_tolerance})
+    # arcpy.PolygonToLine_management(in_features, out_feature_class, {neighbor_option})
+    # arcpy.Buffer_analysis(in_features, out_feature_class, buffer_distance_or_field, {line_side}, {line_end_type}, {dissolve_option}, {dissolve_field}, {method})
+    # arcpy.Clip_analysis (in_features, clip_features, out_feature_class, {cluster_tolerance})
+    # arcpy.Dissolve_management (in_features, out_feature_class, {dissolve_field}, {statistics_fields}, {multi_part}, {unsplit_lines})
+    # arcpy.SpatialJoin_analysis (target_features, join_features, out_feature_class, {join_operation}, {join_type}, {field_mapping}, {match_option}, {search_radius}, {distance_field_name})
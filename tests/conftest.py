@@ -0,0 +1,79 @@
+'''
+SHARED FIXTURES FOR THE PCAT TOOL TESTS
+
+The tests run the open engine on a small synthetic landscape from PCAT_Benchmark.py (200 parcels, generated once per
+session), each on its own copy of the files, since the tool writes its output next to the analysis file. The values
+are compared through the metrics table of every run (PCAT_Results.ResultsStore.SaveTable), which keeps the floats at
+full precision.
+
+To run from the command line (needs shapely, fiona, scipy and pytest):
+    python -m pytest -q tests
+
+'''
+import os, sys, glob, shutil
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PCAT_Backends
+import PCAT_Benchmark
+from PCAT_Results import ResultsStore
+import TNC_ArcPyConservationTool as PCAT
+
+
+# Number of parcels of the test landscape
+Parcels = 200
+
+
+# Copies the files of the three landscape layers into Folder; returns (context file, analysis file, exclusion file) of the copy
+def CopyLandscape_Fnx(Landscape, Folder):
+    for LayerFile in Landscape:
+        for File in glob.glob(os.path.splitext(LayerFile)[0] + ".*"):
+            shutil.copy(File, Folder)
+    return [os.path.join(Folder, os.path.basename(File)) for File in Landscape]
+
+
+# Runs the tool with the open engine on the files of Landscape (already in their own folder); returns (the output file, the ResultsStore of the metrics table)
+def RunTool_Fnx(Landscape, **Parameters):
+    ContextFile, AnalysisFile, ExclusionFile = Landscape
+    MetricsTable = os.path.join(os.path.dirname(AnalysisFile), "metrics.csv")
+    Output = PCAT.RunPCAT_Fnx(ContextFile, AnalysisFile, ExclusionFile, Engine="open", MetricsTable=MetricsTable, **Parameters)
+    return Output, ResultsStore.LoadTable(MetricsTable)
+
+
+# Asserts that Results has the values of Expected for every field of Expected (for the sites of Results only, when it holds fewer)
+def AssertSameMetrics_Fnx(Results, Expected, FieldNames=None):
+    Positions = Expected.Positions(Results.MatchIDs)
+    for FieldName in FieldNames or Expected.FieldNames():
+        Values, ExpectedValues = Results.Get(FieldName), Expected.Get(FieldName)[Positions]
+        if FieldName == "Con_Score":
+            numpy.testing.assert_array_equal(Values, ExpectedValues, err_msg=FieldName)
+        else:
+            numpy.testing.assert_allclose(Values.astype(float), ExpectedValues.astype(float), rtol=1e-9, atol=1e-9, err_msg=FieldName)
+
+
+@pytest.fixture(autouse=True)
+def QuietMessages(monkeypatch):
+    monkeypatch.setattr(PCAT_Backends, "ShowMessages", False)
+
+
+@pytest.fixture(scope="session")
+def Landscape(tmp_path_factory):
+    return PCAT_Benchmark.SyntheticLandscape_Fnx(str(tmp_path_factory.mktemp("landscape")), Parcels)
+
+
+# A fresh copy of the landscape in the test's own folder
+@pytest.fixture
+def LandscapeCopy(Landscape, tmp_path):
+    return CopyLandscape_Fnx(Landscape, str(tmp_path))
+
+
+# The metrics of a normal run (vector connectivity, every site at once), which the other modes are compared with
+@pytest.fixture(scope="session")
+def FullRun(Landscape, tmp_path_factory):
+    PCAT_Backends.ShowMessages = False
+    try:
+        return RunTool_Fnx(CopyLandscape_Fnx(Landscape, str(tmp_path_factory.mktemp("full"))))[1]
+    finally:
+        PCAT_Backends.ShowMessages = True
@@ -0,0 +1,80 @@
+'''
+Every mode that claims the values of a normal run (see the docstrings of PCAT_Parallel.py, PCAT_Streaming.py,
+PCAT_TopK.py, PCAT_Checkpoint.py, PCAT_Cache.py and PCAT_GapGraph.py) against the normal run of the same landscape.
+'''
+import os
+import fiona
+import numpy
+import pytest
+
+import TNC_ArcPyConservationTool as PCAT
+from conftest import Parcels, CopyLandscape_Fnx, RunTool_Fnx, AssertSameMetrics_Fnx
+
+
+def test_TiledMatchesSerial(LandscapeCopy, FullRun):
+    Output, Results = RunTool_Fnx(LandscapeCopy, Workers=2, Tiles=4)
+    assert len(Results) == Parcels
+    AssertSameMetrics_Fnx(Results, FullRun)
+
+
+def test_ChunkedMatchesFull(LandscapeCopy, FullRun):
+    Output, Results = RunTool_Fnx(LandscapeCopy, ChunkSize=50)
+    assert len(Results) == Parcels
+    AssertSameMetrics_Fnx(Results, FullRun)
+
+
+def test_TopKMatchesFullRanking(LandscapeCopy, FullRun):
+    TopK = 10
+    Output, Results = RunTool_Fnx(LandscapeCopy, TopK=TopK)
+    # The full ranking: best final score first, then lowest Match_ID (as in PCAT_TopK.py)
+    Expected = FullRun.MatchIDs[numpy.lexsort((FullRun.MatchIDs, -FullRun.Get("PCAT_Scr")))][:TopK]
+    numpy.testing.assert_array_equal(Results.MatchIDs[numpy.argsort(Results.Get(PCAT.RankField[0]))], Expected)
+    AssertSameMetrics_Fnx(Results, FullRun)
+
+
+def test_ResumeMatchesFullRun(LandscapeCopy, FullRun, monkeypatch):
+    def Fail(*Arguments, **Keywords):
+        raise RuntimeError("stopped")
+
+    # A run that stops after every stage but the final score has been recorded
+    with monkeypatch.context() as patch:
+        patch.setattr(PCAT, "FinalScore_Fnx", Fail)
+        with pytest.raises(RuntimeError):
+            RunTool_Fnx(LandscapeCopy, Checkpoints=True)
+
+    # The resumed run must take the recorded stages from the checkpoint instead of calculating them
+    monkeypatch.setattr(PCAT, "SiteMetrics_Fnx", Fail)
+    monkeypatch.setattr(PCAT, "Connectivity_Fnx", Fail)
+    Output, Results = RunTool_Fnx(LandscapeCopy, Resume=True)
+    AssertSameMetrics_Fnx(Results, FullRun)
+
+
+def test_MetricsCacheMatchesFreshRun(LandscapeCopy, tmp_path, monkeypatch):
+    MetricsCacheFile = os.path.join(os.path.dirname(LandscapeCopy[0]), "metrics_cache.sqlite")
+    RunTool_Fnx(LandscapeCopy, MetricsCacheFile=MetricsCacheFile)
+
+    # Removing one context patch, which changes the sites near it only
+    with fiona.open(LandscapeCopy[0]) as source:
+        Schema, Crs, Driver = source.schema, source.crs, source.driver
+        Features = list(source)[1:]
+    with fiona.open(LandscapeCopy[0], "w", driver=Driver, crs=Crs, schema=Schema) as sink:
+        sink.writerecords(Features)
+    FreshFolder = tmp_path / "fresh"
+    FreshFolder.mkdir()
+    Fresh = RunTool_Fnx(CopyLandscape_Fnx(LandscapeCopy, str(FreshFolder)))[1]
+
+    # The cached run only calculates the sites that the change can reach, with the values of the fresh run
+    Calculated = []
+    SiteMetrics = PCAT.SiteMetrics_Fnx
+    def CountingSiteMetrics(Backend, SiteLayer, *Arguments, **Keywords):
+        Calculated.append(len(SiteLayer))
+        return SiteMetrics(Backend, SiteLayer, *Arguments, **Keywords)
+    monkeypatch.setattr(PCAT, "SiteMetrics_Fnx", CountingSiteMetrics)
+    Output, Results = RunTool_Fnx(LandscapeCopy, MetricsCacheFile=MetricsCacheFile)
+    assert 0 < sum(Calculated) < Parcels
+    AssertSameMetrics_Fnx(Results, Fresh)
+
+
+def test_GapGraphMatchesVector(LandscapeCopy, FullRun):
+    Output, Results = RunTool_Fnx(LandscapeCopy, ConnectivityMethod="graph")
+    AssertSameMetrics_Fnx(Results, FullRun)
@@ -0,0 +1,68 @@
+'''
+The open engine against a plain Shapely calculation of every output field, written from the definitions in
+TNC_ArcPyConservationTool.py (the same buffers, with OpenBackend.QuadSegs segments per quarter circle).
+'''
+import fiona
+import numpy
+import shapely
+import shapely.geometry
+
+import PCAT_Backends
+import TNC_ArcPyConservationTool as PCAT
+
+
+def _ReadGeometries(FileName):
+    with fiona.open(FileName) as source:
+        return [shapely.geometry.shape(feature["geometry"]) for feature in source]
+
+
+def _Percent(Part, Whole):
+    return 100.0 * Part / Whole if Whole > 0 else 0.0
+
+
+# Every output field of every site, by Match_ID (the position of the site in the analysis file, plus one)
+def ReferenceMetrics_Fnx(ContextFile, AnalysisFile, ExclusionFile, Width):
+    Sites, Context, Exclusion = _ReadGeometries(AnalysisFile), _ReadGeometries(ContextFile), _ReadGeometries(ExclusionFile)
+    QuadSegs = PCAT_Backends.OpenBackend.QuadSegs
+    WidthMeters = PCAT_Backends.LinearUnitToMeters_Fnx(Width)
+    ExclusionUnion = shapely.union_all(Exclusion)
+    ContextNoExclusion = [Polygon.difference(ExclusionUnion) for Polygon in Context]
+
+    # The narrow areas: the negative space minus its opening by the width, inside the convex hull of the context
+    ConvexHull = shapely.convex_hull(shapely.multipoints(shapely.get_coordinates(Context)))
+    StudyArea = ConvexHull.buffer(PCAT_Backends.LinearUnitToMeters_Fnx(PCAT.StudyAreaBuffer), quad_segs=QuadSegs)
+    NegativeSpace = StudyArea.difference(shapely.union_all(Context))
+    Opening = NegativeSpace.buffer(-WidthMeters, quad_segs=QuadSegs).buffer(WidthMeters, quad_segs=QuadSegs)
+    NarrowAreas = NegativeSpace.difference(Opening).intersection(ConvexHull)
+    NearAreas = NarrowAreas.buffer(WidthMeters, quad_segs=QuadSegs).difference(NarrowAreas)
+
+    Metrics = {}
+    for MatchID, Site in enumerate(Sites, 1):
+        Values = {"SP_Acr": Site.area / PCAT_Backends.SquareMetersPerAcre}
+        Perimeter = Site.boundary.difference(ExclusionUnion)
+        Shared = sum(Perimeter.intersection(Polygon).length for Polygon in ContextNoExclusion)
+        Values["SP_Lng"], Values["SP_Adj_Pct"] = Perimeter.length, _Percent(Shared, Perimeter.length)
+        for BuffDist, AreaFieldName, ContextAreaFieldName, PercentContextFieldName in PCAT.BuffRings:
+            Ring = Site.buffer(PCAT_Backends.LinearUnitToMeters_Fnx(BuffDist), quad_segs=QuadSegs).difference(Site).difference(ExclusionUnion)
+            RingAcres = Ring.area / PCAT_Backends.SquareMetersPerAcre
+            ContextAcres = sum(Ring.intersection(Polygon).area for Polygon in ContextNoExclusion) / PCAT_Backends.SquareMetersPerAcre
+            Values[AreaFieldName], Values[ContextAreaFieldName], Values[PercentContextFieldName] = RingAcres, ContextAcres, _Percent(ContextAcres, RingAcres)
+        Values["Con_Score"] = 5 if Site.intersects(NarrowAreas) else 1 if Site.intersects(NearAreas) else 0
+        Values["PCAT_Scr"] = sum(Values[FieldName] * Weight for FieldName, Weight in PCAT.ScoreWeights)
+        Metrics[MatchID] = Values
+    return Metrics
+
+
+def test_OpenEngineMatchesShapelyReference(Landscape, FullRun):
+    Reference = ReferenceMetrics_Fnx(Landscape[0], Landscape[1], Landscape[2], "25 Meters")
+    assert sorted(Reference) == FullRun.MatchIDs.tolist()
+
+    for FieldName in Reference[1]:
+        Expected = numpy.array([Reference[MatchID][FieldName] for MatchID in FullRun.MatchIDs])
+        if FieldName == "Con_Score":
+            numpy.testing.assert_array_equal(FullRun.Get(FieldName), Expected, err_msg=FieldName)
+        else:
+            # (the overlays of the engine run feature by feature, so only the order of the floating point sums differs)
+            numpy.testing.assert_allclose(FullRun.Get(FieldName).astype(float), Expected, rtol=1e-6, atol=1e-6, err_msg=FieldName)
+    # (a landscape where every site scores the same would not check the connectivity)
+    assert {0, 5} <= set(Values["Con_Score"] for Values in Reference.values())